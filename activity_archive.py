@@ -0,0 +1,175 @@
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet archival is optional; sealed SQLite partitions work without it
+    pa = None
+
+# One row per prompt: the activity, its prompt and the list of its responses
+ARCHIVE_COLUMNS = (
+    'activity_id', 'user_id', 'activity_type', 'activity_timestamp',
+    'detail_id', 'prompt', 'prompt_timestamp', 'responses',
+)
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Parquet archival needs the pyarrow package")
+
+
+def _schema():
+    return pa.schema([
+        ('activity_id', pa.string()),
+        ('user_id', pa.string()),
+        ('activity_type', pa.string()),
+        ('activity_timestamp', pa.string()),
+        ('detail_id', pa.string()),
+        ('prompt', pa.string()),
+        ('prompt_timestamp', pa.string()),
+        ('responses', pa.list_(pa.string())),
+    ])
+
+
+def write_month(directory, month, rows, compression='zstd'):
+    """Write one month of activity as a Parquet file
+
+    Files are laid out as ``<directory>/month=YYYY-MM/activity.parquet`` so
+    readers can skip whole months from the path alone. The file is written
+    under a temporary name and renamed, so a crash never leaves a partial
+    file where a reader would find it.
+
+    Args:
+        directory (str): Root of the archive
+        month (str): The month, as YYYY-MM
+        rows (list): Tuples in ARCHIVE_COLUMNS order; responses is a list of strings
+        compression (str, optional): Parquet codec. Defaults to 'zstd'.
+
+    Returns:
+        str: Path of the written file
+    """
+    _require_pyarrow()
+    month_dir = os.path.join(directory, f"month={month}")
+    os.makedirs(month_dir, exist_ok=True)
+    path = os.path.join(month_dir, "activity.parquet")
+    # Dataset discovery skips names starting with '_'
+    tmp_path = os.path.join(month_dir, "_activity.parquet.tmp")
+
+    columns = list(zip(*rows)) if rows else [[] for _ in ARCHIVE_COLUMNS]
+    table = pa.Table.from_arrays([pa.array(list(column), type=field.type)
+                                  for column, field in zip(columns, _schema())], schema=_schema())
+    # Sorted by user so per-user filters can skip row groups by their statistics
+    table = table.sort_by([('user_id', 'ascending'), ('activity_timestamp', 'ascending')])
+    pq.write_table(table, tmp_path, compression=compression, row_group_size=64 * 1024)
+    os.replace(tmp_path, path)
+    return path
+
+
+class ActivityArchive:
+    """Read-only analytics over the Parquet activity archive
+
+    Queries run directly on the Parquet files through pyarrow datasets.
+    Month filters prune whole directories, other filters are pushed down to
+    row groups, and only the requested columns are read, so nothing is loaded
+    into SQLite.
+    """
+
+    def __init__(self, directory="activity_archive"):
+        """Initialize the reader
+
+        Args:
+            directory (str, optional): Root of the archive. Defaults to "activity_archive".
+        """
+        _require_pyarrow()
+        self.directory = directory
+
+    def _dataset(self):
+        partitioning = ds.partitioning(pa.schema([('month', pa.string())]), flavor='hive')
+        return ds.dataset(self.directory, format='parquet', partitioning=partitioning)
+
+    def _filter(self, start_month, end_month, user_id, activity_type):
+        conditions = []
+        if start_month:
+            conditions.append(ds.field('month') >= start_month)
+        if end_month:
+            conditions.append(ds.field('month') <= end_month)
+        if user_id:
+            conditions.append(ds.field('user_id') == user_id)
+        if activity_type:
+            conditions.append(ds.field('activity_type') == activity_type)
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def scan(self, columns=None, start_month=None, end_month=None, user_id=None, activity_type=None):
+        """Read matching archived rows
+
+        Args:
+            columns (list, optional): Columns to read, from ARCHIVE_COLUMNS plus 'month'. Defaults to all.
+            start_month (str, optional): First month to include, YYYY-MM. Defaults to None.
+            end_month (str, optional): Last month to include, YYYY-MM. Defaults to None.
+            user_id (str, optional): Only this user's activity. Defaults to None.
+            activity_type (str, optional): Only this activity type. Defaults to None.
+
+        Returns:
+            pyarrow.Table: The matching rows
+        """
+        if not os.path.isdir(self.directory):
+            return _schema().empty_table()
+        return self._dataset().to_table(
+            columns=list(columns) if columns else None,
+            filter=self._filter(start_month, end_month, user_id, activity_type),
+        )
+
+    def rows(self, limit=1000, columns=None, start_month=None, end_month=None, user_id=None, activity_type=None):
+        """Read up to ``limit`` matching archived rows as dicts, stopping once enough are found
+
+        Args:
+            limit (int, optional): Maximum rows returned. Defaults to 1000.
+            columns, start_month, end_month, user_id, activity_type: As for scan()
+
+        Returns:
+            list: One dict per row
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return self._dataset().head(
+            limit,
+            columns=list(columns) if columns else None,
+            filter=self._filter(start_month, end_month, user_id, activity_type),
+        ).to_pylist()
+
+    def count_by(self, keys=('activity_type',), start_month=None, end_month=None, user_id=None, activity_type=None):
+        """Count archived prompts grouped by one or more columns
+
+        Args:
+            keys (tuple, optional): Grouping columns, e.g. ('month', 'activity_type'). Defaults to ('activity_type',).
+            start_month, end_month, user_id, activity_type: Filters, as for scan()
+
+        Returns:
+            list: Dicts holding the key columns and 'count', largest first
+        """
+        keys = list(keys)
+        table = self.scan(columns=keys + ['detail_id'], start_month=start_month, end_month=end_month,
+                          user_id=user_id, activity_type=activity_type)
+        if table.num_rows == 0:
+            return []
+        grouped = table.group_by(keys).aggregate([('detail_id', 'count')])
+        grouped = grouped.rename_columns(['count' if name == 'detail_id_count' else name
+                                          for name in grouped.column_names])
+        order = pc.sort_indices(grouped, sort_keys=[('count', 'descending')])
+        return grouped.take(order).to_pylist()
+
+    def months(self):
+        """List the archived months
+
+        Returns:
+            list: Month strings, oldest first
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[len('month='):] for name in os.listdir(self.directory)
+                      if name.startswith('month=') and os.path.exists(os.path.join(self.directory, name, 'activity.parquet')))
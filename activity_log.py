@@ -0,0 +1,306 @@
+import sqlite3
+import uuid
+import queue
+import atexit
+import threading
+import time
+import logging
+from datetime import datetime
+
+# What submit() does when the queue is full
+OVERFLOW_POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+
+class _FlushMarker:
+    """Queued by flush(); the writer sets it once everything before it is committed"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class ActivityWriter:
+    """Write-behind logger for user activity
+
+    Request threads turn each activity into rows and put them on a bounded
+    queue. A single writer thread drains the queue and inserts everything it
+    collected with executemany in one transaction. It commits once
+    ``batch_size`` events are pending or ``flush_interval`` seconds after the
+    first one arrived, whichever comes first. Under heavy load that is one
+    commit per batch instead of one per request.
+
+    With a BlobStore, prompts and responses are hashed and compressed in the
+    request thread and written as content_blobs rows, so repeated texts are
+    stored once and the activity rows only carry their hash.
+
+    Queued events are lost if the process is killed before they are written.
+    They are flushed on interpreter exit and by close().
+    """
+
+    def __init__(self, pool, max_queue=10000, batch_size=500, flush_interval=0.05,
+                 overflow='block', block_timeout=1.0, blobs=None):
+        """Initialize the writer; the thread starts on the first submit
+
+        Args:
+            pool (ConnectionPool): Pool the writer thread takes its connection from
+            max_queue (int, optional): Maximum queued events. Defaults to 10000.
+            batch_size (int, optional): Events per group commit. Defaults to 500.
+            flush_interval (float, optional): Maximum seconds an event waits for its batch. Defaults to 0.05.
+            overflow (str, optional): One of OVERFLOW_POLICIES. Defaults to 'block'.
+            block_timeout (float, optional): Seconds 'block' waits before dropping. Defaults to 1.0.
+            blobs (BlobStore, optional): Store texts as deduplicated blobs. Defaults to None (inline text).
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.blobs = blobs
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+
+        # Metrics
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.total_commit_time = 0.0
+        self.max_commit_time = 0.0
+        self.last_commit_time = 0.0
+
+    def submit(self, user_id, activity_type, prompt, response=None):
+        """Queue one activity for writing
+
+        Args:
+            user_id (str): The ID of the user
+            activity_type (str): The type of activity
+            prompt (str): The prompt text
+            response (str or list, optional): One response or a list of responses. Defaults to None.
+
+        Returns:
+            str: The activity ID, or None if the event was dropped
+        """
+        activity_id = str(uuid.uuid4())
+        detail_id = str(uuid.uuid4())
+        now = datetime.now().isoformat()
+        if not response:
+            response = []
+        elif not isinstance(response, list):
+            response = [response]
+
+        blob_rows = []
+        if self.blobs is not None:
+            # Compress here, in parallel request threads, not in the single writer
+            prompt_blob = self.blobs.encode(prompt, compress=False)
+            blob_rows.append(prompt_blob)
+            detail = (detail_id, activity_id, '', now, str(uuid.uuid4()), prompt_blob[0])
+            responses = []
+            for resp in response:
+                response_blob = self.blobs.encode(resp)
+                blob_rows.append(response_blob)
+                responses.append((str(uuid.uuid4()), detail_id, '', response_blob[0]))
+        else:
+            detail = (detail_id, activity_id, prompt, now, str(uuid.uuid4()), None)
+            responses = [(str(uuid.uuid4()), detail_id, resp, None) for resp in response]
+        event = (
+            (activity_id, user_id, activity_type, now, activity_id),
+            detail,
+            tuple(responses),
+            tuple(blob_rows),
+        )
+
+        self._ensure_started()
+        if not self._put(event):
+            with self._stats_lock:
+                self.dropped += 1
+            return None
+        with self._stats_lock:
+            self.enqueued += 1
+        return activity_id
+
+    def _put(self, event):
+        """Enqueue according to the overflow policy; False means the event was dropped"""
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow == 'block':
+            try:
+                self._queue.put(event, timeout=self.block_timeout)
+                return True
+            except queue.Full:
+                return False
+        if self.overflow == 'drop_oldest':
+            # Bounded, so a queue holding only flush markers cannot spin us forever
+            for _ in range(self._queue.maxsize + 1):
+                try:
+                    oldest = self._queue.get_nowait()
+                except queue.Empty:
+                    oldest = None
+                if isinstance(oldest, _FlushMarker):
+                    # Never drop a flush request; requeue it behind us instead
+                    try:
+                        self._queue.put_nowait(oldest)
+                    except queue.Full:
+                        # Another thread took the slot; that flush() times out rather than blocking us
+                        logging.warning("Activity queue full, a flush request was lost")
+                elif oldest is not None:
+                    with self._stats_lock:
+                        self.dropped += 1
+                try:
+                    self._queue.put_nowait(event)
+                    return True
+                except queue.Full:
+                    continue
+        return False
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='activity-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            batch, markers = [], []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if isinstance(item, _FlushMarker):
+                    markers.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write_batch(batch)
+            for marker in markers:
+                marker.done.set()
+
+    def _write_batch(self, batch):
+        """Insert a batch of events in one transaction
+
+        If the batch fails, each event is retried in its own transaction so
+        that one bad row only costs its own event.
+        """
+        start = time.perf_counter()
+        try:
+            with self.pool.connection() as conn:
+                self._insert(conn, batch)
+        except sqlite3.Error as e:
+            logging.error(f"Error writing activity batch of {len(batch)}, retrying one by one: {str(e)}")
+            written = 0
+            for event in batch:
+                try:
+                    with self.pool.connection() as conn:
+                        self._insert(conn, [event])
+                    written += 1
+                except sqlite3.Error as e:
+                    logging.error(f"Error writing activity for user {event[0][1]}: {str(e)}")
+            with self._stats_lock:
+                self.written += written
+                self.failed += len(batch) - written
+                self.batches += 1
+            return
+
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self.written += len(batch)
+            self.batches += 1
+            self.last_commit_time = elapsed
+            self.total_commit_time += elapsed
+            self.max_commit_time = max(self.max_commit_time, elapsed)
+
+    def _insert(self, conn, events):
+        """Write events and commit, rolling back on error"""
+        activities = [event[0] for event in events]
+        details = [event[1] for event in events]
+        responses = [resp for event in events for resp in event[2]]
+        blob_rows = [row for event in events for row in event[3]]
+        try:
+            # Blobs first, so the activity rows' triggers can count references
+            if blob_rows:
+                self.blobs.store(conn, blob_rows)
+            conn.executemany('''
+            INSERT INTO user_activity (id, user_id, activity_type, activity_timestamp, activity_id)
+            VALUES (?, ?, ?, ?, ?)
+            ''', activities)
+            conn.executemany('''
+            INSERT INTO activity_details (id, activity_id, prompt, prompt_timestamp, prompt_id, prompt_hash)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', details)
+            if responses:
+                conn.executemany('''
+                INSERT INTO activity_responses (id, activity_detail_id, response, response_hash)
+                VALUES (?, ?, ?, ?)
+                ''', responses)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+    def flush(self, timeout=10.0):
+        """Block until every event queued before this call has been written
+
+        Returns:
+            bool: True if flushed, False on timeout or if the writer is not running
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return self._queue.empty()
+        marker = _FlushMarker()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.done.wait(timeout)
+
+    def close(self, timeout=10.0):
+        """Flush pending events and stop the writer thread"""
+        if self._thread is None:
+            return
+        self.flush(timeout)
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        atexit.unregister(self.close)
+
+    def stats(self):
+        """Get queue depth, drop counts and commit latency"""
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'written': self.written,
+                'failed': self.failed,
+                'batches': self.batches,
+                'avg_batch_size': self.written / self.batches if self.batches else 0.0,
+                'last_commit_time': self.last_commit_time,
+                'avg_commit_time': self.total_commit_time / self.batches if self.batches else 0.0,
+                'max_commit_time': self.max_commit_time,
+            }
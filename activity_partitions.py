@@ -0,0 +1,398 @@
+"""
+Monthly partitions for the activity tables.
+
+    python activity_partitions.py [database.db] [--seal] [--archive] [--hot-months 6] [--retention-months 24]
+"""
+
+import os
+import sys
+import sqlite3
+import logging
+import argparse
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+import activity_archive
+
+# Schema of a sealed partition file: the live tables with texts stored inline
+_PARTITION_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS user_activity (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    activity_type TEXT NOT NULL,
+    activity_timestamp TEXT NOT NULL,
+    activity_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS activity_details (
+    id TEXT PRIMARY KEY,
+    activity_id TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    prompt_timestamp TEXT NOT NULL,
+    prompt_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS activity_responses (
+    id TEXT PRIMARY KEY,
+    activity_detail_id TEXT NOT NULL,
+    response TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_user_activity_user_id ON user_activity (user_id, activity_timestamp);
+CREATE INDEX IF NOT EXISTS idx_user_activity_timestamp ON user_activity (activity_timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_activity_details_activity ON activity_details (activity_id);
+CREATE INDEX IF NOT EXISTS idx_activity_responses_detail ON activity_responses (activity_detail_id);
+'''
+
+
+def month_of(timestamp):
+    """The YYYY-MM month of an ISO timestamp"""
+    return timestamp[:7]
+
+
+def add_months(month, count):
+    """Shift a YYYY-MM month by ``count`` months (may be negative)"""
+    year, month_number = int(month[:4]), int(month[5:7])
+    index = year * 12 + month_number - 1 + count
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+class ActivityPartitions:
+    """Monthly partitioning of user_activity, activity_details and activity_responses
+
+    The live tables hold the hot months, which the activity writer, prompt
+    search and blob store work on unchanged. seal() moves one past month
+    into its own SQLite file, with texts resolved out of the blob store, and
+    records it in the activity_partitions catalog. archive() turns a sealed
+    month into a Parquet file and drops the SQLite file; those months are
+    read with activity_archive.ActivityArchive.
+
+    open_view() gives a connection whose temporary views all_user_activity,
+    all_activity_details and all_activity_responses span the live tables and
+    the sealed months in a range. Only the months in the range are attached.
+    Sealed months are no longer covered by prompt search.
+    """
+
+    def __init__(self, db_path, pool, blobs, directory="activity_partitions",
+                 archive_directory="activity_archive", hot_months=6, retention_months=24):
+        """Initialize the partition manager
+
+        Args:
+            db_path (str): Path of the main database, for open_view()
+            pool (ConnectionPool): Pool for the main database
+            blobs (BlobStore): Resolves texts stored as blobs
+            directory (str, optional): Where sealed month files go. Defaults to "activity_partitions".
+            archive_directory (str, optional): Root of the Parquet archive. Defaults to "activity_archive".
+            hot_months (int, optional): Months kept in the live tables, the current one included. Defaults to 6.
+            retention_months (int, optional): Age in months after which a sealed month is archived. Defaults to 24.
+        """
+        self.db_path = db_path
+        self.pool = pool
+        self.blobs = blobs
+        self.directory = directory
+        self.archive_directory = archive_directory
+        self.hot_months = hot_months
+        self.retention_months = retention_months
+
+    def _partition_path(self, month):
+        return os.path.join(self.directory, f"activity_{month.replace('-', '_')}.db")
+
+    def _set_catalog(self, month, **fields):
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        with self.pool.connection() as conn:
+            conn.execute(f"UPDATE activity_partitions SET {columns} WHERE month = ?", list(fields.values()) + [month])
+            conn.commit()
+
+    def partitions(self):
+        """List the catalog
+
+        Returns:
+            list: Dicts with month, state ('sealing', 'sealed' or 'archived'), path and row counts
+        """
+        try:
+            with self.pool.connection() as conn:
+                rows = conn.execute('''
+                SELECT month, state, path, activities, details, responses, bytes, sealed_at, archived_at
+                FROM activity_partitions ORDER BY month
+                ''').fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Error listing activity partitions: {str(e)}")
+            return []
+        keys = ('month', 'state', 'path', 'activities', 'details', 'responses', 'bytes', 'sealed_at', 'archived_at')
+        return [dict(zip(keys, row)) for row in rows]
+
+    # Sealing
+
+    def seal(self, month, batch_size=1000):
+        """Move one month out of the live tables into its partition file
+
+        Rows are copied in batches; each batch is committed to the partition
+        file before it is deleted from the live tables, so an interrupted
+        run loses nothing and simply seals the rest when run again.
+
+        Args:
+            month (str): The month, as YYYY-MM; must be older than the hot window
+            batch_size (int, optional): Activities per batch. Defaults to 1000.
+
+        Returns:
+            int: Number of activities moved
+
+        Raises:
+            ValueError: If the month is still hot or has already been archived
+        """
+        if month >= add_months(datetime.now().strftime('%Y-%m'), 1 - self.hot_months):
+            raise ValueError(f"Month {month} is still within the {self.hot_months} hot months")
+
+        path = self._partition_path(month)
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT state FROM activity_partitions WHERE month = ?", (month,)).fetchone()
+            if row and row[0] == 'archived':
+                raise ValueError(f"Month {month} has already been archived")
+            conn.execute('''
+            INSERT INTO activity_partitions (month, state, path) VALUES (?, 'sealing', ?)
+            ON CONFLICT(month) DO UPDATE SET state = 'sealing'
+            ''', (month, path))
+            conn.commit()
+
+        os.makedirs(self.directory, exist_ok=True)
+        part = sqlite3.connect(path)
+        moved = 0
+        try:
+            part.executescript(_PARTITION_SCHEMA)
+            while True:
+                batch = self._read_batch(month, batch_size)
+                if batch is None:
+                    break
+                activities, details, responses = batch
+                part.executemany("INSERT OR IGNORE INTO user_activity VALUES (?, ?, ?, ?, ?)", activities)
+                part.executemany("INSERT OR IGNORE INTO activity_details VALUES (?, ?, ?, ?, ?)", details)
+                part.executemany("INSERT OR IGNORE INTO activity_responses VALUES (?, ?, ?)", responses)
+                part.commit()
+
+                with self.pool.connection() as conn:
+                    conn.executemany("DELETE FROM activity_responses WHERE id = ?", [(r[0],) for r in responses])
+                    conn.executemany("DELETE FROM activity_details WHERE id = ?", [(d[0],) for d in details])
+                    conn.executemany("DELETE FROM user_activity WHERE id = ?", [(a[0],) for a in activities])
+                    conn.commit()
+                moved += len(activities)
+
+            counts = [part.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                      for table in ('user_activity', 'activity_details', 'activity_responses')]
+        finally:
+            part.close()
+
+        self._set_catalog(month, state='sealed', activities=counts[0], details=counts[1], responses=counts[2],
+                          bytes=os.path.getsize(path), sealed_at=datetime.now().isoformat())
+        # The deleted rows released their blob references
+        self.blobs.gc()
+        return moved
+
+    def _read_batch(self, month, batch_size):
+        """Read the next batch of a month from the live tables, texts resolved"""
+        with self.pool.connection() as conn:
+            activities = conn.execute('''
+            SELECT id, user_id, activity_type, activity_timestamp, activity_id FROM user_activity
+            WHERE activity_timestamp >= ? AND activity_timestamp < ?
+            ORDER BY activity_timestamp, id LIMIT ?
+            ''', (month, add_months(month, 1), batch_size)).fetchall()
+            if not activities:
+                return None
+            ids = [activity[0] for activity in activities]
+            details = conn.execute(
+                f"SELECT id, activity_id, prompt, prompt_timestamp, prompt_id, prompt_hash FROM activity_details "
+                f"WHERE activity_id IN ({', '.join('?' * len(ids))})", ids
+            ).fetchall()
+            detail_ids = [detail[0] for detail in details]
+            responses = conn.execute(
+                f"SELECT id, activity_detail_id, response, response_hash FROM activity_responses "
+                f"WHERE activity_detail_id IN ({', '.join('?' * len(detail_ids))})", detail_ids
+            ).fetchall() if detail_ids else []
+
+        texts = self.blobs.get_many([d[5] for d in details] + [r[3] for r in responses])
+
+        def text(inline, digest):
+            if digest is None:
+                return inline
+            resolved = texts.get(bytes(digest))
+            if resolved is None:
+                raise ValueError("A blob referenced by an activity row is missing")
+            return resolved
+
+        details = [(d[0], d[1], text(d[2], d[5]), d[3], d[4]) for d in details]
+        responses = [(r[0], r[1], text(r[2], r[3])) for r in responses]
+        return activities, details, responses
+
+    def seal_expired(self, batch_size=1000):
+        """Seal every month older than the hot window
+
+        Months that have already been archived are skipped with a warning:
+        rows that arrive late for them stay in the live tables, where the
+        unified views and prompt search still see them, and do not hold up
+        the months after them.
+
+        Returns:
+            list: The months sealed
+        """
+        cutoff = add_months(datetime.now().strftime('%Y-%m'), 1 - self.hot_months)
+        archived = {p['month'] for p in self.partitions() if p['state'] == 'archived'}
+        sealed = []
+        month = ''
+        while True:
+            with self.pool.connection() as conn:
+                oldest = conn.execute(
+                    "SELECT MIN(activity_timestamp) FROM user_activity WHERE activity_timestamp >= ?", (month,)
+                ).fetchone()[0]
+            if oldest is None or month_of(oldest) >= cutoff:
+                return sealed
+            month = month_of(oldest)
+            if month in archived:
+                logging.warning(f"Month {month} is already archived; leaving its late activity in the live tables")
+            else:
+                self.seal(month, batch_size)
+                sealed.append(month)
+            month = add_months(month, 1)
+
+    # Archival
+
+    def archive(self, month):
+        """Convert a sealed month into a Parquet file and drop its SQLite file
+
+        Returns:
+            str: Path of the Parquet file
+
+        Raises:
+            ValueError: If the month is not sealed
+            RuntimeError: If pyarrow is not installed
+        """
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT state, path FROM activity_partitions WHERE month = ?", (month,)).fetchone()
+        if row is None or row[0] != 'sealed':
+            raise ValueError(f"Month {month} is not sealed")
+
+        part = sqlite3.connect(row[1])
+        try:
+            responses = {}
+            for detail_id, response in part.execute(
+                "SELECT activity_detail_id, response FROM activity_responses ORDER BY rowid"
+            ):
+                responses.setdefault(detail_id, []).append(response)
+            rows = [record + (responses.get(record[4], []),) for record in part.execute('''
+            SELECT a.id, a.user_id, a.activity_type, a.activity_timestamp, d.id, d.prompt, d.prompt_timestamp
+            FROM user_activity a LEFT JOIN activity_details d ON d.activity_id = a.id
+            ''')]
+        finally:
+            part.close()
+
+        path = activity_archive.write_month(self.archive_directory, month, rows)
+        self._set_catalog(month, state='archived', path=path, bytes=os.path.getsize(path),
+                          archived_at=datetime.now().isoformat())
+        os.remove(row[1])
+        return path
+
+    def archive_expired(self):
+        """Archive every sealed month older than the retention age
+
+        Returns:
+            list: The months archived
+        """
+        cutoff = add_months(datetime.now().strftime('%Y-%m'), -self.retention_months)
+        archived = []
+        for partition in self.partitions():
+            if partition['state'] == 'sealed' and partition['month'] < cutoff:
+                self.archive(partition['month'])
+                archived.append(partition['month'])
+        return archived
+
+    # Querying
+
+    @contextmanager
+    def open_view(self, start_month=None, end_month=None):
+        """Open a read connection with unified views over live and sealed activity
+
+        The temporary views all_user_activity, all_activity_details and
+        all_activity_responses have the columns of the original tables, with
+        prompts and responses as text. Sealed months outside the range are
+        not attached; archived months are read with ActivityArchive instead.
+
+        Args:
+            start_month (str, optional): First sealed month to attach, YYYY-MM. Defaults to None.
+            end_month (str, optional): Last sealed month to attach, YYYY-MM. Defaults to None.
+
+        Yields:
+            sqlite3.Connection: The connection; closed on exit
+
+        Raises:
+            ValueError: If the range needs more attached files than SQLite allows
+        """
+        months = [p for p in self.partitions() if p['state'] == 'sealed'
+                  and (start_month is None or p['month'] >= start_month)
+                  and (end_month is None or p['month'] <= end_month)]
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+            if len(months) > limit:
+                raise ValueError(f"{len(months)} sealed months in range but only {limit} can be attached; narrow the range")
+
+            @functools.lru_cache(maxsize=4096)
+            def blob_text(digest):
+                return self.blobs.get(bytes(digest)) if digest is not None else None
+            conn.create_function('blob_text', 1, blob_text, deterministic=True)
+
+            for i, partition in enumerate(months):
+                conn.execute(f"ATTACH DATABASE ? AS p{i}", (partition['path'],))
+
+            sources = {
+                'all_user_activity': ["SELECT id, user_id, activity_type, activity_timestamp, activity_id FROM main.user_activity"],
+                'all_activity_details': ["SELECT id, activity_id, COALESCE(NULLIF(prompt, ''), blob_text(prompt_hash)) AS prompt, "
+                                         "prompt_timestamp, prompt_id FROM main.activity_details"],
+                'all_activity_responses': ["SELECT id, activity_detail_id, COALESCE(NULLIF(response, ''), blob_text(response_hash)) AS response "
+                                           "FROM main.activity_responses"],
+            }
+            for i in range(len(months)):
+                sources['all_user_activity'].append(
+                    f"SELECT id, user_id, activity_type, activity_timestamp, activity_id FROM p{i}.user_activity")
+                sources['all_activity_details'].append(
+                    f"SELECT id, activity_id, prompt, prompt_timestamp, prompt_id FROM p{i}.activity_details")
+                sources['all_activity_responses'].append(
+                    f"SELECT id, activity_detail_id, response FROM p{i}.activity_responses")
+            for view, selects in sources.items():
+                conn.execute(f"CREATE TEMP VIEW {view} AS " + " UNION ALL ".join(selects))
+            yield conn
+        finally:
+            conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('db_path', nargs='?', default='database.db')
+    parser.add_argument('--seal', action='store_true', help="Seal every month older than the hot window")
+    parser.add_argument('--archive', action='store_true', help="Archive sealed months past the retention age to Parquet")
+    parser.add_argument('--hot-months', type=int, default=6)
+    parser.add_argument('--retention-months', type=int, default=24)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    from db_pool import ConnectionPool
+    from blob_store import BlobStore
+
+    pool = ConnectionPool(args.db_path, size=1)
+    partitions = ActivityPartitions(args.db_path, pool, BlobStore(pool),
+                                    hot_months=args.hot_months, retention_months=args.retention_months)
+    try:
+        if args.seal:
+            for month in partitions.seal_expired(args.batch_size):
+                print(f"Sealed {month}")
+        if args.archive:
+            for month in partitions.archive_expired():
+                print(f"Archived {month}")
+        for partition in partitions.partitions():
+            print(f"{partition['month']}  {partition['state']:<8}  {partition['activities']:>10,} activities  "
+                  f"{partition['bytes'] / 2**20:>9.1f} MiB  {partition['path']}")
+    except (sqlite3.Error, ValueError, RuntimeError) as e:
+        logging.error(f"Error maintaining activity partitions: {str(e)}")
+        return 1
+    finally:
+        pool.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+import hmac
+import hashlib
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+from functools import wraps
+from flask import request, jsonify, session, g
+
+# Number of leading api_key characters stored in the indexed key_prefix
+# column. Lookups go through the prefix, and the full key is then compared
+# in constant time, so the B-tree search never sees the whole key.
+KEY_PREFIX_LENGTH = 12
+
+
+def key_prefix(api_key):
+    return api_key[:KEY_PREFIX_LENGTH]
+
+
+def hash_secret(pepper, api_secret):
+    """HMAC-SHA256 of an API secret keyed with the server pepper"""
+    return hmac.new(pepper, api_secret.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+class ApiKeyAuthenticator:
+    """Verifies API key credentials for programmatic clients
+
+    Secrets are checked against an HMAC-SHA256 keyed with a server pepper,
+    using constant-time comparison. A hash costs about a microsecond, unlike
+    bcrypt or decrypting the stored secret. Successfully verified keys are
+    kept in a bounded LRU for ``cache_ttl`` seconds, so repeat calls skip
+    SQLite; the cache holds the keyed hash, never the secret.
+    delete_api_key invalidates this process's entry immediately. Other
+    processes drop it once the TTL expires.
+
+    Keys created before secret_hash existed are verified once by decrypting
+    api_secret, and their hash is stored for next time.
+    """
+
+    def __init__(self, pool, pepper, keyring=None, cache_size=10000, cache_ttl=30.0):
+        """Initialize the authenticator
+
+        Args:
+            pool (ConnectionPool): Pool used to look keys up
+            pepper (bytes): Server-side HMAC key; never stored in the database
+            keyring (Keyring, optional): Used to verify keys that have no secret_hash yet. Defaults to None.
+            cache_size (int, optional): Maximum cached credentials. Defaults to 10000.
+            cache_ttl (float, optional): Seconds a verified credential stays cached. Defaults to 30.
+        """
+        self.pool = pool
+        self.pepper = pepper
+        self.keyring = keyring
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()     # api_key -> (key_id, user_id, secret_hash, cached_at)
+
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def authenticate(self, api_key, api_secret):
+        """Verify an API key and secret
+
+        Args:
+            api_key (str): The public API key
+            api_secret (str): The secret presented with it
+
+        Returns:
+            dict: {'key_id', 'user_id'} if the credentials are valid, None otherwise
+        """
+        if not api_key or not api_secret:
+            return None
+        presented = hash_secret(self.pepper, api_secret)
+        now = time.monotonic()
+
+        with self._lock:
+            cached = self._cache.get(api_key)
+            if cached is not None and now - cached[3] < self.cache_ttl:
+                self._cache.move_to_end(api_key)
+                if hmac.compare_digest(cached[2], presented):
+                    self.hits += 1
+                    return {'key_id': cached[0], 'user_id': cached[1]}
+                self.failures += 1
+                return None
+            self.misses += 1
+
+        try:
+            row = self._lookup(api_key)
+        except sqlite3.Error as e:
+            logging.error(f"Error verifying API key: {str(e)}")
+            return None
+        if row is None:
+            self.failures += 1
+            return None
+
+        key_id, user_id, secret_hash = row
+        if secret_hash is None or not hmac.compare_digest(secret_hash, presented):
+            self.failures += 1
+            return None
+
+        with self._lock:
+            self._cache[api_key] = (key_id, user_id, secret_hash, now)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return {'key_id': key_id, 'user_id': user_id}
+
+    def _lookup(self, api_key):
+        """Find an active key by prefix and compare the full key in constant time
+
+        Returns:
+            tuple: (key_id, user_id, secret_hash) or None
+        """
+        with self.pool.connection() as conn:
+            rows = conn.execute('''
+            SELECT id, user_id, api_key, secret_hash, api_secret FROM api_keys
+            WHERE key_prefix = ? AND COALESCE(status, 'Active') = 'Active'
+            ''', (key_prefix(api_key),)).fetchall()
+
+            for key_id, user_id, stored_key, secret_hash, api_secret in rows:
+                if not hmac.compare_digest(stored_key.encode(), api_key.encode()):
+                    continue
+                if secret_hash is None:
+                    secret_hash = self._upgrade(conn, key_id, api_secret)
+                return key_id, user_id, secret_hash
+        return None
+
+    def _upgrade(self, conn, key_id, api_secret):
+        """Compute and store secret_hash for a key created before it existed"""
+        if self.keyring is None or not api_secret:
+            return None
+        try:
+            secret_hash = hash_secret(self.pepper, self.keyring.decrypt(api_secret))
+        except Exception:
+            # bcrypt-hashed secrets cannot be recovered; the key must be reissued
+            return None
+        conn.execute("UPDATE api_keys SET secret_hash = ? WHERE id = ?", (secret_hash, key_id))
+        conn.commit()
+        return secret_hash
+
+    def invalidate(self, key_id):
+        """Drop a key from the cache after it was deleted or disabled"""
+        with self._lock:
+            for api_key in [k for k, entry in self._cache.items() if entry[0] == key_id]:
+                del self._cache[api_key]
+
+    def stats(self):
+        """Get cache hit/miss and failure counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'cached_keys': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'failures': self.failures,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+def get_api_credentials():
+    """Read API credentials from the request
+
+    Accepts ``Authorization: Bearer <api_key>.<api_secret>`` or the
+    ``X-API-Key`` and ``X-API-Secret`` headers.
+
+    Returns:
+        tuple: (api_key, api_secret), either of which may be None
+    """
+    auth = request.headers.get('Authorization', '')
+    if auth.startswith('Bearer '):
+        api_key, _, api_secret = auth[7:].strip().partition('.')
+        return api_key or None, api_secret or None
+    return request.headers.get('X-API-Key'), request.headers.get('X-API-Secret')
+
+
+def api_key_required(authenticator, allow_session=True):
+    """Decorator for /api/* routes used by programmatic clients
+
+    On success ``g.user_id`` is set, and ``g.api_key_id`` is set too when an
+    API key was used. A logged-in browser session is accepted as well unless
+    ``allow_session`` is False.
+
+    Args:
+        authenticator (callable): Returns the ApiKeyAuthenticator to use; resolved per request
+        allow_session (bool, optional): Accept a session cookie instead of a key. Defaults to True.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            api_key, api_secret = get_api_credentials()
+            if api_key or api_secret:
+                verified = authenticator().authenticate(api_key, api_secret)
+                if not verified:
+                    response = jsonify({'success': False, 'message': 'Invalid API credentials'})
+                    response.status_code = 401
+                    response.headers['WWW-Authenticate'] = 'Bearer'
+                    return response
+                g.user_id = verified['user_id']
+                g.api_key_id = verified['key_id']
+            elif allow_session and 'user_id' in session:
+                g.user_id = session['user_id']
+                g.api_key_id = None
+            else:
+                response = jsonify({'success': False, 'message': 'Authentication required'})
+                response.status_code = 401
+                response.headers['WWW-Authenticate'] = 'Bearer'
+                return response
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
@@ -4,11 +4,11 @@ import hashlib
 import secrets
 import sqlite3
 from datetime import datetime
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import bcrypt
 from flask import Flask, jsonify, session
+from database import get_db
+from encryption_keys import LEGACY_API_KEY_PASSPHRASE
+from api_key_auth import key_prefix, hash_secret
 
 app = Flask(__name__)
 
@@ -48,65 +48,27 @@ Database schema for reference:
         ''')
 """
 
-# Encryption key (in production, this should be stored securely, not hardcoded)
-ENCRYPTION_KEY = b'your-encryption-key-here'
+# Passphrase of the old salted format; only kept so existing ciphertexts stay readable
+ENCRYPTION_KEY = LEGACY_API_KEY_PASSPHRASE
 
 
-def _derive_key(password, salt, iterations=100000):
-    """Derive a key from a password and salt"""
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=iterations,
-    )
-    return base64.urlsafe_b64encode(kdf.derive(password))
+def _encrypt_sensitive_data(data, key=None):
+    """Encrypt sensitive data with the primary key of the shared keyring
 
-
-def _encrypt_sensitive_data(data, key=ENCRYPTION_KEY):
-    """Encrypt sensitive data"""
+    The ciphertext carries the key version, so decrypting it needs no key
+    derivation.
+    """
     try:
-        if isinstance(data, str):
-            data = data.encode()
-        
-        # Generate a random salt
-        salt = secrets.token_bytes(16)
-        
-        # Derive a key from the password and salt
-        derived_key = _derive_key(key, salt)
-        
-        # Create a Fernet cipher with the derived key
-        cipher = Fernet(derived_key)
-        
-        # Encrypt the data
-        encrypted_data = cipher.encrypt(data)
-        
-        # Combine salt and encrypted data for storage
-        return base64.urlsafe_b64encode(salt + encrypted_data).decode()
+        return get_db().keyring.encrypt(data)
     except Exception as e:
         print(f"Encryption error: {str(e)}")
         raise e
 
 
-def _decrypt_sensitive_data(encrypted_data, key=ENCRYPTION_KEY):
-    """Decrypt sensitive data"""
+def _decrypt_sensitive_data(encrypted_data, key=None):
+    """Decrypt sensitive data written under any keyring version or a legacy format"""
     try:
-        # Decode the combined salt and encrypted data
-        decoded_data = base64.urlsafe_b64decode(encrypted_data.encode())
-        
-        # Extract salt (first 16 bytes) and encrypted data
-        salt, encrypted_data = decoded_data[:16], decoded_data[16:]
-        
-        # Derive the key from the password and salt
-        derived_key = _derive_key(key, salt)
-        
-        # Create a Fernet cipher with the derived key
-        cipher = Fernet(derived_key)
-        
-        # Decrypt the data
-        decrypted_data = cipher.decrypt(encrypted_data)
-        
-        return decrypted_data.decode()
+        return get_db().keyring.decrypt(encrypted_data)
     except Exception as e:
         print(f"Decryption error: {str(e)}")
         raise e
@@ -114,31 +76,23 @@ def _decrypt_sensitive_data(encrypted_data, key=ENCRYPTION_KEY):
 
 def generate_api_key(db_connection, user_id):
     """Generate a new API key for a user"""
-    import bcrypt
-
-    # Generate API key components
-    try:
-        with open('api_key_id.json', 'r') as f:
-            api_key_id = json.load(f)['api_key_id']
-    except FileNotFoundError:
-        api_key_id = '00001'
-    
-    api_key_id = str(int(api_key_id) + 1).zfill(5)
-    
-    with open('api_key_id.json', 'w') as f:
-        json.dump({'api_key_id': api_key_id}, f)
+    # Generate API key components; the id comes from the shared DB sequence
+    api_key_id = str(get_db().api_key_ids.next_id()).zfill(5)
     api_key = secrets.token_urlsafe(32)
     api_secret = secrets.token_urlsafe(64)
 
-    # Hash the API secret
-    hashed_secret = bcrypt.hashpw(api_secret.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    # Encrypt the secret so it can be revealed again, and store its peppered
+    # hash for authentication
+    encrypted_secret = _encrypt_sensitive_data(api_secret)
+    secret_hash = hash_secret(get_db().api_key_auth.pepper, api_secret)
 
     # Store in database
     cursor = db_connection.cursor()
     cursor.execute('''
-        INSERT INTO api_keys (id, user_id, api_key, api_secret, api_id, created_at, status)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (api_key_id, user_id, api_key, hashed_secret, api_key_id, datetime.now().isoformat(), 'Active'))
+        INSERT INTO api_keys (id, user_id, api_key, api_secret, api_id, created_at, status, key_prefix, secret_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (api_key_id, user_id, api_key, encrypted_secret, api_key_id, datetime.now().isoformat(), 'Active',
+          key_prefix(api_key), secret_hash))
 
     db_connection.commit()
 
@@ -235,6 +189,7 @@ def delete_api_key(db_connection, api_key_id, user_id):
         ''', (api_key_id,))
         
         db_connection.commit()
+        get_db().api_key_auth.invalidate(api_key_id)
         return True
     except sqlite3.Error as e:
         db_connection.rollback()
@@ -248,7 +203,8 @@ def generate_key():
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     
     user_id = session['user_id']
-    api_key = generate_api_key(auth_handler.db.conn, user_id)
+    with get_db().connection() as conn:
+        api_key = generate_api_key(conn, user_id)
     
     if api_key:
         return jsonify({'success': True, 'api_key': api_key})
@@ -0,0 +1,57 @@
+"""
+Benchmark: API key provisioning
+
+Compares creating keys one at a time through create_api_key, which does one
+commit per key, with create_api_keys, which creates a whole batch in one
+transaction with ids from a DB-backed block allocator.
+
+    python benchmarks/bench_api_key_provisioning.py [--keys 10000] [--single 1000]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--keys', type=int, default=10000, help='keys created by one bulk call')
+    parser.add_argument('--single', type=int, default=1000, help='keys created one at a time')
+    parser.add_argument('--users', type=int, default=100)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_provisioning_')
+    os.chdir(workdir)
+
+    from database import Database
+    from migrations import apply_migrations
+
+    db = Database(os.path.join(workdir, 'database.db'))
+    with db.connection() as conn:
+        apply_migrations(conn)
+    user_ids = [db.create_user(f"user{i}", 'x', f"user{i}@example.com") for i in range(args.users)]
+    db.keyring, db.api_key_auth   # derive keys before timing
+
+    start = time.perf_counter()
+    for i in range(args.single):
+        db.create_api_key(user_ids[i % len(user_ids)])
+    elapsed = time.perf_counter() - start
+    print(f"create_api_key x{args.single:<8} {elapsed:>8.2f} s {args.single / elapsed:>10.0f} keys/s")
+
+    per_user = max(args.keys // len(user_ids), 1)
+    start = time.perf_counter()
+    keys = db.create_api_keys(user_ids, count=per_user)
+    elapsed = time.perf_counter() - start
+    print(f"create_api_keys x{len(keys):<7} {elapsed:>8.2f} s {len(keys) / elapsed:>10.0f} keys/s")
+
+    sample = keys[len(keys) // 2]
+    assert db.verify_api_key(sample['api_key'], sample['api_secret']) == sample['user_id']
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
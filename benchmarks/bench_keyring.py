@@ -0,0 +1,95 @@
+"""
+Benchmark: API secret encryption throughput
+
+Compares the old api_key_generation scheme with the versioned keyring. The
+old scheme stored a random salt with every ciphertext and ran a
+100,000-iteration PBKDF2 on every encrypt and decrypt. The keyring holds
+already-derived keys and tags each ciphertext with a key version. It also
+times get_api_secret reveals against a populated api_keys table.
+
+    python benchmarks/bench_keyring.py [--secrets 200] [--keys 2000]
+"""
+
+import os
+import sys
+import time
+import base64
+import secrets
+import argparse
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+
+def legacy_derive_key(password, salt, iterations=100000):
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=iterations)
+    return base64.urlsafe_b64encode(kdf.derive(password))
+
+
+def legacy_encrypt(data, key):
+    """The pre-keyring scheme, kept for comparison"""
+    salt = secrets.token_bytes(16)
+    return base64.urlsafe_b64encode(salt + Fernet(legacy_derive_key(key, salt)).encrypt(data.encode())).decode()
+
+
+def legacy_decrypt(encrypted_data, key):
+    decoded = base64.urlsafe_b64decode(encrypted_data.encode())
+    salt, token = decoded[:16], decoded[16:]
+    return Fernet(legacy_derive_key(key, salt)).decrypt(token).decode()
+
+
+def rate(label, func, items):
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34} {len(items) / elapsed:>12.0f} secrets/s {elapsed / len(items) * 1e6:>10.1f} us/secret")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--secrets', type=int, default=200, help='secrets for the slow legacy scheme')
+    parser.add_argument('--keys', type=int, default=2000, help='secrets for the keyring and reveal runs')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_keyring_')
+    os.chdir(workdir)
+
+    from database import Database
+    from migrations import apply_migrations
+    from encryption_keys import LEGACY_API_KEY_PASSPHRASE
+    from api_key_generation import get_api_secret
+
+    db = Database(os.path.join(workdir, 'database.db'))
+    keyring = db.keyring
+    passphrase = LEGACY_API_KEY_PASSPHRASE
+
+    plain = [secrets.token_urlsafe(64) for _ in range(args.keys)]
+    legacy_tokens = [legacy_encrypt(p, passphrase) for p in plain[:args.secrets]]
+    rate("legacy encrypt (PBKDF2 per call)", lambda p: legacy_encrypt(p, passphrase), plain[:args.secrets])
+    rate("legacy decrypt (PBKDF2 per call)", lambda t: legacy_decrypt(t, passphrase), legacy_tokens)
+
+    tokens = [keyring.encrypt(p) for p in plain]
+    rate("keyring encrypt", keyring.encrypt, plain)
+    rate("keyring decrypt", keyring.decrypt, tokens)
+
+    with db.connection() as conn:
+        apply_migrations(conn)
+        user_id = db.create_user('bench', 'x', 'bench@example.com')
+        now = datetime.now().isoformat()
+        conn.executemany(
+            "INSERT INTO api_keys (id, user_id, api_key, api_secret, api_id, created_at, status) VALUES (?, ?, ?, ?, ?, ?, 'Active')",
+            [(f"k{i}", user_id, f"key{i}", token, f"k{i}", now) for i, token in enumerate(tokens)]
+        )
+        conn.commit()
+        rate("get_api_secret reveal (keyring)", lambda i: get_api_secret(conn, f"k{i}", user_id), range(args.keys))
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
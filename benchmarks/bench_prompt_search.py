@@ -0,0 +1,153 @@
+"""
+Benchmark: full-text prompt search
+
+Loads a synthetic corpus of prompts (Zipf-distributed vocabulary, many
+users) through the same INSERTs the activity writer uses, so the FTS5
+triggers index every row as it arrives, then measures:
+
+- history pages for one user, first page and deep pages via cursors
+- searches for common, rare and prefix terms, per user and across all
+  users, ranked by bm25 and by recency
+- a LIKE '%term%' scan over the same rows, for comparison
+
+    python benchmarks/bench_prompt_search.py [--prompts 5000000] [--users 10000] [--queries 200]
+"""
+
+import os
+import sys
+import time
+import uuid
+import random
+import argparse
+import itertools
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SUBJECTS = ['cat', 'dog', 'castle', 'robot', 'forest', 'city', 'dragon', 'portrait', 'ocean', 'mountain',
+            'car', 'flower', 'astronaut', 'knight', 'village', 'spaceship', 'lighthouse', 'garden', 'train', 'owl']
+STYLES = ['watercolor', 'oil', 'painting', 'photorealistic', 'cinematic', 'lighting', 'sketch', 'neon',
+          'pastel', 'vintage', 'isometric', 'render', 'minimalist', 'baroque', 'anime', 'noir']
+
+
+def make_vocabulary(size, rng):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set(SUBJECTS + STYLES)
+    while len(words) < size:
+        words.add(''.join(rng.choice(letters) for _ in range(rng.randint(4, 10))))
+    return sorted(words, key=lambda word: (word not in SUBJECTS and word not in STYLES, word))
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def timed(label, fn, runs):
+    """Run ``fn(i)`` ``runs`` times and print p50/p95 latency in ms"""
+    samples = []
+    results = 0
+    for i in range(runs):
+        start = time.perf_counter()
+        results += len(fn(i)['items'])
+        samples.append((time.perf_counter() - start) * 1000)
+    print(f"  {label:<42} p50 {percentile(samples, 0.5):>8.2f} ms   p95 {percentile(samples, 0.95):>8.2f} ms"
+          f"   {results / runs:>5.1f} items")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--prompts', type=int, default=5000000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=5000)
+    args = parser.parse_args()
+    rng = random.Random(7)
+
+    workdir = tempfile.mkdtemp(prefix='bench_prompts_')
+    os.chdir(workdir)
+
+    from database import Database
+    from migrations import apply_migrations
+
+    db = Database(os.path.join(workdir, 'database.db'))
+    with db.connection() as conn:
+        apply_migrations(conn)
+
+    vocabulary = make_vocabulary(args.vocabulary, rng)
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(vocabulary))))
+    user_ids = [f"user{i}" for i in range(args.users)]
+
+    print(f"loading {args.prompts:,} prompts for {args.users:,} users ...")
+    insert_time = 0.0
+    loaded = 0
+    while loaded < args.prompts:
+        count = min(args.batch, args.prompts - loaded)
+        activities, details = [], []
+        for i in range(count):
+            activity_id = str(uuid.uuid4())
+            timestamp = f"2025-01-01T00:00:{loaded + i:012d}"
+            words = rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(8, 20))
+            activities.append((activity_id, rng.choice(user_ids), 'generate', timestamp, activity_id))
+            details.append((str(uuid.uuid4()), activity_id, ' '.join(words), timestamp, str(uuid.uuid4())))
+        start = time.perf_counter()
+        with db.connection() as conn:
+            conn.executemany(
+                "INSERT INTO user_activity (id, user_id, activity_type, activity_timestamp, activity_id) VALUES (?, ?, ?, ?, ?)",
+                activities
+            )
+            conn.executemany(
+                "INSERT INTO activity_details (id, activity_id, prompt, prompt_timestamp, prompt_id) VALUES (?, ?, ?, ?, ?)",
+                details
+            )
+            conn.commit()
+        insert_time += time.perf_counter() - start
+        loaded += count
+    print(f"indexed on insert: {args.prompts / insert_time:,.0f} prompts/s ({insert_time:.1f}s in INSERTs)")
+
+    start = time.perf_counter()
+    db.prompts.optimize()
+    print(f"optimize: {time.perf_counter() - start:.1f}s, database {os.path.getsize('database.db') / 2**20:,.0f} MiB\n")
+
+    history = db.get_prompt_history
+    runs = args.queries
+    rare = vocabulary[len(vocabulary) // 2:]
+    print("history:")
+    timed("first page, one user", lambda i: history(rng.choice(user_ids)), runs)
+
+    def deep_page(i, pages=10):
+        user_id = rng.choice(user_ids)
+        page = history(user_id, limit=5)
+        for _ in range(pages):
+            if not page['next_cursor']:
+                break
+            page = history(user_id, limit=5, cursor=page['next_cursor'])
+        return page
+    timed("11th page of 5, one user (cursor walk)", deep_page, max(1, runs // 10))
+
+    print("search, one user:")
+    timed("common term, relevance", lambda i: history(rng.choice(user_ids), query=rng.choice(SUBJECTS)), runs)
+    timed("two terms, relevance", lambda i: history(rng.choice(user_ids), query=f"{rng.choice(SUBJECTS)} {rng.choice(STYLES)}"), runs)
+    timed("prefix term, recent", lambda i: history(rng.choice(user_ids), query=rng.choice(STYLES)[:3], sort='recent'), runs)
+
+    print("search, all users:")
+    timed("rare term, relevance", lambda i: history(None, query=rng.choice(rare)), runs)
+    timed("two common terms, recent", lambda i: history(None, query=f"{rng.choice(SUBJECTS)} {rng.choice(STYLES)}", sort='recent'), runs)
+    timed("two common terms, relevance", lambda i: history(None, query=f"{rng.choice(SUBJECTS)} {rng.choice(STYLES)}"), max(1, runs // 20))
+
+    print("baseline:")
+    def like_scan(i):
+        term = rng.choice(rare)
+        with db.connection() as conn:
+            rows = conn.execute(
+                "SELECT id FROM activity_details WHERE prompt LIKE ? ORDER BY prompt_timestamp DESC LIMIT 20",
+                (f"%{term}%",)
+            ).fetchall()
+        return {'items': rows}
+    timed("LIKE '%rare term%', all users", like_scan, max(1, runs // 50))
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark: role inheritance
+
+Builds a hierarchy of several hundred roles (a deep chain plus a random
+DAG hanging off it), assigns users to roles at every depth and measures:
+permission checks with the resolver cache disabled, which is the
+user_effective_permissions lookup every cache miss pays, grouped by how deep
+the user's role sits (the cost follows the number of inherited
+permissions read, not the depth itself); the same checks with the cache
+warm; and the cost of hierarchy edits, which rewrite only the affected part
+of role_closure.
+
+    python benchmarks/bench_role_hierarchy.py [--roles 500] [--depth 100] [--users 2000] [--checks 50000]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def checks_per_second(db, users, permissions, checks, rng):
+    start = time.perf_counter()
+    for _ in range(checks):
+        db.has_permission(rng.choice(users), rng.choice(permissions))
+    return checks / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--roles', type=int, default=500)
+    parser.add_argument('--depth', type=int, default=100, help='length of the inheritance chain')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--checks', type=int, default=50000)
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    workdir = tempfile.mkdtemp(prefix='bench_roles_')
+    os.chdir(workdir)
+
+    from database import Database
+    from migrations import apply_migrations
+
+    db = Database(os.path.join(workdir, 'database.db'))
+    with db.connection() as conn:
+        apply_migrations(conn)
+        conn.executemany(
+            "INSERT INTO users (id, username, password, email, created_at, updated_at) VALUES (?, ?, 'x', ?, 'now', 'now')",
+            [(f"u{i}", f"user{i}", f"user{i}@example.com") for i in range(args.users)]
+        )
+        conn.commit()
+
+    # role_0 <- role_1 <- ... <- role_{depth-1}, then the rest inherit from
+    # one or two random earlier roles
+    start = time.perf_counter()
+    depth_of = {}
+    for i in range(args.roles):
+        if i == 0:
+            parents = []
+        elif i < args.depth:
+            parents = [f"role_{i - 1}"]
+        else:
+            parents = [f"role_{rng.randrange(i)}" for _ in range(rng.choice((1, 2)))]
+        db.create_role(f"role_{i}", {f"perm_{i}": True}, inherits=parents)
+        depth_of[f"role_{i}"] = max((depth_of[p] + 1 for p in parents), default=0)
+    build = time.perf_counter() - start
+    with db.connection() as conn:
+        closure_rows = conn.execute("SELECT COUNT(*) FROM role_closure").fetchone()[0]
+    print(f"{args.roles} roles, max depth {max(depth_of.values())}, {closure_rows:,} closure rows, "
+          f"built in {build:.2f}s ({build / args.roles * 1000:.2f} ms per create_role)")
+
+    by_depth = {'shallow (<5)': [], 'mid (5-49)': [], 'deep (50+)': []}
+    for i in range(args.users):
+        role_name = f"role_{rng.randrange(args.roles)}"
+        with db.connection() as conn:
+            conn.execute("INSERT INTO user_roles (id, user_id, role) VALUES (?, ?, ?)", (f"ur{i}", f"u{i}", role_name))
+            conn.commit()
+        depth = depth_of[role_name]
+        bucket = 'shallow (<5)' if depth < 5 else 'mid (5-49)' if depth < 50 else 'deep (50+)'
+        by_depth[bucket].append(f"u{i}")
+    db.permissions.invalidate_roles()
+
+    permissions = [f"perm_{i}" for i in range(args.roles)]
+    max_users = db.permissions.max_users
+    db.permissions.max_users = 0
+    print("\nuncached checks (one indexed lookup each):")
+    for bucket, users in by_depth.items():
+        if users:
+            granted = sum(len(db.get_user_permissions(user)) for user in users) / len(users)
+            rate = checks_per_second(db, users, permissions, args.checks // 3, rng)
+            print(f"  {bucket:<14} {len(users):>6} users  {granted:>6.1f} perms/user  {rate:>12,.0f} checks/s")
+
+    db.permissions.max_users = max_users
+    all_users = [user for users in by_depth.values() for user in users]
+    checks_per_second(db, all_users, permissions, len(all_users), rng)  # warm
+    rate = checks_per_second(db, all_users, permissions, args.checks, rng)
+    print(f"cached checks                                            {rate:>12,.0f} checks/s")
+
+    print("\nhierarchy edits:")
+    root = db.get_role(role_name='role_0')
+    start = time.perf_counter()
+    db.update_role(root['role_id'], {'permissions': {'perm_0': True, 'perm_root_extra': True}})
+    print(f"  change root permissions        {(time.perf_counter() - start) * 1000:>9.1f} ms")
+
+    mid = db.get_role(role_name=f"role_{args.depth // 2}")
+    start = time.perf_counter()
+    db.update_role(mid['role_id'], {'inherits': []})
+    print(f"  detach mid-chain role          {(time.perf_counter() - start) * 1000:>9.1f} ms")
+    start = time.perf_counter()
+    db.update_role(mid['role_id'], {'inherits': [f"role_{args.depth // 2 - 1}"]})
+    print(f"  reattach mid-chain role        {(time.perf_counter() - start) * 1000:>9.1f} ms")
+
+    leaf = db.get_role(role_name=f"role_{args.roles - 1}")
+    start = time.perf_counter()
+    db.update_role(leaf['role_id'], {'inherits': ['role_0', f"role_{args.depth - 1}"]})
+    print(f"  re-parent a leaf role          {(time.perf_counter() - start) * 1000:>9.1f} ms")
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: session token validation
+
+Compares AuthHandler.is_authenticated for database-backed session tokens
+and for signed tokens (SESSION_TOKEN_FORMAT=signed), in validated requests
+per second. Database tokens are measured both with the session LRU warm and
+with it disabled, which is what every request costs once the LRU TTL has
+passed or on a worker that has not seen the token yet.
+
+    python benchmarks/bench_session_tokens.py [--users 1000] [--requests 50000] [--threads 4]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run(check, tokens, requests, threads):
+    """Validate ``requests`` random tokens across ``threads`` threads; returns requests/s"""
+    per_thread = requests // threads
+    failures = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(per_thread):
+            if not check(rng.choice(tokens)):
+                failures.append(1)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    assert not failures, f"{len(failures)} tokens failed to validate"
+    return per_thread * threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=50000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_sessions_')
+    os.chdir(workdir)
+
+    from database import Database
+    from database_handler import AuthHandler
+    from migrations import apply_migrations
+
+    db = Database(os.path.join(workdir, 'database.db'))
+    with db.connection() as conn:
+        apply_migrations(conn)
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO users (id, username, password, email, created_at, updated_at) VALUES (?, ?, 'x', ?, 'now', 'now')",
+            [(f"u{i}", f"user{i}", f"user{i}@example.com") for i in range(args.users)]
+        )
+        conn.commit()
+    user_ids = [f"u{i}" for i in range(args.users)]
+    expires = now + 3600
+
+    stored = AuthHandler(db, session_format='database')
+    signed = AuthHandler(db, session_format='signed')
+
+    db_tokens = []
+    for user_id in user_ids:
+        token = stored._generate_session_token()
+        db.store_session_token(user_id, token, expires)
+        db_tokens.append(token)
+    signed_tokens = [db.signed_sessions.issue(user_id, expires) for user_id in user_ids]
+    # Revoke one user so the epoch map is not empty
+    db.signed_sessions.revoke_user(user_ids[0])
+    signed_tokens[0] = db.signed_sessions.issue(user_ids[0], expires)
+
+    print(f"{args.users} users, {args.requests} validations on {args.threads} threads")
+    lru_size = db.sessions.lru_size
+    db.sessions.lru_size = 0
+    db.sessions._lru.clear()
+    rate = run(stored.is_authenticated, db_tokens, args.requests, args.threads)
+    print(f"database (no LRU)    {rate:>12,.0f} req/s")
+
+    db.sessions.lru_size = lru_size
+    run(stored.is_authenticated, db_tokens, len(db_tokens), 1)  # warm the LRU
+    rate = run(stored.is_authenticated, db_tokens, args.requests, args.threads)
+    print(f"database (warm LRU)  {rate:>12,.0f} req/s")
+
+    rate = run(signed.is_authenticated, signed_tokens, args.requests, args.threads)
+    print(f"signed               {rate:>12,.0f} req/s")
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
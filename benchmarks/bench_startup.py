@@ -0,0 +1,67 @@
+"""
+Benchmark: server startup
+
+Starts a fresh interpreter several times in a migrated temporary database
+directory and reports:
+
+  * import time of server.py
+  * time to first request (GET /) measured from the start of the import
+  * cost of the first use of Database.keyring (PBKDF2 key derivation), which
+    is paid lazily and only once per process
+
+    python benchmarks/bench_startup.py [--runs 10]
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r'''
+import sys, time, json
+sys.path[:0] = [{repo!r}, {script!r}]
+start = time.perf_counter()
+import server
+imported = time.perf_counter()
+client = server.app.test_client()
+client.get('/')
+first_request = time.perf_counter()
+server.auth_handler.db.keyring
+keyring = time.perf_counter()
+print(json.dumps({{
+    'import': imported - start,
+    'first_request': first_request - start,
+    'keyring': keyring - first_request,
+}}))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_startup_')
+    subprocess.run([sys.executable, os.path.join(REPO, 'migrations.py'), os.path.join(workdir, 'database.db')],
+                   check=True, capture_output=True)
+
+    code = CHILD.format(repo=REPO, script=os.path.join(REPO, 'script'))
+    results = []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, '-c', code], cwd=workdir, check=True,
+                             capture_output=True, text=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    print(f"{args.runs} runs in {workdir}")
+    for name in ('import', 'first_request', 'keyring'):
+        values = [r[name] * 1000 for r in results]
+        print(f"{name:<16} median {statistics.median(values):>8.1f} ms   min {min(values):>8.1f} ms   max {max(values):>8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark: user hydration with roles and permissions
+
+Compares the old N+1 get_user (one query for the user, one for its roles and
+one per role for permissions) with the batched Database.get_user/get_users
+against a synthetic database.
+
+    python benchmarks/bench_user_hydration.py [--users 100000] [--samples 2000]
+"""
+
+import os
+import sys
+import time
+import uuid
+import random
+import argparse
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def legacy_get_user(cursor, user_id):
+    """The pre-batching N+1 implementation, kept for comparison"""
+    cursor.execute('''
+    SELECT id, username, full_name, email, bio, profile_pic, created_at, updated_at
+    FROM users WHERE id = ?
+    ''', (user_id,))
+    user = cursor.fetchone()
+    if not user:
+        return None
+    user_dict = {
+        'id': user[0], 'username': user[1], 'full_name': user[2], 'email': user[3],
+        'bio': user[4], 'profile_pic': user[5], 'created_at': user[6], 'updated_at': user[7],
+        'roles': []
+    }
+    cursor.execute("SELECT id, role FROM user_roles WHERE user_id = ?", (user_id,))
+    for role_id, role_name in cursor.fetchall():
+        cursor.execute("SELECT permission FROM role_permissions WHERE role_id = ?", (role_id,))
+        user_dict['roles'].append({'role': role_name, 'permissions': [p[0] for p in cursor.fetchall()]})
+    return user_dict
+
+
+def populate(conn, user_count):
+    """Insert synthetic users with one or two roles and a few permissions each"""
+    now = datetime.now().isoformat()
+    role_names = ['admin', 'medium_admin', 'social_media_handler', 'basic_user']
+    users, roles, perms = [], [], []
+    user_ids = []
+    for i in range(user_count):
+        user_id = str(uuid.uuid4())
+        user_ids.append(user_id)
+        users.append((user_id, f"user{i}", 'x', f"User {i}", f"user{i}@example.com", None, None, now, now))
+        for role_name in random.sample(role_names, random.randint(1, 2)):
+            role_id = str(uuid.uuid4())
+            roles.append((role_id, user_id, role_name))
+            for permission in ('read', 'write')[:random.randint(1, 2)]:
+                perms.append((str(uuid.uuid4()), role_id, permission))
+    conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", users)
+    conn.executemany("INSERT INTO user_roles (id, user_id, role) VALUES (?, ?, ?)", roles)
+    conn.executemany("INSERT INTO role_permissions (id, role_id, permission) VALUES (?, ?, ?)", perms)
+    conn.commit()
+    return user_ids
+
+
+def measure(conn, label, func, calls):
+    """Run func calls times and report query count and latency"""
+    queries = [0]
+    conn.set_trace_callback(lambda statement: queries.__setitem__(0, queries[0] + 1))
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    elapsed = time.perf_counter() - start
+    conn.set_trace_callback(None)
+    print(f"{label:<34} {queries[0] / calls:>8.1f} queries/call {elapsed / calls * 1e6:>10.1f} us/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--samples', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=100)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_hydration_')
+    os.chdir(workdir)
+
+    from database import Database
+    from migrations import apply_migrations
+
+    db = Database(os.path.join(workdir, 'bench.db'))
+    with db.connection() as conn:
+        apply_migrations(conn)
+        print(f"Populating {args.users} users in {workdir} ...")
+        user_ids = populate(conn, args.users)
+
+        sample = random.sample(user_ids, args.samples)
+        cursor = conn.cursor()
+        it = iter(sample * 2)
+        measure(conn, "legacy N+1 get_user", lambda: legacy_get_user(cursor, next(it)), args.samples)
+        it = iter(sample * 2)
+        measure(conn, "batched get_user", lambda: db.get_user(next(it)), args.samples)
+
+        batches = [sample[i:i + args.batch] for i in range(0, len(sample), args.batch)]
+        it = iter(batches)
+        measure(conn, f"legacy N+1 x{args.batch} users", lambda: [legacy_get_user(cursor, u) for u in next(it)], len(batches))
+        it = iter(batches)
+        measure(conn, f"get_users({args.batch} ids)", lambda: db.get_users(next(it)), len(batches))
+
+        # Sanity check: both implementations return the same shape and content
+        # (roles may come back in a different order)
+        by_role = lambda user: sorted(user['roles'], key=lambda role: role['role'])
+        for user_id in sample[:50]:
+            legacy, batched = legacy_get_user(cursor, user_id), db.get_user(user_id)
+            assert by_role(legacy) == by_role(batched)
+            assert {k: v for k, v in legacy.items() if k != 'roles'} == {k: v for k, v in batched.items() if k != 'roles'}
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
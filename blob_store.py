@@ -0,0 +1,335 @@
+import zlib
+import hashlib
+import sqlite3
+import threading
+import logging
+from collections import Counter
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; zlib is always available
+    zstandard = None
+
+CODECS = ('raw', 'zlib', 'zstd')
+
+# zlib only looks back 32 KiB, so a longer preset dictionary is wasted
+ZLIB_MAX_DICTIONARY = 32 * 1024
+
+
+def content_hash(data):
+    """SHA-256 digest of the raw content bytes; the key of a blob"""
+    return hashlib.sha256(data).digest()
+
+
+class BlobStore:
+    """Content-addressed, compressed storage for prompts and responses
+
+    Each distinct text is stored once in content_blobs, keyed by the SHA-256
+    of its UTF-8 bytes, and activity rows point to it by hash. refcount is
+    the number of rows pointing at a blob; triggers keep it current as those
+    rows are inserted, re-pointed and deleted, and gc() removes blobs nobody
+    references any more.
+
+    Responses are compressed with zstd when the zstandard package is
+    installed and with zlib otherwise, optionally with a shared dictionary
+    trained from stored responses. Prompts are stored uncompressed so that
+    the full-text index and its triggers can read them in SQL.
+    """
+
+    def __init__(self, pool, codec=None, level=None, min_size=64, min_saving=0.1):
+        """Initialize the blob store
+
+        Args:
+            pool (ConnectionPool): Pool used to read blobs and dictionaries
+            codec (str, optional): 'zstd' or 'zlib'. Defaults to zstd if installed, else zlib.
+            level (int, optional): Compression level. Defaults to 3 for zstd and 6 for zlib.
+            min_size (int, optional): Texts shorter than this many bytes are stored raw. Defaults to 64.
+            min_saving (float, optional): Compressed data must be at least this fraction smaller. Defaults to 0.1.
+        """
+        codec = codec or ('zstd' if zstandard is not None else 'zlib')
+        if codec not in ('zlib', 'zstd'):
+            raise ValueError(f"Unknown compression codec: {codec}")
+        if codec == 'zstd' and zstandard is None:
+            raise ValueError("The zstd codec needs the zstandard package")
+
+        self.pool = pool
+        self.codec = codec
+        self.level = level if level is not None else (3 if codec == 'zstd' else 6)
+        self.min_size = min_size
+        self.min_saving = min_saving
+
+        self._lock = threading.Lock()
+        self._dictionaries = {}         # dict_id -> (codec, bytes); rows are never changed
+        self._active_dict = None        # (dict_id, bytes) for self.codec, loaded lazily
+        self._active_loaded = False
+        self._local = threading.local()  # per-thread zstd (de)compressors
+
+    # Encoding
+
+    def encode(self, text, compress=True):
+        """Turn a text into a blob row, compressing it if that pays off
+
+        Args:
+            text (str): The content
+            compress (bool, optional): Allow compression. Defaults to True.
+
+        Returns:
+            tuple: (hash, codec, dict_id, size, stored_size, data), ready for store()
+        """
+        raw = text.encode('utf-8')
+        digest = content_hash(raw)
+        if compress and len(raw) >= self.min_size:
+            dict_id, dictionary = self._get_active_dictionary()
+            data = self._compress(raw, dictionary)
+            if len(data) <= len(raw) * (1 - self.min_saving):
+                return (digest, self.codec, dict_id, len(raw), len(data), data)
+        return (digest, 'raw', None, len(raw), len(raw), raw)
+
+    def _compress(self, raw, dictionary):
+        if self.codec == 'zstd':
+            compressors = getattr(self._local, 'compressors', None)
+            if compressors is None:
+                compressors = self._local.compressors = {}
+            key = id(dictionary)
+            compressor = compressors.get(key)
+            if compressor is None:
+                dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+                compressor = compressors[key] = zstandard.ZstdCompressor(level=self.level, dict_data=dict_data)
+            return compressor.compress(raw)
+        if dictionary:
+            compressor = zlib.compressobj(self.level, zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(self.level)
+        return compressor.compress(raw) + compressor.flush()
+
+    def _decode(self, codec, dict_id, data):
+        if codec == 'raw':
+            return bytes(data).decode('utf-8')
+        dictionary = self._get_dictionary(dict_id) if dict_id is not None else None
+        if codec == 'zlib':
+            decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+            return (decompressor.decompress(data) + decompressor.flush()).decode('utf-8')
+        if codec == 'zstd':
+            if zstandard is None:
+                raise ValueError("Blob is zstd-compressed but the zstandard package is not installed")
+            dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(data).decode('utf-8')
+        raise ValueError(f"Unknown blob codec: {codec}")
+
+    # Storage
+
+    @staticmethod
+    def store(conn, rows):
+        """Insert blob rows inside the caller's transaction; existing hashes are left alone
+
+        Reference counts start at zero and are raised by the triggers on the
+        activity rows, so the rows pointing at these blobs must be written in
+        the same transaction, or gc() may remove the blobs first.
+
+        Args:
+            conn (sqlite3.Connection): Connection holding the write transaction
+            rows (list): Tuples from encode()
+        """
+        now = datetime.now().isoformat()
+        conn.executemany('''
+        INSERT INTO content_blobs (hash, codec, dict_id, size, stored_size, data, refcount, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, 0, ?)
+        ON CONFLICT(hash) DO NOTHING
+        ''', [row + (now,) for row in rows])
+
+    def get_many(self, hashes):
+        """Load and decode several blobs
+
+        Args:
+            hashes (iterable): Blob hashes; None entries are ignored
+
+        Returns:
+            dict: hash -> text for every blob found and decoded
+        """
+        hashes = list({h for h in hashes if h is not None})
+        result = {}
+        if not hashes:
+            return result
+        try:
+            with self.pool.connection() as conn:
+                for start in range(0, len(hashes), 500):
+                    chunk = hashes[start:start + 500]
+                    rows = conn.execute(
+                        f"SELECT hash, codec, dict_id, data FROM content_blobs WHERE hash IN ({', '.join('?' * len(chunk))})",
+                        chunk
+                    ).fetchall()
+                    for digest, codec, dict_id, data in rows:
+                        try:
+                            result[bytes(digest)] = self._decode(codec, dict_id, data)
+                        except (ValueError, zlib.error) as e:
+                            logging.error(f"Error decoding blob: {str(e)}")
+        except sqlite3.Error as e:
+            logging.error(f"Error loading blobs: {str(e)}")
+        return result
+
+    def get(self, digest):
+        """Load and decode one blob
+
+        Returns:
+            str: The text, or None if the blob is missing or cannot be decoded
+        """
+        return self.get_many([digest]).get(digest)
+
+    def gc(self, batch_size=500):
+        """Delete blobs that no row references, in small transactions
+
+        Returns:
+            int: Number of blobs deleted
+        """
+        deleted = 0
+        try:
+            while True:
+                with self.pool.connection() as conn:
+                    count = conn.execute('''
+                    DELETE FROM content_blobs WHERE hash IN (
+                        SELECT hash FROM content_blobs WHERE refcount <= 0 LIMIT ?
+                    )
+                    ''', (batch_size,)).rowcount
+                    conn.commit()
+                deleted += count
+                if count < batch_size:
+                    return deleted
+        except sqlite3.Error as e:
+            logging.error(f"Error collecting unreferenced blobs: {str(e)}")
+            return deleted
+
+    # Dictionaries
+
+    def _get_dictionary(self, dict_id):
+        with self._lock:
+            cached = self._dictionaries.get(dict_id)
+        if cached is not None:
+            return cached[1]
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT codec, data FROM blob_dictionaries WHERE id = ?", (dict_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"Unknown blob dictionary: {dict_id}")
+        with self._lock:
+            self._dictionaries[dict_id] = (row[0], bytes(row[1]))
+        return bytes(row[1])
+
+    def _get_active_dictionary(self):
+        """The newest dictionary for our codec, or (None, None); read once per process"""
+        if not self._active_loaded:
+            try:
+                with self.pool.connection() as conn:
+                    row = conn.execute(
+                        "SELECT id, data FROM blob_dictionaries WHERE codec = ? ORDER BY id DESC LIMIT 1",
+                        (self.codec,)
+                    ).fetchone()
+            except sqlite3.Error as e:
+                logging.error(f"Error loading blob dictionary: {str(e)}")
+                row = None
+            with self._lock:
+                self._active_dict = (row[0], bytes(row[1])) if row else None
+                self._active_loaded = True
+        return self._active_dict or (None, None)
+
+    def train_dictionary(self, samples, size=None):
+        """Build a shared dictionary from sample texts and use it for new blobs
+
+        zstd dictionaries are trained by zstandard. A zlib dictionary is the
+        most frequent samples concatenated, most frequent last, since zlib
+        finds matches near the end of the dictionary most cheaply. Existing
+        blobs keep the dictionary they were written with. Other processes
+        pick the new dictionary up when they restart.
+
+        Args:
+            samples (list): Representative texts, e.g. recent responses
+            size (int, optional): Dictionary size in bytes. Defaults to 110 KiB for zstd and 32 KiB for zlib.
+
+        Returns:
+            int: The new dictionary's id, or None if there were too few samples
+        """
+        encoded = [sample.encode('utf-8') for sample in samples if sample]
+        if len(encoded) < 8:
+            return None
+
+        if self.codec == 'zstd':
+            try:
+                dictionary = zstandard.train_dictionary(size or 110 * 1024, encoded).as_bytes()
+            except zstandard.ZstdError as e:
+                logging.error(f"Error training zstd dictionary: {str(e)}")
+                return None
+        else:
+            size = min(size or ZLIB_MAX_DICTIONARY, ZLIB_MAX_DICTIONARY)
+            chosen, total = [], 0
+            for sample, _ in Counter(encoded).most_common():
+                if total + len(sample) > size:
+                    continue
+                chosen.append(sample)
+                total += len(sample)
+            dictionary = b''.join(reversed(chosen))
+            if not dictionary:
+                return None
+
+        try:
+            with self.pool.connection() as conn:
+                dict_id = conn.execute(
+                    "INSERT INTO blob_dictionaries (codec, data, created_at) VALUES (?, ?, ?)",
+                    (self.codec, dictionary, datetime.now().isoformat())
+                ).lastrowid
+                conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error storing blob dictionary: {str(e)}")
+            return None
+
+        with self._lock:
+            self._dictionaries[dict_id] = (self.codec, dictionary)
+            self._active_dict = (dict_id, dictionary)
+            self._active_loaded = True
+        return dict_id
+
+    # Reporting
+
+    def space_report(self):
+        """Measure how much the blob store saves
+
+        Returns:
+            dict: Blob and reference counts, logical, unique and stored bytes,
+                deduplication and compression ratios, a per-codec breakdown and
+                the rows still stored inline
+        """
+        try:
+            with self.pool.connection() as conn:
+                blobs, references, logical, unique, stored = conn.execute('''
+                SELECT COUNT(*), COALESCE(SUM(refcount), 0), COALESCE(SUM(size * refcount), 0),
+                       COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0)
+                FROM content_blobs
+                ''').fetchone()
+                by_codec = {codec: {'blobs': count, 'bytes': size, 'stored_bytes': stored_size}
+                            for codec, count, size, stored_size in conn.execute(
+                                "SELECT codec, COUNT(*), SUM(size), SUM(stored_size) FROM content_blobs GROUP BY codec")}
+                inline_prompts = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(length(CAST(prompt AS BLOB))), 0) FROM activity_details WHERE prompt_hash IS NULL"
+                ).fetchone()
+                inline_responses = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(length(CAST(response AS BLOB))), 0) FROM activity_responses WHERE response_hash IS NULL"
+                ).fetchone()
+                unreferenced = conn.execute("SELECT COUNT(*) FROM content_blobs WHERE refcount <= 0").fetchone()[0]
+        except sqlite3.Error as e:
+            logging.error(f"Error building blob space report: {str(e)}")
+            return None
+
+        return {
+            'blobs': blobs,
+            'references': references,
+            'unreferenced_blobs': unreferenced,
+            'logical_bytes': logical,
+            'unique_bytes': unique,
+            'stored_bytes': stored,
+            'saved_bytes': logical - stored,
+            'dedupe_ratio': logical / unique if unique else 1.0,
+            'compression_ratio': unique / stored if stored else 1.0,
+            'by_codec': by_codec,
+            'inline_prompts': inline_prompts[0],
+            'inline_prompt_bytes': inline_prompts[1],
+            'inline_responses': inline_responses[0],
+            'inline_response_bytes': inline_responses[1],
+        }
@@ -5,27 +5,47 @@ import uuid
 import hashlib
 import secrets
 import base64
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from datetime import datetime
 import logging
 import threading
 import time
-import bcrypt
+from db_pool import ConnectionPool
+import migrations
+from permissions import PermissionResolver, bump_epoch, ROLES_SCOPE, USER_ROLES_SCOPE
+from session_store import SessionStore
+from revocation import RevocationList
+from activity_log import ActivityWriter
+from encryption_keys import Keyring, LEGACY_API_KEY_PASSPHRASE
+from api_key_auth import ApiKeyAuthenticator, key_prefix, hash_secret
+from id_allocator import IdBlockAllocator
+from signed_sessions import SignedSessionTokens
+from user_cache import UserCache
+from prompt_search import PromptSearch
+from blob_store import BlobStore
+from activity_partitions import ActivityPartitions
+from role_hierarchy import RoleHierarchyError, set_role_parents, refresh_role_closure, get_role_parents, get_role_ancestors
+from password_policy import hash_password, verify_password, verify_and_update
 
-# Thread-local storage for database connections
-_thread_local = threading.local()
 
 class Database:
-    def __init__(self, db_path="database.db"):
-        """Initialize the database connection"""
+    def __init__(self, db_path="database.db", pool_size=5, pragma_profile="default"):
+        """Initialize the database connection pool"""
         self.db_path = db_path
         self.schema_path = "database_tables_form.json"
-        self.secret_key = self._get_or_create_secret_key()
-        self.fernet = self._initialize_encryption()
-        self.connect()
-        self._initialize_database()
+        self._keyring = None
+        self._api_key_auth = None
+        self._signed_sessions = None
+        self.pool = ConnectionPool(db_path, size=pool_size, profile=pragma_profile)
+        self.permissions = PermissionResolver(self.pool)
+        self.sessions = SessionStore(self.pool)
+        self.revocations = RevocationList(self.pool)
+        self.blobs = BlobStore(self.pool)
+        self.activity = ActivityWriter(self.pool, blobs=self.blobs)
+        self.api_key_ids = IdBlockAllocator(self.pool, 'api_key_id', block_size=1000)
+        self.user_cache = UserCache(self)
+        self.prompts = PromptSearch(self.pool, self.blobs)
+        self.partitions = ActivityPartitions(db_path, self.pool, self.blobs)
+        self._check_schema()
     
     def _get_or_create_secret_key(self, key_file="secret.key"):
         """Get or create a secret key for encryption"""
@@ -33,510 +53,587 @@ class Database:
             with open(key_file, "rb") as f:
                 return f.read()
         else:
-            # Generate a secure random key
+            # Generate a secure random key, readable by the owner only
             key = secrets.token_bytes(32)
-            with open(key_file, "wb") as f:
+            fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
                 f.write(key)
             return key
     
     def _initialize_encryption(self):
-        """Initialize Fernet encryption with the secret key"""
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=b'static_salt_for_key_derivation',  # In production, use a unique salt per application
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(self.secret_key))
-        return Fernet(key)
-    
-    def connect(self):
-        """Create a new database connection for the current thread"""
-        if not hasattr(_thread_local, 'conn') or _thread_local.conn is None:
-            _thread_local.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            _thread_local.cursor = _thread_local.conn.cursor()
-        
-        self.conn = _thread_local.conn
-        self.cursor = _thread_local.cursor
+        """Load the versioned keyring; version 1 is derived from the secret key"""
+        return Keyring(self._get_or_create_secret_key(), legacy_passphrase=LEGACY_API_KEY_PASSPHRASE)
+
+    @property
+    def keyring(self):
+        """Keyring for sensitive data, loaded on first use"""
+        if self._keyring is None:
+            self._keyring = self._initialize_encryption()
+        return self._keyring
+
+    @property
+    def api_key_auth(self):
+        """API key authenticator, keyed with the pepper in api_key_pepper.key"""
+        if self._api_key_auth is None:
+            pepper = self._get_or_create_secret_key("api_key_pepper.key")
+            self._api_key_auth = ApiKeyAuthenticator(self.pool, pepper, keyring=self.keyring)
+        return self._api_key_auth
+
+    @property
+    def signed_sessions(self):
+        """Signed session token codec, keyed with session_signing.key"""
+        if self._signed_sessions is None:
+            secret = self._get_or_create_secret_key("session_signing.key")
+            self._signed_sessions = SignedSessionTokens(self.pool, secret)
+        return self._signed_sessions
     
     def _hash_password(self, password):
-        """Hash a password using bcrypt"""
-        try:
-            return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        except Exception as e:
-            print(f"Error hashing password: {str(e)}")
-            return None
+        """Hash a password at the password policy cost"""
+        return hash_password(password)
 
     def _verify_password(self, stored_password, provided_password):
         """Verify a password against its bcrypt hash"""
+        return verify_password(stored_password, provided_password)
+
+    def get_password_hash(self, user_id):
+        """Get the stored password hash of a user
+
+        Returns:
+            str: The bcrypt hash, or None if the user does not exist
+        """
         try:
-            return bcrypt.checkpw(provided_password.encode('utf-8'), stored_password.encode('utf-8'))
-        except Exception as e:
-            print(f"Error verifying password: {str(e)}")
-            return False
+            with self.pool.connection() as conn:
+                row = conn.execute("SELECT password FROM users WHERE id = ?", (user_id,)).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            logging.error(f"Error getting password hash: {str(e)}")
+            return None
     
     def _encrypt_sensitive_data(self, data):
-        """Encrypt sensitive data"""
-        return self.fernet.encrypt(data.encode()).decode()
+        """Encrypt sensitive data under the primary key"""
+        return self.keyring.encrypt(data)
     
     def _decrypt_sensitive_data(self, encrypted_data):
-        """Decrypt sensitive data"""
-        return self.fernet.decrypt(encrypted_data.encode()).decode()
+        """Decrypt sensitive data written under any key version"""
+        return self.keyring.decrypt(encrypted_data)
     
-    def _initialize_database(self):
-        """Initialize the database with tables based on the JSON schema"""
+    def _check_schema(self):
+        """Warn if the database has migrations that were not applied at deploy time"""
         try:
-            # Load schema from JSON file
-            with open(self.schema_path, 'r') as f:
-                schema = json.load(f)
-            
-            # Create users table
-            self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id TEXT PRIMARY KEY,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                full_name TEXT,
-                email TEXT UNIQUE NOT NULL,
-                bio TEXT,
-                profile_pic TEXT,
-                created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL
-            )
-            ''')
-            
-            # Create user_roles table for the roles array
-            self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_roles (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                role TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-            ''')
-            
-            # Create roles table with permissions as JSON
-            self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS roles (
-                role_id TEXT PRIMARY KEY,
-                role_name TEXT UNIQUE NOT NULL,
-                permissions TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL
-            )
-            ''')
-            
-            # Insert default roles if they don't exist
-            now = datetime.now().isoformat()
-            self.cursor.execute('''
-            INSERT OR IGNORE INTO roles (role_id, role_name, permissions, created_at, updated_at)
-            VALUES 
-                (?, ?, ?, ?, ?),
-                (?, ?, ?, ?, ?),
-                (?, ?, ?, ?, ?),
-                (?, ?, ?, ?, ?)
-            ''', (
-                str(uuid.uuid4()), 'admin', json.dumps({"all": True, "manage_users": True, "manage_roles": True, "manage_content": True, "social_media": True, "prompting": True}), now, now,
-                str(uuid.uuid4()), 'medium_admin', json.dumps({"view_users": True, "manage_content": True, "social_media": True, "prompting": True}), now, now,
-                str(uuid.uuid4()), 'social_media_handler', json.dumps({"social_media": True, "prompting": True}), now, now,
-                str(uuid.uuid4()), 'basic_user', json.dumps({"prompting": True}), now, now
-            ))
-            
-            # Create api_keys table
-            self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS api_keys (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                api_key TEXT UNIQUE NOT NULL,
-                api_secret TEXT NOT NULL,
-                api_id TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                status TEXT NOT NULL DEFAULT 'Active',
-                FOREIGN KEY(user_id) REFERENCES users(id)
-            )
-            ''')
-            
-            # Create api_role_permissions table
-            self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS api_role_permissions (
-                api_key_id TEXT NOT NULL,
-                permission_name TEXT NOT NULL,
-                FOREIGN KEY(api_key_id) REFERENCES api_keys(id)
-            )
-            ''')
-            
-            # Create user_activity table
-            self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_activity (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                activity_type TEXT NOT NULL,
-                activity_timestamp TEXT NOT NULL,
-                activity_id TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-            ''')
-            
-            # Create activity_details table
-            self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS activity_details (
-                id TEXT PRIMARY KEY,
-                activity_id TEXT NOT NULL,
-                prompt TEXT NOT NULL,
-                prompt_timestamp TEXT NOT NULL,
-                prompt_id TEXT NOT NULL,
-                FOREIGN KEY (activity_id) REFERENCES user_activity(id)
-            )
-            ''')
-            
-            # Create activity_responses table
-            self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS activity_responses (
-                id TEXT PRIMARY KEY,
-                activity_detail_id TEXT NOT NULL,
-                response TEXT NOT NULL,
-                FOREIGN KEY (activity_detail_id) REFERENCES activity_details(id)
-            )
-            ''')
-            
-            # Create user_sessions table
-            self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_sessions (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                token TEXT NOT NULL,
-                expiration_time REAL NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-            ''')
-            
-            # Create role_permissions table
-            self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS role_permissions (
-                id TEXT PRIMARY KEY,
-                role_id TEXT NOT NULL,
-                permission TEXT NOT NULL,
-                FOREIGN KEY (role_id) REFERENCES roles(role_id)
-            )
-            ''')
-            
-            self.conn.commit()
+            with self.pool.connection() as conn:
+                pending = migrations.pending_migrations(conn)
         except sqlite3.Error as e:
-            self.conn.rollback()
-            logging.error(f"Error initializing database: {str(e)}")
-    
+            logging.error(f"Error checking schema version: {str(e)}")
+            return
+        if pending:
+            logging.warning(
+                f"Database schema is {len(pending)} migration(s) behind; run 'python migrations.py' to apply them"
+            )
+
+    def connection(self):
+        """Check a connection out of the pool for the duration of a with-block"""
+        return self.pool.connection()
+
+    def pool_stats(self):
+        """Get connection pool checkout and wait-time metrics"""
+        return self.pool.stats()
+
     def close(self):
-        """Close the database connection"""
-        if hasattr(_thread_local, 'conn'):
-            _thread_local.conn.close()
-            del _thread_local.conn
-            del _thread_local.cursor
-    
+        """Flush queued activity and close the database connection pool"""
+        self.activity.close()
+        self.pool.close()
+
     def create_user(self, username, password, email, full_name=None, bio=None, profile_pic=None, roles=None):
         """Create a new user with secure password hashing"""
         user_id = str(uuid.uuid4())
         hashed_password = self._hash_password(password)
         now = datetime.now().isoformat()
-        
-        try:
-            self.cursor.execute('''
+
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
             INSERT INTO users (id, username, password, full_name, email, bio, profile_pic, created_at, updated_at)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (user_id, username, hashed_password, full_name, email, bio, profile_pic, now, now))
-            
+
             # Add user roles if provided
             if roles:
                 for role_data in roles:
                     role_id = str(uuid.uuid4())
-                    self.cursor.execute('''
+                    cursor.execute('''
                     INSERT INTO user_roles (id, user_id, role)
                     VALUES (?, ?, ?)
                     ''', (role_id, user_id, role_data['role']))
-                    
+
                     # Add permissions for this role
                     if 'permissions' in role_data:
                         for permission in role_data['permissions']:
                             perm_id = str(uuid.uuid4())
-                            self.cursor.execute('''
+                            cursor.execute('''
                             INSERT INTO role_permissions (id, role_id, permission)
                             VALUES (?, ?, ?)
                             ''', (perm_id, role_id, permission))
-            
-            self.conn.commit()
-            return user_id
-        except sqlite3.Error as e:
-            self.conn.rollback()
-            raise e
-    
+
+            epoch = bump_epoch(conn, USER_ROLES_SCOPE) if roles else None
+            conn.commit()
+        if roles:
+            self.permissions.invalidate_user(user_id, epoch)
+        return user_id
+
     def authenticate_user(self, username, password):
         """Authenticate a user by username and password"""
-        self.cursor.execute('''
-        SELECT id, password FROM users WHERE username = ?
-        ''', (username,))
-        
-        result = self.cursor.fetchone()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT id, password FROM users WHERE username = ?
+            ''', (username,))
+
+            result = cursor.fetchone()
         if not result:
             return None
-        
+
         user_id, stored_password = result
-        if self._verify_password(stored_password, password):
-            return user_id
-        return None
-    
+        valid, new_hash = verify_and_update(stored_password, password)
+        if not valid:
+            return None
+        if new_hash:
+            self._store_rehashed_password(user_id, stored_password, new_hash)
+        return user_id
+
+    def _store_rehashed_password(self, user_id, old_hash, new_hash):
+        """Replace an out-of-policy hash, unless the password changed meanwhile"""
+        try:
+            with self.pool.connection() as conn:
+                conn.execute(
+                    "UPDATE users SET password = ? WHERE id = ? AND password = ?",
+                    (new_hash, user_id, old_hash)
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error storing rehashed password: {str(e)}")
+
     def get_user(self, user_id):
         """Get user data by ID"""
-        self.cursor.execute('''
-        SELECT id, username, full_name, email, bio, profile_pic, created_at, updated_at
-        FROM users WHERE id = ?
-        ''', (user_id,))
-        
-        user = self.cursor.fetchone()
-        if not user:
-            return None
-        
-        # Convert to dictionary
-        user_dict = {
-            'id': user[0],
-            'username': user[1],
-            'full_name': user[2],
-            'email': user[3],
-            'bio': user[4],
-            'profile_pic': user[5],
-            'created_at': user[6],
-            'updated_at': user[7],
-            'roles': []
-        }
-        
-        # Get user roles
-        self.cursor.execute('''
-        SELECT id, role FROM user_roles WHERE user_id = ?
-        ''', (user_id,))
-        
-        roles = self.cursor.fetchall()
-        for role_id, role_name in roles:
-            # Get permissions for this role
-            self.cursor.execute('''
-            SELECT permission FROM role_permissions WHERE role_id = ?
-            ''', (role_id,))
-            
-            permissions = [perm[0] for perm in self.cursor.fetchall()]
-            user_dict['roles'].append({
-                'role': role_name,
-                'permissions': permissions
-            })
-        
-        return user_dict
-    
+        return self.get_users([user_id]).get(user_id)
+
+    def get_users(self, user_ids, chunk_size=500):
+        """Get several users with their roles and role permissions
+
+        Loads users in a constant number of queries per chunk of ids: one for
+        the user rows and one JOIN for their roles and role permissions.
+
+        Args:
+            user_ids (list): IDs of the users to load
+            chunk_size (int, optional): Maximum ids bound per IN (...) list. Defaults to 500.
+
+        Returns:
+            dict: User dicts (same shape as get_user) keyed by user ID; unknown IDs are omitted
+        """
+        ids = list(dict.fromkeys(user_ids))
+        users = {}
+
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(ids), chunk_size):
+                chunk = ids[start:start + chunk_size]
+                placeholders = ', '.join('?' * len(chunk))
+
+                cursor.execute(f'''
+                SELECT id, username, full_name, email, bio, profile_pic, created_at, updated_at
+                FROM users WHERE id IN ({placeholders})
+                ''', chunk)
+
+                for user in cursor.fetchall():
+                    users[user[0]] = {
+                        'id': user[0],
+                        'username': user[1],
+                        'full_name': user[2],
+                        'email': user[3],
+                        'bio': user[4],
+                        'profile_pic': user[5],
+                        'created_at': user[6],
+                        'updated_at': user[7],
+                        'roles': []
+                    }
+
+                # Roles and their permissions in one pass, in insertion order
+                cursor.execute(f'''
+                SELECT ur.user_id, ur.rowid, ur.role, rp.permission
+                FROM user_roles ur
+                LEFT JOIN role_permissions rp ON rp.role_id = ur.id
+                WHERE ur.user_id IN ({placeholders})
+                ORDER BY ur.rowid, rp.rowid
+                ''', chunk)
+
+                current_role = None
+                for user_id, role_rowid, role_name, permission in cursor.fetchall():
+                    user_dict = users.get(user_id)
+                    if user_dict is None:
+                        continue
+                    if role_rowid != current_role:
+                        current_role = role_rowid
+                        role_entry = {'role': role_name, 'permissions': []}
+                        user_dict['roles'].append(role_entry)
+                    if permission is not None:
+                        role_entry['permissions'].append(permission)
+
+        return users
+
     def get_user_by_email(self, email):
         """Get user by email address"""
         try:
-            self.cursor.execute('''
-            SELECT id, username, email, full_name, bio, profile_pic, created_at, updated_at 
-            FROM users WHERE email = ?
-            ''', (email,))
-            
-            result = self.cursor.fetchone()
-            if not result:
-                return None
-                
-            user_data = {
-                'id': result[0],
-                'username': result[1],
-                'email': result[2],
-                'full_name': result[3],
-                'bio': result[4],
-                'profile_pic': result[5],
-                'created_at': result[6],
-                'updated_at': result[7]
-            }
-            
-            # Get user roles
-            self.cursor.execute('''
-            SELECT role FROM user_roles WHERE user_id = ?
-            ''', (user_data['id'],))
-            
-            roles = [row[0] for row in self.cursor.fetchall()]
-            user_data['roles'] = roles
-            
-            return user_data
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                SELECT id, username, email, full_name, bio, profile_pic, created_at, updated_at
+                FROM users WHERE email = ?
+                ''', (email,))
+
+                result = cursor.fetchone()
+                if not result:
+                    return None
+
+                user_data = {
+                    'id': result[0],
+                    'username': result[1],
+                    'email': result[2],
+                    'full_name': result[3],
+                    'bio': result[4],
+                    'profile_pic': result[5],
+                    'created_at': result[6],
+                    'updated_at': result[7]
+                }
+
+                # Get user roles
+                cursor.execute('''
+                SELECT role FROM user_roles WHERE user_id = ?
+                ''', (user_data['id'],))
+
+                roles = [row[0] for row in cursor.fetchall()]
+                user_data['roles'] = roles
+
+                return user_data
         except sqlite3.Error as e:
             logging.error(f"Error getting user by email: {str(e)}")
             return None
-            
+
     def update_user_password(self, user_id, new_password):
         """Update a user's password"""
         try:
             # Hash the new password
             hashed_password = self._hash_password(new_password)
             now = datetime.now().isoformat()
-            
-            self.cursor.execute('''
-            UPDATE users 
-            SET password = ?, updated_at = ? 
-            WHERE id = ?
-            ''', (hashed_password, now, user_id))
-            
-            self.conn.commit()
+
+            with self.pool.connection() as conn:
+                conn.execute('''
+                UPDATE users
+                SET password = ?, updated_at = ?
+                WHERE id = ?
+                ''', (hashed_password, now, user_id))
+
+                conn.commit()
+            self.user_cache.invalidate(user_id)
             return True
         except sqlite3.Error as e:
-            self.conn.rollback()
             logging.error(f"Error updating user password: {str(e)}")
             return False
-    
+
+    # Maximum keys created by one create_api_keys call
+    MAX_BULK_API_KEYS = 10000
+
     def create_api_key(self, user_id):
         """Create a new API key for a user
-        
+
         Args:
             user_id (str): The ID of the user to create a key for
-            
+
         Returns:
             dict: API key data including key, secret, and additional information
         """
-        api_key_id = str(uuid.uuid4())
-        api_key = secrets.token_urlsafe(32)
-        api_secret = secrets.token_urlsafe(64)
-        api_id = str(uuid.uuid4())[:8]
-        now = datetime.now().isoformat()
-        
-        # Encrypt the API secret before storing
-        encrypted_secret = self._encrypt_sensitive_data(api_secret)
-        
+        keys = self.create_api_keys([user_id])
+        return keys[0] if keys else None
+
+    def create_api_keys(self, user_ids, count=1, permissions=None):
+        """Create API keys for several users in one transaction
+
+        Ids come from the 'api_key_id' sequence in blocks, and all secrets are
+        drawn from a single random buffer before anything touches the database.
+
+        Args:
+            user_ids (list): The IDs of the users to create keys for
+            count (int, optional): Keys to create per user. Defaults to 1.
+            permissions (list, optional): Permission names for every key. Defaults to ['Standard API access'].
+
+        Returns:
+            list: API key data for each new key, including its secret, or None on failure
+
+        Raises:
+            ValueError: If too many keys are requested or a user ID does not exist
+        """
+        total = len(user_ids) * count
+        if total > self.MAX_BULK_API_KEYS:
+            raise ValueError(f"At most {self.MAX_BULK_API_KEYS} keys can be created at once")
+        if total == 0:
+            return []
+        permissions = list(permissions) if permissions else ['Standard API access']
+
+        # Foreign keys are not enforced, so check the owners before minting anything
         try:
-            self.cursor.execute('''
-            INSERT INTO api_keys (id, user_id, api_key, api_secret, api_id, created_at, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (api_key_id, user_id, api_key, encrypted_secret, api_id, now, 'Active'))
-            
-            # Add default permission for the API key
-            self.cursor.execute('''
-            INSERT INTO api_role_permissions (api_key_id, permission_name)
-            VALUES (?, ?)
-            ''', (api_key_id, 'Standard API access'))
-            
-            self.conn.commit()
-            return {
+            with self.pool.connection() as conn:
+                unknown = [row[0] for row in conn.execute(
+                    "SELECT DISTINCT value FROM json_each(?) WHERE value NOT IN (SELECT id FROM users)",
+                    (json.dumps(user_ids),)
+                )]
+        except sqlite3.Error as e:
+            logging.error(f"Error checking API key owners: {str(e)}")
+            return None
+        if unknown:
+            raise ValueError(f"Unknown user IDs: {', '.join(map(str, unknown))}")
+
+        try:
+            ids = self.api_key_ids.take(total)
+        except sqlite3.Error:
+            return None
+
+        # 32 random bytes per key and 64 per secret, like token_urlsafe(32) and token_urlsafe(64)
+        randomness = secrets.token_bytes(total * 96)
+        encode = base64.urlsafe_b64encode
+        encrypt = self.keyring.encrypt
+        pepper = self.api_key_auth.pepper
+        now = datetime.now().isoformat()
+
+        keys, key_rows, permission_rows = [], [], []
+        owners = [user_id for user_id in user_ids for _ in range(count)]
+        for i, (numeric_id, user_id) in enumerate(zip(ids, owners)):
+            chunk = randomness[i * 96:(i + 1) * 96]
+            api_key = encode(chunk[:32]).rstrip(b'=').decode()
+            api_secret = encode(chunk[32:]).rstrip(b'=').decode()
+            api_key_id = str(numeric_id).zfill(5)
+
+            key_rows.append((api_key_id, user_id, api_key, encrypt(api_secret), api_key_id, now, 'Active',
+                             key_prefix(api_key), hash_secret(pepper, api_secret)))
+            permission_rows.extend((api_key_id, permission) for permission in permissions)
+            keys.append({
                 'id': api_key_id,
+                'user_id': user_id,
                 'api_key': api_key,
                 'api_secret': api_secret,  # Return the unencrypted secret to the user once
-                'api_id': api_id,
+                'api_id': api_key_id,
                 'created_at': now,
                 'status': 'Active',
-                'permissions': ['Standard API access']
-            }
+                'permissions': permissions
+            })
+
+        try:
+            with self.pool.connection() as conn:
+                try:
+                    conn.executemany('''
+                    INSERT INTO api_keys (id, user_id, api_key, api_secret, api_id, created_at, status, key_prefix, secret_hash)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', key_rows)
+                    conn.executemany('''
+                    INSERT INTO api_role_permissions (api_key_id, permission_name)
+                    VALUES (?, ?)
+                    ''', permission_rows)
+                    conn.commit()
+                except sqlite3.Error:
+                    conn.rollback()
+                    raise
+            return keys
         except sqlite3.Error as e:
-            self.conn.rollback()
-            logging.error(f"Error creating API key: {str(e)}")
+            logging.error(f"Error creating API keys: {str(e)}")
             return None
-    
+
     def verify_api_key(self, api_key, api_secret):
-        """Verify an API key and secret"""
-        self.cursor.execute('''
-        SELECT id, user_id, api_secret FROM api_keys WHERE api_key = ?
-        ''', (api_key,))
-        
-        result = self.cursor.fetchone()
-        if not result:
-            return None
-        
-        key_id, user_id, encrypted_secret = result
-        decrypted_secret = self._decrypt_sensitive_data(encrypted_secret)
-        
-        if decrypted_secret == api_secret:
-            return user_id
-        return None
-    
+        """Verify an API key and secret
+
+        Returns:
+            str: The owning user's ID if the credentials are valid, None otherwise
+        """
+        verified = self.api_key_auth.authenticate(api_key, api_secret)
+        return verified['user_id'] if verified else None
+
     def log_user_activity(self, user_id, activity_type, prompt, response=None):
-        """Log user activity including prompts and responses"""
-        activity_id = str(uuid.uuid4())
-        prompt_id = str(uuid.uuid4())
-        now = datetime.now().isoformat()
-        
+        """Log user activity including prompts and responses
+
+        The rows are written by a background thread in batches, so they may
+        not be visible to readers for up to ``activity.flush_interval``
+        seconds; call ``self.activity.flush()`` to wait for them.
+
+        Returns:
+            str: The activity ID, or None if the activity queue was full
+        """
+        return self.activity.submit(user_id, activity_type, prompt, response)
+
+    def get_prompt_history(self, user_id=None, query=None, limit=20, cursor=None, sort=None):
+        """Get one page of logged prompts, newest first or ranked by a full-text search
+
+        Prompts are queued by log_user_activity, so the latest ones may
+        appear only after the activity writer's next flush.
+
+        Args:
+            user_id (str, optional): Only this user's prompts; None for every user. Defaults to None.
+            query (str, optional): Words to search for. Defaults to None.
+            limit (int, optional): Maximum items per page (1-100). Defaults to 20.
+            cursor (str, optional): The next_cursor returned for the previous page. Defaults to None.
+            sort (str, optional): 'relevance' or 'recent'. Defaults to relevance when searching.
+
+        Returns:
+            dict: 'items' (list of prompt dicts) and 'next_cursor' (str or None)
+
+        Raises:
+            ValueError: If the sort key or cursor is invalid
+        """
         try:
-            # Create activity entry
-            self.cursor.execute('''
-            INSERT INTO user_activity (id, user_id, activity_type, activity_timestamp, activity_id)
-            VALUES (?, ?, ?, ?, ?)
-            ''', (activity_id, user_id, activity_type, now, activity_id))
-            
-            # Create activity detail entry
-            detail_id = str(uuid.uuid4())
-            self.cursor.execute('''
-            INSERT INTO activity_details (id, activity_id, prompt, prompt_timestamp, prompt_id)
-            VALUES (?, ?, ?, ?, ?)
-            ''', (detail_id, activity_id, prompt, now, prompt_id))
-            
-            # Add response if provided
-            if response:
-                if isinstance(response, list):
-                    for resp in response:
-                        resp_id = str(uuid.uuid4())
-                        self.cursor.execute('''
-                        INSERT INTO activity_responses (id, activity_detail_id, response)
-                        VALUES (?, ?, ?)
-                        ''', (resp_id, detail_id, resp))
-                else:
-                    resp_id = str(uuid.uuid4())
-                    self.cursor.execute('''
-                    INSERT INTO activity_responses (id, activity_detail_id, response)
-                    VALUES (?, ?, ?)
-                    ''', (resp_id, detail_id, response))
-            
-            self.conn.commit()
-            return activity_id
+            return self.prompts.history(user_id=user_id, query=query, limit=limit, cursor=cursor, sort=sort)
         except sqlite3.Error as e:
-            self.conn.rollback()
-            raise e
-    
+            logging.error(f"Error getting prompt history: {str(e)}")
+            return {'items': [], 'next_cursor': None}
+
     def get_all_users(self):
         """Get a list of all users with basic information"""
-        self.cursor.execute('''
-        SELECT id, username, full_name, email, profile_pic FROM users
-        ''')
-        
-        users = []
-        for user in self.cursor.fetchall():
-            user_id = user[0]
-            
-            # Get the first role for each user (simplified)
-            self.cursor.execute('''
-            SELECT role FROM user_roles WHERE user_id = ? LIMIT 1
-            ''', (user_id,))
-            
-            role_result = self.cursor.fetchone()
-            role = role_result[0] if role_result else "Basic User"
-            
-            users.append({
-                'id': user_id,
-                'username': user[1],
-                'full_name': user[2],
-                'email': user[3],
-                'profile_pic': user[4],
-                'role': role
-            })
-        
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT u.id, u.username, u.full_name, u.email, u.profile_pic,
+                   (SELECT role FROM user_roles WHERE user_id = u.id ORDER BY rowid LIMIT 1)
+            FROM users u
+            ''')
+
+            users = []
+            for user in cursor.fetchall():
+                users.append({
+                    'id': user[0],
+                    'username': user[1],
+                    'full_name': user[2],
+                    'email': user[3],
+                    'profile_pic': user[4],
+                    'role': user[5] if user[5] else "Basic User"
+                })
+
         return users
-    
+
+    # Sort keys accepted by list_users, mapped to their SQL expression.
+    # Each one is backed by an index ending in the id tie-breaker.
+    USER_SORT_KEYS = {
+        'username': "u.username",
+        'email': "u.email",
+        'full_name': "COALESCE(u.full_name, '')",
+        'created_at': "u.created_at",
+    }
+
+    def list_users(self, limit=50, cursor=None, search=None, sort='username', descending=False, role=None):
+        """Get one page of users using keyset (cursor) pagination
+
+        Each page is a single indexed query, so its cost does not depend on
+        how deep into the listing the caller is.
+
+        Args:
+            limit (int, optional): Maximum users per page (1-200). Defaults to 50.
+            cursor (str, optional): The next_cursor returned for the previous page. Defaults to None.
+            search (str, optional): Substring matched against username, email and full name. Defaults to None.
+            sort (str, optional): One of USER_SORT_KEYS. Defaults to 'username'.
+            descending (bool, optional): Sort in descending order. Defaults to False.
+            role (str, optional): Only include users that have this role. Defaults to None.
+
+        Returns:
+            dict: 'users' (list of user dicts like get_all_users) and 'next_cursor' (str or None)
+
+        Raises:
+            ValueError: If the sort key or cursor is invalid
+        """
+        if sort not in self.USER_SORT_KEYS:
+            raise ValueError(f"Invalid sort key: {sort}")
+        limit = max(1, min(int(limit), 200))
+        sort_expr = self.USER_SORT_KEYS[sort]
+
+        where = []
+        params = []
+        if search:
+            pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            where.append("(u.username LIKE ? ESCAPE '\\' OR u.email LIKE ? ESCAPE '\\' OR u.full_name LIKE ? ESCAPE '\\')")
+            params.extend([pattern, pattern, pattern])
+        if role:
+            where.append("EXISTS (SELECT 1 FROM user_roles r WHERE r.user_id = u.id AND r.role = ?)")
+            params.append(role)
+        if cursor:
+            last_sort_value, last_id = self._decode_user_cursor(cursor, sort)
+            # Equivalent to (sort, id) > (?, ?), written so the leading term is an index range
+            op = '<' if descending else '>'
+            where.append(f"{sort_expr} {op}= ? AND ({sort_expr} {op} ? OR u.id {op} ?)")
+            params.extend([last_sort_value, last_sort_value, last_id])
+
+        direction = 'DESC' if descending else 'ASC'
+        query = f'''
+        SELECT u.id, u.username, u.full_name, u.email, u.profile_pic,
+               (SELECT role FROM user_roles WHERE user_id = u.id ORDER BY rowid LIMIT 1),
+               {sort_expr}
+        FROM users u
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY {sort_expr} {direction}, u.id {direction}
+        LIMIT ?
+        '''
+        params.append(limit + 1)
+
+        with self.pool.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self._encode_user_cursor(sort, rows[-1][6], rows[-1][0])
+
+        users = [{
+            'id': row[0],
+            'username': row[1],
+            'full_name': row[2],
+            'email': row[3],
+            'profile_pic': row[4],
+            'role': row[5] if row[5] else "Basic User"
+        } for row in rows]
+
+        return {'users': users, 'next_cursor': next_cursor}
+
+    def _encode_user_cursor(self, sort, sort_value, user_id):
+        """Encode the position after the last row of a page as an opaque token"""
+        payload = json.dumps([sort, sort_value, user_id], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def _decode_user_cursor(self, cursor, sort):
+        """Decode a list_users cursor, checking it was issued for the same sort key"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            cursor_sort, sort_value, user_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        except (ValueError, TypeError):
+            raise ValueError("Invalid cursor")
+        if cursor_sort != sort:
+            raise ValueError("Cursor does not match the requested sort order")
+        return sort_value, user_id
+
     def check_user_exists(self, username=None, email=None):
         """Check if a user with the given username or email already exists"""
-        if username and email:
-            self.cursor.execute('''
-            SELECT id, username, email FROM users WHERE username = ? OR email = ?
-            ''', (username, email))
-        elif username:
-            self.cursor.execute('''
-            SELECT id, username, email FROM users WHERE username = ?
-            ''', (username,))
-        elif email:
-            self.cursor.execute('''
-            SELECT id, username, email FROM users WHERE email = ?
-            ''', (email,))
-        else:
+        if not username and not email:
             return None
-            
-        result = self.cursor.fetchone()
+
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            if username and email:
+                cursor.execute('''
+                SELECT id, username, email FROM users WHERE username = ? OR email = ?
+                ''', (username, email))
+            elif username:
+                cursor.execute('''
+                SELECT id, username, email FROM users WHERE username = ?
+                ''', (username,))
+            else:
+                cursor.execute('''
+                SELECT id, username, email FROM users WHERE email = ?
+                ''', (email,))
+
+            result = cursor.fetchone()
         if not result:
             return None
-            
+
         # Return information about the existing user
         return {
             'id': result[0],
@@ -546,192 +643,157 @@ class Database:
             'duplicate_username': username and result[1].lower() == username.lower(),
             'duplicate_email': email and result[2].lower() == email.lower()
         }
-    
+
     def store_session_token(self, user_id, session_token, expiration_time):
         """Store a session token with its expiration time"""
-        try:
-            token_id = str(uuid.uuid4())
-            self.cursor.execute('''
-            INSERT INTO user_sessions (id, user_id, token, expiration_time)
-            VALUES (?, ?, ?, ?)
-            ''', (token_id, user_id, session_token, expiration_time))
-            
-            self.conn.commit()
-            return True
-        except sqlite3.Error as e:
-            self.conn.rollback()
-            logging.error(f"Error storing session token: {str(e)}")
-            return False
-    
+        return self.sessions.create(user_id, session_token, expiration_time)
+
     def validate_session_token(self, session_token):
         """Validate a session token and return user_id if valid"""
-        try:
-            current_time = time.time()
-            self.cursor.execute('''
-            SELECT user_id, expiration_time FROM user_sessions 
-            WHERE token = ? AND expiration_time > ?
-            ''', (session_token, current_time))
-            
-            result = self.cursor.fetchone()
-            if not result:
-                return None
-                
-            return result[0]  # Return user_id
-        except sqlite3.Error as e:
-            logging.error(f"Error validating session token: {str(e)}")
-            return None
-    
-    def update_user(self, user_id, updates):
-        """Update user information
-        
-        Args:
-            user_id (int): The ID of the user to update
-            updates (dict): Dictionary of fields to update
-            
+        return self.sessions.validate(session_token)
+
+    def revoke_session_token(self, session_token):
+        """Delete a session token so it can no longer be validated"""
+        return self.sessions.revoke(session_token)
+
+    def revoke_user_sessions(self, user_id):
+        """Invalidate every session of a user: stored, signed and browser sessions
+
         Returns:
-            bool: True if successful, False otherwise
+            int: Number of stored sessions deleted
         """
+        self.signed_sessions.revoke_user(user_id)
         try:
-            # Build the SET clause dynamically based on the updates dictionary
-            set_clause = []
-            values = []
-            
-            for field, value in updates.items():
-                set_clause.append(f"{field} = ?")
-                values.append(value)
-            
-            # Add updated_at timestamp
-            set_clause.append("updated_at = ?")
-            values.append(datetime.now().isoformat())
-            
-            # Add user_id to values
-            values.append(user_id)
-            
-            # Execute the update query
-            query = f"UPDATE users SET {', '.join(set_clause)} WHERE id = ?"
-            self.cursor.execute(query, values)
-            
-            self.conn.commit()
-            return True
+            with self.pool.connection() as conn:
+                conn.execute("DELETE FROM web_sessions WHERE user_id = ?", (user_id,))
+                conn.commit()
         except sqlite3.Error as e:
-            self.conn.rollback()
-            logging.error(f"Error updating user: {str(e)}")
-            return False
-    
+            logging.error(f"Error deleting browser sessions: {str(e)}")
+        return self.sessions.revoke_user_sessions(user_id)
+
     def get_user_by_username(self, username):
         """Get user by username
-        
+
         Args:
             username (str): The username to look up
-            
+
         Returns:
             dict: User data if found, None otherwise
         """
         try:
-            self.cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-            user = self.cursor.fetchone()
-            
-            if not user:
-                return None
-                
-            # Convert row to dictionary
-            columns = [col[0] for col in self.cursor.description]
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+                user = cursor.fetchone()
+
+                if not user:
+                    return None
+
+                # Convert row to dictionary
+                columns = [col[0] for col in cursor.description]
             user_data = {columns[i]: user[i] for i in range(len(columns))}
-            
+
             return user_data
         except sqlite3.Error as e:
             logging.error(f"Error getting user by username: {str(e)}")
             return None
-    
+
     def get_user_api_keys(self, user_id):
         """Get all API keys for a user
-        
+
         Args:
             user_id (str): The ID of the user to get keys for
-            
+
         Returns:
             list: List of API keys for the user with detailed information
         """
         try:
-            self.cursor.execute("""
-            SELECT id, api_key, created_at, status 
-            FROM api_keys 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC
-            """, (user_id,))
-            
-            keys = self.cursor.fetchall()
-            
-            # Convert rows to dictionaries
-            result = []
-            for key in keys:
-                # Get permissions for this key (default to standard API access if none found)
-                self.cursor.execute("""
-                SELECT permission_name FROM api_role_permissions 
-                WHERE api_key_id = ?
-                """, (key[0],))
-                
-                permissions = self.cursor.fetchall()
-                permission_list = [p[0] for p in permissions] if permissions else ["Standard API access"]
-                
-                result.append({
-                    'id': key[0],
-                    'api_key': key[1],
-                    'created_at': key[2],
-                    'status': key[3] if key[3] else 'Active',  # Default to Active if status is NULL
-                    'permissions': permission_list
-                })
-            
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                SELECT id, api_key, created_at, status
+                FROM api_keys
+                WHERE user_id = ?
+                ORDER BY created_at DESC
+                """, (user_id,))
+
+                keys = cursor.fetchall()
+
+                # Convert rows to dictionaries
+                result = []
+                for key in keys:
+                    # Get permissions for this key (default to standard API access if none found)
+                    cursor.execute("""
+                    SELECT permission_name FROM api_role_permissions
+                    WHERE api_key_id = ?
+                    """, (key[0],))
+
+                    permissions = cursor.fetchall()
+                    permission_list = [p[0] for p in permissions] if permissions else ["Standard API access"]
+
+                    result.append({
+                        'id': key[0],
+                        'api_key': key[1],
+                        'created_at': key[2],
+                        'status': key[3] if key[3] else 'Active',  # Default to Active if status is NULL
+                        'permissions': permission_list
+                    })
+
             return result
         except sqlite3.Error as e:
             logging.error(f"Error getting user API keys: {str(e)}")
             return []
-    
+
     def delete_api_key(self, api_key_id, user_id):
         """Delete an API key
-        
+
         Args:
             api_key_id (str): The ID of the API key to delete
             user_id (str): The ID of the user who owns the key (for security)
-            
+
         Returns:
             bool: True if the key was deleted, False otherwise
         """
         try:
-            # First check if the key belongs to the user
-            self.cursor.execute("""
-            SELECT id FROM api_keys 
-            WHERE id = ? AND user_id = ?
-            """, (api_key_id, user_id))
-            
-            key = self.cursor.fetchone()
-            if not key:
-                return False
-            
-            # Delete the key
-            self.cursor.execute("DELETE FROM api_keys WHERE id = ?", (api_key_id,))
-            
-            # Delete associated permissions if they exist
-            self.cursor.execute("DELETE FROM api_role_permissions WHERE api_key_id = ?", (api_key_id,))
-            
-            self.conn.commit()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+
+                # First check if the key belongs to the user
+                cursor.execute("""
+                SELECT id FROM api_keys
+                WHERE id = ? AND user_id = ?
+                """, (api_key_id, user_id))
+
+                key = cursor.fetchone()
+                if not key:
+                    return False
+
+                # Delete the key
+                cursor.execute("DELETE FROM api_keys WHERE id = ?", (api_key_id,))
+
+                # Delete associated permissions if they exist
+                cursor.execute("DELETE FROM api_role_permissions WHERE api_key_id = ?", (api_key_id,))
+
+                conn.commit()
+            self.api_key_auth.invalidate(api_key_id)
             return True
         except sqlite3.Error as e:
-            self.conn.rollback()
             logging.error(f"Error deleting API key: {str(e)}")
             return False
-    
+
     # Role management methods
     def get_all_roles(self):
         """Get all roles
-        
+
         Returns:
             list: List of all roles with their permissions
         """
         try:
-            self.cursor.execute("SELECT role_id, role_name, permissions, created_at, updated_at FROM roles ORDER BY role_name")
-            roles = self.cursor.fetchall()
-            
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT role_id, role_name, permissions, created_at, updated_at FROM roles ORDER BY role_name")
+                roles = cursor.fetchall()
+
             result = []
             for role in roles:
                 # Handle NULL permissions by providing an empty dict
@@ -741,7 +803,7 @@ class Database:
                         permissions = json.loads(role[2])
                     except json.JSONDecodeError:
                         permissions = {}
-                
+
                 result.append({
                     'role_id': role[0],
                     'role_name': role[1],
@@ -749,34 +811,37 @@ class Database:
                     'created_at': role[3],
                     'updated_at': role[4]
                 })
-            
+
             return result
         except sqlite3.Error as e:
             logging.error(f"Error getting all roles: {str(e)}")
             return []
-    
+
     def get_role(self, role_id=None, role_name=None):
         """Get a role by ID or name
-        
+
         Args:
             role_id (str, optional): The ID of the role to get
             role_name (str, optional): The name of the role to get
-            
+
         Returns:
             dict: Role data if found, None otherwise
         """
         try:
-            if role_id:
-                self.cursor.execute("SELECT role_id, role_name, permissions, created_at, updated_at FROM roles WHERE role_id = ?", (role_id,))
-            elif role_name:
-                self.cursor.execute("SELECT role_id, role_name, permissions, created_at, updated_at FROM roles WHERE role_name = ?", (role_name,))
-            else:
+            if not role_id and not role_name:
                 return None
-                
-            role = self.cursor.fetchone()
+
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                if role_id:
+                    cursor.execute("SELECT role_id, role_name, permissions, created_at, updated_at FROM roles WHERE role_id = ?", (role_id,))
+                else:
+                    cursor.execute("SELECT role_id, role_name, permissions, created_at, updated_at FROM roles WHERE role_name = ?", (role_name,))
+
+                role = cursor.fetchone()
             if not role:
                 return None
-                
+
             # Handle NULL permissions by providing an empty dict
             permissions = {}
             if role[2] is not None:
@@ -784,7 +849,7 @@ class Database:
                     permissions = json.loads(role[2])
                 except json.JSONDecodeError:
                     permissions = {}
-            
+
             return {
                 'role_id': role[0],
                 'role_name': role[1],
@@ -795,14 +860,15 @@ class Database:
         except sqlite3.Error as e:
             logging.error(f"Error getting role: {str(e)}")
             return None
-    
-    def create_role(self, role_name, permissions):
+
+    def create_role(self, role_name, permissions, inherits=None):
         """Create a new role
-        
+
         Args:
             role_name (str): The name of the role
             permissions (dict): Dictionary of permissions
-            
+            inherits (list, optional): Names of roles whose permissions this role also grants
+
         Returns:
             dict: Role data if created, None otherwise
         """
@@ -810,36 +876,44 @@ class Database:
             # Check if role already exists
             if self.get_role(role_name=role_name):
                 return None
-                
+
             role_id = str(uuid.uuid4())
             now = datetime.now().isoformat()
-            
-            self.cursor.execute("""
-            INSERT INTO roles (role_id, role_name, permissions, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?)
-            """, (role_id, role_name, json.dumps(permissions), now, now))
-            
-            self.conn.commit()
-            
+
+            with self.pool.connection() as conn:
+                conn.execute("""
+                INSERT INTO roles (role_id, role_name, permissions, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                """, (role_id, role_name, json.dumps(permissions), now, now))
+                if inherits:
+                    set_role_parents(conn, role_name, inherits)
+
+                epoch = bump_epoch(conn, ROLES_SCOPE)
+                conn.commit()
+            self.permissions.invalidate_roles(epoch)
+
             return {
                 'role_id': role_id,
                 'role_name': role_name,
                 'permissions': permissions,
+                'inherits': sorted(set(inherits or ())),
                 'created_at': now,
                 'updated_at': now
             }
+        except RoleHierarchyError as e:
+            logging.error(f"Error creating role: {str(e)}")
+            return None
         except sqlite3.Error as e:
-            self.conn.rollback()
             logging.error(f"Error creating role: {str(e)}")
             return None
-    
+
     def update_role(self, role_id, updates):
         """Update a role
-        
+
         Args:
             role_id (str): The ID of the role to update
-            updates (dict): Dictionary of fields to update
-            
+            updates (dict): Dictionary of fields to update; 'inherits' replaces the role's parents
+
         Returns:
             bool: True if successful, False otherwise
         """
@@ -848,42 +922,48 @@ class Database:
             role = self.get_role(role_id=role_id)
             if not role:
                 return False
-                
+
             set_clause = []
             values = []
-            
+
             if 'role_name' in updates:
                 set_clause.append("role_name = ?")
                 values.append(updates['role_name'])
-                
+
             if 'permissions' in updates:
                 set_clause.append("permissions = ?")
                 values.append(json.dumps(updates['permissions']))
-                
+
             # Add updated_at timestamp
             set_clause.append("updated_at = ?")
             values.append(datetime.now().isoformat())
-            
+
             # Add role_id to values
             values.append(role_id)
-            
+
             # Execute the update query
             query = f"UPDATE roles SET {', '.join(set_clause)} WHERE role_id = ?"
-            self.cursor.execute(query, values)
-            
-            self.conn.commit()
+            with self.pool.connection() as conn:
+                conn.execute(query, values)
+                if 'inherits' in updates:
+                    set_role_parents(conn, updates.get('role_name', role['role_name']), updates['inherits'])
+                epoch = bump_epoch(conn, ROLES_SCOPE)
+                conn.commit()
+            self.permissions.invalidate_roles(epoch)
             return True
+        except RoleHierarchyError as e:
+            logging.error(f"Error updating role: {str(e)}")
+            return False
         except sqlite3.Error as e:
-            self.conn.rollback()
             logging.error(f"Error updating role: {str(e)}")
             return False
-    
+
     def delete_role(self, role_id):
         """Delete a role
-        
+
         Args:
             role_id (str): The ID of the role to delete
-            
+
         Returns:
             bool: True if successful, False otherwise
         """
@@ -892,163 +972,209 @@ class Database:
             role = self.get_role(role_id=role_id)
             if not role:
                 return False
-                
+
             # Don't allow deleting default roles
             if role['role_name'] in ['admin', 'medium_admin', 'social_media_handler', 'basic_user']:
                 return False
-                
-            # Delete the role
-            self.cursor.execute("DELETE FROM roles WHERE role_id = ?", (role_id,))
-            
-            # Update users with this role to basic_user
-            basic_role = self.get_role(role_name='basic_user')
-            if basic_role:
-                self.cursor.execute("UPDATE user_roles SET role = ? WHERE role = ?", (basic_role['role_name'], role['role_name']))
-            
-            self.conn.commit()
+
+            with self.pool.connection() as conn:
+                # Roles that inherited from this one lose its ancestors too
+                children = [row[0] for row in conn.execute(
+                    "SELECT role_name FROM role_parents WHERE parent_name = ?", (role['role_name'],)
+                )]
+
+                # Delete the role
+                conn.execute("DELETE FROM roles WHERE role_id = ?", (role_id,))
+                if children:
+                    refresh_role_closure(conn, children)
+
+                # Update users with this role to basic_user
+                basic_role = self.get_role(role_name='basic_user')
+                if basic_role:
+                    conn.execute("UPDATE user_roles SET role = ? WHERE role = ?", (basic_role['role_name'], role['role_name']))
+
+                epoch = bump_epoch(conn, ROLES_SCOPE)
+                conn.commit()
+            self.permissions.invalidate_roles(epoch)
             return True
         except sqlite3.Error as e:
-            self.conn.rollback()
             logging.error(f"Error deleting role: {str(e)}")
             return False
-    
+
+    def get_role_inheritance(self, role_name):
+        """Get the roles a role inherits from
+
+        Args:
+            role_name (str): The name of the role
+
+        Returns:
+            dict: {'parents': direct parent names, 'ancestors': {name: depth}} for every inherited role
+        """
+        try:
+            with self.pool.connection() as conn:
+                return {
+                    'parents': get_role_parents(conn, role_name),
+                    'ancestors': get_role_ancestors(conn, role_name),
+                }
+        except sqlite3.Error as e:
+            logging.error(f"Error getting role inheritance: {str(e)}")
+            return {'parents': [], 'ancestors': {}}
+
     def get_user_roles(self, user_id):
         """Get all roles for a user
-        
+
         Args:
             user_id (str): The ID of the user to get roles for
-            
+
         Returns:
             list: List of role names for the user
         """
         try:
-            self.cursor.execute("""
-            SELECT role FROM user_roles 
-            WHERE user_id = ?
-            """, (user_id,))
-            
-            roles = self.cursor.fetchall()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                SELECT role FROM user_roles
+                WHERE user_id = ?
+                """, (user_id,))
+
+                roles = cursor.fetchall()
             return [role[0] for role in roles]
         except sqlite3.Error as e:
             logging.error(f"Error getting user roles: {str(e)}")
             return []
-    
+
     def get_user_permissions(self, user_id):
         """Get all permissions for a user based on their roles
-        
+
         Args:
             user_id (str): The ID of the user to get permissions for
-            
+
         Returns:
             dict: Combined permissions from all user roles
         """
         try:
-            # Get user roles
-            user_roles = self.get_user_roles(user_id)
-            
-            # Get permissions for each role
-            permissions = {}
-            for role_name in user_roles:
-                # Ensure role_name is lowercase to match database entries
-                role = self.get_role(role_name=role_name.lower())
-                if role and 'permissions' in role:
-                    for perm, value in role['permissions'].items():
-                        if value:
-                            permissions[perm] = True
-            
-            return permissions
+            return self.permissions.get_user_permissions(user_id)
         except Exception as e:
             logging.error(f"Error getting user permissions: {str(e)}")
             return {}
-    
+
     def has_permission(self, user_id, permission):
         """Check if a user has a specific permission
-        
+
         Args:
             user_id (str): The ID of the user to check
             permission (str): The permission to check for
-            
+
         Returns:
             bool: True if the user has the permission, False otherwise
         """
         try:
-            permissions = self.get_user_permissions(user_id)
-            return permissions.get('all', False) or permissions.get(permission, False)
+            return self.permissions.has_permission(user_id, permission)
         except Exception as e:
             logging.error(f"Error checking permission: {str(e)}")
             return False
-    
+
+    def get_users_with_permission(self, permission, include_all=True):
+        """Get the IDs of every user granted a permission
+
+        Reads the trigger-maintained user_effective_permissions table, so this
+        is an index range scan rather than a walk over every role's JSON.
+
+        Args:
+            permission (str): The permission to look up
+            include_all (bool, optional): Also count users holding 'all'. Defaults to True.
+
+        Returns:
+            list: Sorted user IDs
+        """
+        try:
+            with self.connection() as conn:
+                query = "SELECT user_id FROM user_effective_permissions WHERE permission = ? ORDER BY user_id"
+                user_ids = {row[0] for row in conn.execute(query, (permission,))}
+                if include_all and permission != 'all':
+                    user_ids.update(row[0] for row in conn.execute(query, ('all',)))
+            return sorted(user_ids)
+        except sqlite3.Error as e:
+            logging.error(f"Error getting users with permission: {str(e)}")
+            return []
+
     def assign_role_to_user(self, user_id, role_name):
         """Assign a role to a user
-        
+
         Args:
             user_id (str): The ID of the user
             role_name (str): The name of the role to assign
-            
+
         Returns:
             bool: True if successful, False otherwise
         """
         try:
-            # Check if role exists
-            role = self.get_role(role_name=role_name)
-            if not role:
-                return False
-                
-            # Check if user already has this role
-            user_roles = self.get_user_roles(user_id)
-            if role_name in user_roles:
-                return True
-                
-            # Add role to user
-            role_id = str(uuid.uuid4())
-            self.cursor.execute("""
-            INSERT INTO user_roles (id, user_id, role)
-            VALUES (?, ?, ?)
-            """, (role_id, user_id, role_name))
-            
-            self.conn.commit()
+            with self.pool.connection() as conn:
+                # Check if role exists
+                role = self.get_role(role_name=role_name)
+                if not role:
+                    return False
+
+                # Check if user already has this role
+                user_roles = self.get_user_roles(user_id)
+                if role_name in user_roles:
+                    return True
+
+                # Add role to user
+                role_id = str(uuid.uuid4())
+                conn.execute("""
+                INSERT INTO user_roles (id, user_id, role)
+                VALUES (?, ?, ?)
+                """, (role_id, user_id, role_name))
+
+                epoch = bump_epoch(conn, USER_ROLES_SCOPE)
+                conn.commit()
+            self.permissions.invalidate_user(user_id, epoch)
             return True
         except sqlite3.Error as e:
-            self.conn.rollback()
             logging.error(f"Error assigning role to user: {str(e)}")
             return False
-    
+
     def remove_role_from_user(self, user_id, role_name):
         """Remove a role from a user
-        
+
         Args:
             user_id (str): The ID of the user
             role_name (str): The name of the role to remove
-            
+
         Returns:
             bool: True if successful, False otherwise
         """
         try:
-            # Delete the role assignment
-            self.cursor.execute("""
-            DELETE FROM user_roles 
-            WHERE user_id = ? AND role = ?
-            """, (user_id, role_name))
-            
-            # Ensure user has at least one role (basic_user)
-            user_roles = self.get_user_roles(user_id)
-            if not user_roles:
-                self.assign_role_to_user(user_id, 'basic_user')
-            
-            self.conn.commit()
+            with self.pool.connection() as conn:
+                # Delete the role assignment
+                conn.execute("""
+                DELETE FROM user_roles
+                WHERE user_id = ? AND role = ?
+                """, (user_id, role_name))
+
+                # Ensure user has at least one role (basic_user), in this same transaction
+                if not conn.execute("SELECT 1 FROM user_roles WHERE user_id = ? LIMIT 1", (user_id,)).fetchone():
+                    conn.execute("""
+                    INSERT INTO user_roles (id, user_id, role)
+                    SELECT ?, ?, role_name FROM roles WHERE role_name = 'basic_user'
+                    """, (str(uuid.uuid4()), user_id))
+
+                epoch = bump_epoch(conn, USER_ROLES_SCOPE)
+                conn.commit()
+            self.permissions.invalidate_user(user_id, epoch)
             return True
         except sqlite3.Error as e:
-            self.conn.rollback()
             logging.error(f"Error removing role from user: {str(e)}")
             return False
-    
+
     def update_user(self, user_id, update_data):
         """Update user details
-        
+
         Args:
             user_id (int): The ID of the user to update
             update_data (dict): Dictionary containing the fields to update
-            
+
         Returns:
             bool: True if successful, False otherwise
         """
@@ -1056,91 +1182,135 @@ class Database:
             # Build the SQL query dynamically based on the fields to update
             fields = []
             values = []
-            
+
             for field, value in update_data.items():
                 fields.append(f"{field} = ?")
                 values.append(value)
-            
+
+            # Add updated_at timestamp; cached users are revalidated against it
+            fields.append("updated_at = ?")
+            values.append(datetime.now().isoformat())
+
             # Add the user_id to the values list
             values.append(user_id)
-            
+
             # Construct the SQL query
             sql = f"UPDATE users SET {', '.join(fields)} WHERE id = ?"
-            
+
             # Execute the query
-            self.cursor.execute(sql, values)
-            self.conn.commit()
-            
+            with self.pool.connection() as conn:
+                conn.execute(sql, values)
+                conn.commit()
+            self.user_cache.invalidate(user_id)
+
             return True
         except sqlite3.Error as e:
             logging.error(f"Error updating user: {str(e)}")
             return False
-    
+
     def delete_user(self, user_id):
         """Delete a user
-        
+
         Args:
             user_id (int): The ID of the user to delete
-            
+
         Returns:
             bool: True if successful, False otherwise
         """
         try:
-            # Start a transaction
-            self.conn.execute("BEGIN TRANSACTION")
-            
-            # Delete user roles
-            self.cursor.execute("DELETE FROM user_roles WHERE user_id = ?", (user_id,))
-            
-            # Delete user API keys
-            self.cursor.execute("DELETE FROM api_keys WHERE user_id = ?", (user_id,))
-            
-            # Delete the user
-            self.cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-            
-            # Commit the transaction
-            self.conn.commit()
-            
+            with self.pool.connection() as conn:
+                # Start a transaction
+                conn.execute("BEGIN TRANSACTION")
+
+                # Delete user roles
+                conn.execute("DELETE FROM user_roles WHERE user_id = ?", (user_id,))
+
+                # Delete user API keys and their permissions
+                key_ids = [row[0] for row in conn.execute("SELECT id FROM api_keys WHERE user_id = ?", (user_id,))]
+                conn.executemany("DELETE FROM api_role_permissions WHERE api_key_id = ?", [(key_id,) for key_id in key_ids])
+                conn.execute("DELETE FROM api_keys WHERE user_id = ?", (user_id,))
+
+                # Delete the user
+                conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+
+                epoch = bump_epoch(conn, USER_ROLES_SCOPE)
+
+                # Commit the transaction
+                conn.commit()
+            self.permissions.invalidate_user(user_id, epoch)
+            self.user_cache.invalidate(user_id)
+            for key_id in key_ids:
+                self.api_key_auth.invalidate(key_id)
+
             return True
         except sqlite3.Error as e:
-            # Rollback the transaction in case of error
-            self.conn.rollback()
+            # The pool rolls the transaction back in case of error
             logging.error(f"Error deleting user: {str(e)}")
             return False
-    
+
     def update_user_roles(self, user_id, roles):
         """Update a user's roles
-        
+
         Args:
             user_id (int): The ID of the user to update roles for
             roles (list): List of role names to assign to the user
-            
+
         Returns:
             bool: True if successful, False otherwise
         """
         try:
-            # Start a transaction
-            self.conn.execute("BEGIN TRANSACTION")
-            
-            # Delete existing roles
-            self.cursor.execute("DELETE FROM user_roles WHERE user_id = ?", (user_id,))
-            
-            # Add new roles
-            for role_name in roles:
-                self.cursor.execute(
-                    "INSERT INTO user_roles (user_id, role) VALUES (?, ?)",
-                    (user_id, role_name)
-                )
-            
-            # Commit the transaction
-            self.conn.commit()
-            
+            with self.pool.connection() as conn:
+                # Start a transaction
+                conn.execute("BEGIN TRANSACTION")
+
+                # Delete existing roles
+                conn.execute("DELETE FROM user_roles WHERE user_id = ?", (user_id,))
+
+                # Add new roles
+                for role_name in roles:
+                    conn.execute(
+                        "INSERT INTO user_roles (user_id, role) VALUES (?, ?)",
+                        (user_id, role_name)
+                    )
+
+                epoch = bump_epoch(conn, USER_ROLES_SCOPE)
+
+                # Commit the transaction
+                conn.commit()
+            self.permissions.invalidate_user(user_id, epoch)
+            self.user_cache.invalidate(user_id)
+
             return True
         except sqlite3.Error as e:
-            # Rollback the transaction in case of error
-            self.conn.rollback()
+            # The pool rolls the transaction back in case of error
             logging.error(f"Error updating user roles: {str(e)}")
             return False
 
-# Initialize the database when the module is imported
-db = Database()
\ No newline at end of file
+_db = None
+_db_lock = threading.Lock()
+
+
+def get_db(db_path="database.db", **kwargs):
+    """Get the process-wide Database, creating it on first use
+
+    Args:
+        db_path (str, optional): Database file used if it has not been created yet. Defaults to "database.db".
+        **kwargs: Extra Database arguments used on creation
+
+    Returns:
+        Database: The shared instance
+    """
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                _db = Database(db_path, **kwargs)
+    return _db
+
+
+def __getattr__(name):
+    # Keep 'from database import db' working without creating the
+    # database at import time of this module
+    if name == 'db':
+        return get_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
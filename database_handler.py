@@ -1,40 +1,55 @@
+import os
 import re
 import secrets
 import time
 from functools import wraps
-from flask import request, jsonify, session, redirect, url_for, flash
-from database import db
-import bcrypt
+from flask import request, jsonify, session, redirect, url_for, flash, g
+from database import get_db
+from rate_limit import SlidingWindowLimiter
+from password_service import PasswordServiceBusy
+from password_policy import hash_password, verify_password
+from signed_sessions import is_signed_token
+
+# Session token formats: 'database' stores a random token in the sessions
+# table; 'signed' issues a stateless HMAC-signed token that validates
+# without a database read. Chosen per deployment with SESSION_TOKEN_FORMAT.
+SESSION_TOKEN_FORMATS = ('database', 'signed')
+
 
 class AuthHandler:
-    def __init__(self):
-        self.db = db
-        self.token_blacklist = set()  # For logout functionality
-        self.failed_attempts = {}     # For rate limiting
+    def __init__(self, db=None, session_format=None):
+        self._db = db                 # Resolved on first use so importing this module stays cheap
+        self.session_format = session_format or os.getenv("SESSION_TOKEN_FORMAT", "database")
+        if self.session_format not in SESSION_TOKEN_FORMATS:
+            raise ValueError(f"Unknown session token format: {self.session_format}")
+        self._failed_attempts = None
+        self.session_lifetime = 3600  # Seconds a session token stays valid
         self.attempt_window = 15 * 60  # 15 minutes window for rate limiting
         self.max_attempts = 5         # Max failed attempts before rate limiting
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = get_db()
+        return self._db
+
+    @property
+    def failed_attempts(self):
+        """Failed logins per username, shared by all worker processes"""
+        if self._failed_attempts is None:
+            self._failed_attempts = SlidingWindowLimiter(
+                self.db.pool, 'login_failures', limit=self.max_attempts, period=self.attempt_window
+            )
+        return self._failed_attempts
     
     def _is_rate_limited(self, username):
         """Check if a username is rate limited due to too many failed attempts"""
-        current_time = time.time()
-        if username in self.failed_attempts:
-            attempts, timestamp = self.failed_attempts[username]
-            # If within the time window and exceeded max attempts
-            if current_time - timestamp < self.attempt_window and attempts >= self.max_attempts:
-                return True
-            # Reset if outside time window
-            elif current_time - timestamp >= self.attempt_window:
-                self.failed_attempts[username] = (0, current_time)
-        return False
+        allowed, _ = self.failed_attempts.peek(username.lower())
+        return not allowed
     
     def _record_failed_attempt(self, username):
         """Record a failed login attempt"""
-        current_time = time.time()
-        if username in self.failed_attempts:
-            attempts, _ = self.failed_attempts[username]
-            self.failed_attempts[username] = (attempts + 1, current_time)
-        else:
-            self.failed_attempts[username] = (1, current_time)
+        self.failed_attempts.hit(username.lower())
     
     def _validate_password_strength(self, password):
         """Validate password meets security requirements"""
@@ -68,20 +83,12 @@ class AuthHandler:
         return secrets.token_urlsafe(32)
     
     def hash_password(self, password):
-        """Hash a password using bcrypt"""
-        try:
-            return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        except Exception as e:
-            print(f"Error hashing password: {str(e)}")
-            return None
+        """Hash a password at the password policy cost"""
+        return hash_password(password)
 
     def verify_password(self, stored_password, provided_password):
         """Verify a password against its bcrypt hash"""
-        try:
-            return bcrypt.checkpw(provided_password.encode('utf-8'), stored_password.encode('utf-8'))
-        except Exception as e:
-            print(f"Error verifying password: {str(e)}")
-            return False
+        return verify_password(stored_password, provided_password)
     
     def register_user(self, username, password, email, full_name=None, bio=None, roles=None, profile_pic=None):
         """Register a new user
@@ -178,13 +185,10 @@ class AuthHandler:
                     'permissions': ['read']
                 })
             
-            # Hash the password
-            hashed_password = self.hash_password(password)
-            
-            # Create user
+            # Create user; create_user hashes the password
             user_id = self.db.create_user(
                 username=username,
-                password=hashed_password,
+                password=password,
                 email=email,
                 full_name=full_name,
                 bio=bio,
@@ -207,6 +211,8 @@ class AuthHandler:
                     'success': False,
                     'message': 'Failed to create user'
                 }
+        except PasswordServiceBusy:
+            raise
         except Exception as e:
             return {
                 'success': False,
@@ -232,13 +238,18 @@ class AuthHandler:
                 'success': False,
                 'message': 'Invalid username or password'
             }
+        self.failed_attempts.reset(username.lower())
         
-        # Generate session token
-        session_token = self._generate_session_token()
-        
-        # Store session token in database with expiration time
-        expiration_time = time.time() + 3600  # 1 hour
-        self.db.store_session_token(user_id, session_token, expiration_time)
+        expiration_time = time.time() + self.session_lifetime
+        if self.session_format == 'signed':
+            # Carries its own expiry and epoch; nothing is stored
+            session_token = self.db.signed_sessions.issue(user_id, expiration_time)
+        else:
+            # Generate session token
+            session_token = self._generate_session_token()
+            
+            # Store session token in database with expiration time
+            self.db.store_session_token(user_id, session_token, expiration_time)
         
         # Get user data
         user_data = self.db.get_user(user_id)
@@ -253,8 +264,23 @@ class AuthHandler:
     
     def logout_user(self, session_token):
         """Logout a user by invalidating their session token"""
-        # Add token to blacklist
-        self.token_blacklist.add(session_token)
+        # Revoke for every worker until the session would have expired anyway
+        if is_signed_token(session_token):
+            claims = self.db.signed_sessions.decode(session_token)
+            if claims is None:
+                # Forged or malformed; there is nothing to revoke
+                return {
+                    'success': True,
+                    'message': 'Logout successful'
+                }
+            expiration_time = claims['expiration_time']
+        else:
+            expiration_time = self.db.sessions.get_expiration(session_token)
+        if expiration_time is None:
+            expiration_time = time.time() + self.session_lifetime
+        self.db.revocations.revoke(session_token, expiration_time)
+        if not is_signed_token(session_token):
+            self.db.revoke_session_token(session_token)
         
         return {
             'success': True,
@@ -263,12 +289,15 @@ class AuthHandler:
     
     def is_authenticated(self, session_token):
         """Check if a session token is valid"""
-        # Check if token is in blacklist
-        if session_token in self.token_blacklist:
+        # Check the shared revocation list
+        if self.db.revocations.is_revoked(session_token):
             return False
         
-        # Check if token exists in database and hasn't expired
-        user_id = self.db.validate_session_token(session_token)
+        # Signed tokens are checked in memory; others must exist in the database and not have expired
+        if is_signed_token(session_token):
+            user_id = self.db.signed_sessions.verify(session_token)
+        else:
+            user_id = self.db.validate_session_token(session_token)
         if not user_id:
             return False
         return True
@@ -296,13 +325,12 @@ class AuthHandler:
                     'message': message
                 }
             
-            # Hash the new password
-            hashed_password = self.hash_password(new_password)
-            
-            # Update the password in the database
-            result = self.db.update_user_password(user_id, hashed_password)
+            # Update the password in the database; update_user_password hashes it
+            result = self.db.update_user_password(user_id, new_password)
             
             if result:
+                # Sessions opened with the old password stop working
+                self.db.revoke_user_sessions(user_id)
                 return {
                     'success': True,
                     'message': 'Password has been reset successfully'
@@ -312,24 +340,78 @@ class AuthHandler:
                     'success': False,
                     'message': 'Failed to reset password'
                 }
+        except PasswordServiceBusy:
+            raise
         except Exception as e:
             return {
                 'success': False,
                 'message': f'Error resetting password: {str(e)}'
             }
 
+def load_current_user():
+    """Resolve the logged-in user and their permissions into flask.g
+
+    Registered as a before_request hook, so each request loads them at most
+    once. Sets ``g.user`` (None when nobody is logged in or the user no
+    longer exists) and ``g.permissions``.
+    """
+    g.user = None
+    g.permissions = {}
+    user_id = session.get('user_id')
+    if user_id is not None:
+        g.user, g.permissions = auth_handler.db.user_cache.get(user_id)
+
+
+def _current_user():
+    # Load on demand when load_current_user is not registered as a hook
+    if 'user' not in g:
+        load_current_user()
+    return g.user
+
+
+def _not_logged_in():
+    if request.path.startswith('/api/'):
+        return jsonify({'success': False, 'message': 'Authentication required'}), 401
+    flash('Please log in to access this page', 'error')
+    return redirect(url_for('login'))
+
+
 # Create a decorator for requiring authentication
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # Check if user is logged in by checking for user_id in session
-        if 'user_id' not in session:
-            flash('Please log in to access this page', 'error')
-            return redirect(url_for('login'))
+        # Check if user is logged in and still exists
+        if _current_user() is None:
+            return _not_logged_in()
         
         return f(*args, **kwargs)
     
     return decorated_function
 
+
+def permission_required(permission, message=None):
+    """Decorator for routes that need a permission (or 'all')
+
+    Reuses the user loaded by load_current_user. API routes get a JSON 401
+    or 403; pages flash ``message`` and redirect to the dashboard.
+
+    Args:
+        permission (str): The permission name, e.g. 'manage_users'
+        message (str, optional): Text shown when the permission is missing
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if _current_user() is None:
+                return _not_logged_in()
+            if not g.permissions.get(permission) and not g.permissions.get('all'):
+                if request.path.startswith('/api/'):
+                    return jsonify({'success': False, 'message': message or 'Permission denied'}), 403
+                flash(message or 'You do not have permission to access this page', 'error')
+                return redirect(url_for('dashboard'))
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
 # Initialize the auth handler
 auth_handler = AuthHandler()
\ No newline at end of file
@@ -0,0 +1,248 @@
+import sqlite3
+import threading
+import queue
+import time
+import logging
+from contextlib import contextmanager
+
+# PRAGMA profiles applied to every pooled connection when it is opened.
+# journal_mode=WAL lets readers run alongside a single writer, and
+# busy_timeout makes writers wait for the lock instead of failing with
+# "database is locked" straight away.
+PRAGMA_PROFILES = {
+    'default': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -16000,       # ~16 MB page cache per connection
+        'mmap_size': 268435456,     # 256 MB memory-mapped I/O
+        'temp_store': 'MEMORY',
+    },
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 10000,
+        'cache_size': -16000,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+    },
+    'bulk': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'busy_timeout': 30000,
+        'cache_size': -64000,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Raised when no pooled connection became available in time"""
+
+
+class ConnectionPool:
+    """A fixed-size pool of SQLite connections
+
+    Connections are opened lazily up to ``size`` and configured with one of
+    the ``PRAGMA_PROFILES``. Checkouts are re-entrant per thread: a nested
+    ``connection()`` call on a thread that already holds a connection gets
+    the same one back, so helper methods that call each other share one
+    transaction.
+    """
+
+    def __init__(self, db_path, size=5, timeout=30.0, profile='default', pragmas=None):
+        """Initialize the pool
+
+        Args:
+            db_path (str): Path to the SQLite database file
+            size (int, optional): Maximum number of open connections. Defaults to 5.
+            timeout (float, optional): Seconds to wait for a free connection. Defaults to 30.
+            profile (str, optional): Name of the PRAGMA profile to apply. Defaults to 'default'.
+            pragmas (dict, optional): Extra PRAGMAs overriding the profile. Defaults to None.
+        """
+        if profile not in PRAGMA_PROFILES:
+            raise ValueError(f"Unknown PRAGMA profile: {profile}")
+
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = dict(PRAGMA_PROFILES[profile])
+        if pragmas:
+            self.pragmas.update(pragmas)
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._created = 0
+        self._closed = False
+
+        # Checkout metrics
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._in_use = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _create_connection(self):
+        """Open a new connection and apply the PRAGMA profile"""
+        busy_timeout = self.pragmas.get('busy_timeout', 5000)
+        conn = sqlite3.connect(self.db_path, timeout=busy_timeout / 1000.0, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def acquire(self):
+        """Check a connection out of the pool
+
+        Returns:
+            sqlite3.Connection: A connection owned by the calling thread
+
+        Raises:
+            PoolTimeout: If no connection became free within ``timeout`` seconds
+        """
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed")
+
+        start = time.perf_counter()
+        waited = False
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    conn = self._create_connection()
+                except sqlite3.Error:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                waited = True
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeout(f"Timed out after {self.timeout}s waiting for a database connection")
+
+        wait_time = time.perf_counter() - start
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+            self._total_wait += wait_time
+            if waited:
+                self._waits += 1
+            if wait_time > self._max_wait:
+                self._max_wait = wait_time
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any open transaction"""
+        with self._lock:
+            self._in_use -= 1
+        if self._closed:
+            conn.close()
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            # A broken connection is dropped and replaced on the next checkout
+            logging.error(f"Discarding broken pooled connection: {str(e)}")
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager that yields a pooled connection
+
+        Uncommitted work is rolled back if the block raises or when the
+        outermost checkout on this thread returns the connection. A nested
+        block entered while a transaction is open runs under a savepoint, so
+        if it raises only its own work is undone and the outer caller's
+        transaction is left for the outer caller to commit or roll back.
+        """
+        depth = getattr(self._local, 'depth', 0)
+        if depth:
+            conn = self._local.conn
+        else:
+            conn = self.acquire()
+            self._local.conn = conn
+        savepoint = f"pool_nested_{depth}" if depth and conn.in_transaction else None
+        if savepoint:
+            conn.execute(f"SAVEPOINT {savepoint}")
+        self._local.depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            if savepoint:
+                self._rollback_savepoint(conn, savepoint)
+            elif conn.in_transaction:
+                conn.rollback()
+            raise
+        else:
+            if savepoint and conn.in_transaction:
+                self._release_savepoint(conn, savepoint)
+        finally:
+            self._local.depth = depth
+            if not depth:
+                self._local.conn = None
+                self.release(conn)
+
+    @staticmethod
+    def _rollback_savepoint(conn, savepoint):
+        # The savepoint is gone if the nested block committed or rolled back itself
+        if not conn.in_transaction:
+            return
+        try:
+            conn.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+            conn.execute(f"RELEASE SAVEPOINT {savepoint}")
+        except sqlite3.OperationalError:
+            pass
+
+    @staticmethod
+    def _release_savepoint(conn, savepoint):
+        try:
+            conn.execute(f"RELEASE SAVEPOINT {savepoint}")
+        except sqlite3.OperationalError:
+            pass
+
+    def stats(self):
+        """Get checkout and wait-time metrics for the pool
+
+        Returns:
+            dict: Pool size, open/idle/in-use connections and wait statistics
+        """
+        with self._lock:
+            return {
+                'size': self.size,
+                'open_connections': self._created,
+                'idle_connections': self._idle.qsize(),
+                'in_use': self._in_use,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'total_wait_time': self._total_wait,
+                'avg_wait_time': self._total_wait / self._checkouts if self._checkouts else 0.0,
+                'max_wait_time': self._max_wait,
+            }
+
+    def close(self):
+        """Close all idle connections; checked-out ones are closed on release"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
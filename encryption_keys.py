@@ -0,0 +1,239 @@
+"""
+Versioned keyring for encrypting sensitive data at rest
+
+Ciphertexts are written as ``v<version>:<fernet token>``. The version names
+the data-encryption key (DEK) used, so decryption is a dictionary lookup
+instead of a PBKDF2 derivation. Version 1 is derived once from secret.key,
+which is the key Database has always used. Later versions are random Fernet
+keys kept in keyring.json (mode 0600) and added by rotate().
+
+Two untagged legacy formats are still readable:
+  * bare Fernet tokens written by Database with the secret.key-derived key
+  * base64(salt + token) written by api_key_generation, which derived a key
+    from a passphrase and a per-ciphertext salt (slow; cached per salt)
+
+Usage:
+    python encryption_keys.py [db_path] --status
+    python encryption_keys.py [db_path] --rotate
+    python encryption_keys.py [db_path] --reencrypt [--batch-size 500]
+"""
+
+import os
+import json
+import time
+import base64
+import sqlite3
+import logging
+import functools
+import threading
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+# Passphrase api_key_generation used for its salted ciphertexts
+LEGACY_API_KEY_PASSPHRASE = b'your-encryption-key-here'
+
+
+@functools.lru_cache(maxsize=1024)
+def _derive_key(passphrase, salt, iterations=100000):
+    """PBKDF2 a passphrase into a Fernet key; cached so each (passphrase, salt) pair is derived once"""
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=iterations,
+    )
+    return base64.urlsafe_b64encode(kdf.derive(passphrase))
+
+
+class Keyring:
+    """Data-encryption keys indexed by version, all held in memory"""
+
+    # Salt used for the version 1 key derived from secret.key
+    LEGACY_SALT = b'static_salt_for_key_derivation'
+
+    def __init__(self, secret_key, keyring_file="keyring.json", legacy_passphrase=None):
+        """Load the keyring
+
+        Args:
+            secret_key (bytes): Contents of secret.key; version 1 is derived from it
+            keyring_file (str, optional): File holding rotated keys. Defaults to "keyring.json".
+            legacy_passphrase (bytes, optional): Passphrase for salted api_key_generation ciphertexts. Defaults to None.
+        """
+        self.keyring_file = keyring_file
+        self.legacy_passphrase = legacy_passphrase
+        self._lock = threading.Lock()
+        self._keys = {1: Fernet(_derive_key(secret_key, self.LEGACY_SALT))}
+        self.primary = 1
+
+        if os.path.exists(keyring_file):
+            with open(keyring_file, "r") as f:
+                stored = json.load(f)
+            for version, key in stored.get('keys', {}).items():
+                self._keys[int(version)] = Fernet(key.encode())
+            self.primary = stored.get('primary', self.primary)
+
+    @property
+    def versions(self):
+        return sorted(self._keys)
+
+    def encrypt(self, data):
+        """Encrypt with the primary key
+
+        Args:
+            data (str or bytes): Plaintext
+
+        Returns:
+            str: ``v<version>:<token>``
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        return f"v{self.primary}:{self._keys[self.primary].encrypt(data).decode()}"
+
+    def decrypt(self, ciphertext):
+        """Decrypt a tagged or legacy ciphertext
+
+        Returns:
+            str: The plaintext
+
+        Raises:
+            InvalidToken: If no known key can decrypt the ciphertext
+        """
+        if ciphertext.startswith('v'):
+            version, sep, token = ciphertext[1:].partition(':')
+            if sep and version.isdigit():
+                key = self._keys.get(int(version))
+                if key is None:
+                    raise InvalidToken(f"Unknown key version {version}")
+                return key.decrypt(token.encode()).decode()
+        return self._decrypt_legacy(ciphertext)
+
+    def _decrypt_legacy(self, ciphertext):
+        try:
+            return self._keys[1].decrypt(ciphertext.encode()).decode()
+        except InvalidToken:
+            if self.legacy_passphrase is None:
+                raise
+        decoded = base64.urlsafe_b64decode(ciphertext.encode())
+        salt, token = decoded[:16], decoded[16:]
+        return Fernet(_derive_key(self.legacy_passphrase, salt)).decrypt(token).decode()
+
+    def is_current(self, ciphertext):
+        """True if the ciphertext is already under the primary key"""
+        return ciphertext.startswith(f"v{self.primary}:")
+
+    def rotate(self):
+        """Generate a new key, make it primary and persist the keyring
+
+        Returns:
+            int: The new primary version
+        """
+        with self._lock:
+            version = max(self._keys) + 1
+            key = Fernet.generate_key()
+            self._keys[version] = Fernet(key)
+            self.primary = version
+
+            stored = {'primary': version, 'keys': {}}
+            if os.path.exists(self.keyring_file):
+                with open(self.keyring_file, "r") as f:
+                    stored['keys'] = json.load(f).get('keys', {})
+            stored['keys'][str(version)] = key.decode()
+
+            tmp_file = self.keyring_file + ".tmp"
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(stored, f)
+            os.replace(tmp_file, self.keyring_file)
+            return version
+
+
+def reencrypt_api_secrets(conn, keyring, batch_size=500, pause=0.01):
+    """Re-encrypt every api_keys.api_secret that is not under the primary key
+
+    Rows are walked in rowid order, one short transaction per batch, so the
+    tool can run against a live database and be interrupted and restarted.
+    Values no key can decrypt are left untouched and counted as skipped.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the application database
+        keyring (Keyring): Keyring holding the old and the primary key
+        batch_size (int, optional): Rows per transaction. Defaults to 500.
+        pause (float, optional): Seconds to sleep between batches. Defaults to 0.01.
+
+    Returns:
+        dict: Counts of rows scanned, re-encrypted and skipped
+    """
+    counts = {'scanned': 0, 'reencrypted': 0, 'skipped': 0}
+    last_rowid = 0
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, api_secret FROM api_keys WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last_rowid, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+        counts['scanned'] += len(rows)
+
+        updates = []
+        for rowid, secret in rows:
+            if not secret or keyring.is_current(secret):
+                continue
+            try:
+                updates.append((keyring.encrypt(keyring.decrypt(secret)), rowid, secret))
+            except (InvalidToken, ValueError):
+                counts['skipped'] += 1
+
+        if updates:
+            try:
+                # The api_secret guard skips rows changed since we read them
+                cursor = conn.executemany(
+                    "UPDATE api_keys SET api_secret = ? WHERE rowid = ? AND api_secret = ?", updates
+                )
+                conn.commit()
+                counts['reencrypted'] += cursor.rowcount
+            except sqlite3.Error as e:
+                conn.rollback()
+                logging.error(f"Error re-encrypting API secrets: {str(e)}")
+                raise
+        time.sleep(pause)
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Manage the encryption keyring")
+    parser.add_argument('db_path', nargs='?', default='database.db')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--status', action='store_true')
+    group.add_argument('--rotate', action='store_true')
+    group.add_argument('--reencrypt', action='store_true')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    with open("secret.key", "rb") as f:
+        keyring = Keyring(f.read(), legacy_passphrase=LEGACY_API_KEY_PASSPHRASE)
+
+    if args.rotate:
+        print(f"Primary key is now version {keyring.rotate()}")
+    elif args.reencrypt:
+        conn = sqlite3.connect(args.db_path)
+        try:
+            counts = reencrypt_api_secrets(conn, keyring, batch_size=args.batch_size)
+        finally:
+            conn.close()
+        print(f"Scanned {counts['scanned']}, re-encrypted {counts['reencrypted']}, skipped {counts['skipped']}")
+    else:
+        conn = sqlite3.connect(args.db_path)
+        try:
+            current = conn.execute(
+                "SELECT COUNT(*) FROM api_keys WHERE api_secret LIKE ?", (f"v{keyring.primary}:%",)
+            ).fetchone()[0]
+            total = conn.execute("SELECT COUNT(*) FROM api_keys").fetchone()[0]
+        finally:
+            conn.close()
+        print(f"Key versions {keyring.versions}, primary {keyring.primary}; "
+              f"{current}/{total} API secrets under the primary key")
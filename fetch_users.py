@@ -1,11 +1,10 @@
-import sqlite3
 import base64
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import os
 from database import Database
-import bcrypt
+from password_policy import verify_password, bcrypt_cost
 
 def get_secret_key():
     """Get the secret key for encryption"""
@@ -26,58 +25,56 @@ def initialize_encryption(secret_key):
     key = base64.urlsafe_b64encode(kdf.derive(secret_key))
     return Fernet(key)
 
-def verify_password(stored_password, provided_password):
-    """Verify a password against its bcrypt hash"""
-    try:
-        # Convert both inputs to bytes
-        return bcrypt.checkpw(provided_password.encode('utf-8'), stored_password.encode('utf-8'))
-    except Exception as e:
-        print(f"Error verifying password: {str(e)}")
-        return False
+def main():
+    # Initialize the database
+    db = Database()
 
-# Initialize the database
-db = Database()
+    # Borrow a pooled connection from the database
+    conn = db.pool.acquire()
+    cursor = conn.cursor()
 
-# Connect to the database
-db_path = "database.db"
-conn = sqlite3.connect(db_path)
-cursor = conn.cursor()
+    # Get the secret key for encryption
+    secret_key = get_secret_key()
+    if secret_key:
+        fernet = initialize_encryption(secret_key)
+    else:
+        print("Warning: Secret key not found. Some encrypted fields may not be decodable.")
+        fernet = None
 
-# Get the secret key for encryption
-secret_key = get_secret_key()
-if secret_key:
-    fernet = initialize_encryption(secret_key)
-else:
-    print("Warning: Secret key not found. Some encrypted fields may not be decodable.")
-    fernet = None
+    # Fetch all users
+    cursor.execute("""
+        SELECT id, username, password, full_name, email, bio, profile_pic, created_at, updated_at
+        FROM users
+    """)
 
-# Fetch all users
-cursor.execute("""
-    SELECT id, username, password, full_name, email, bio, profile_pic, created_at, updated_at
-    FROM users
-""")
+    users = cursor.fetchall()
 
-users = cursor.fetchall()
+    print("\n=== All Users in Database ===\n")
+    for user in users:
+        user_id, username, password, full_name, email, bio, profile_pic, created_at, updated_at = user
 
-print("\n=== All Users in Database ===\n")
-for user in users:
-    user_id, username, password, full_name, email, bio, profile_pic, created_at, updated_at = user
-    
-    # Example: Verify a test password
-    test_password = "_OQ7k2MqiDd+"
-    is_valid = verify_password(password, test_password)
-    
-    print(f"\nUser ID: {user_id}")
-    print(f"Username: {username}")
-    print(f"Email: {email}")
-    print(f"Full Name: {full_name}")
-    print(f"Bio: {bio}")
-    print(f"Profile Pic: {profile_pic}")
-    print(f"Created At: {created_at}")
-    print(f"Updated At: {updated_at}")
-    print(f"Stored Password: {password}")
-    
-    print(f"Password Match: {is_valid}")
-    print("-" * 50)
+        # Example: Verify a test password
+        test_password = "_OQ7k2MqiDd+"
+        is_valid = verify_password(password, test_password)
 
-conn.close()
+        print(f"\nUser ID: {user_id}")
+        print(f"Username: {username}")
+        print(f"Email: {email}")
+        print(f"Full Name: {full_name}")
+        print(f"Bio: {bio}")
+        print(f"Profile Pic: {profile_pic}")
+        print(f"Created At: {created_at}")
+        print(f"Updated At: {updated_at}")
+        print(f"Stored Password: {password}")
+        print(f"Hash Cost: {bcrypt_cost(password)}")
+
+        print(f"Password Match: {is_valid}")
+        print("-" * 50)
+
+    db.pool.release(conn)
+    db.close()
+
+
+# The password worker pool re-imports this module in each worker process
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import sqlite3
+import threading
+import logging
+
+
+class IdBlockAllocator:
+    """Hands out integer ids from a sequence stored in the id_sequences table
+
+    Each process reserves ``block_size`` ids at a time with one atomic
+    UPDATE ... RETURNING and serves them from memory. Processes never hand
+    out the same id. Ids left unused in a block when a process exits are
+    skipped, so ids are unique and increasing per process but not gap-free.
+    """
+
+    def __init__(self, pool, name, block_size=1000):
+        """Initialize the allocator
+
+        Args:
+            pool (ConnectionPool): Pool used to reserve blocks
+            name (str): Sequence name in id_sequences
+            block_size (int, optional): Ids reserved per round trip. Defaults to 1000.
+        """
+        self.pool = pool
+        self.name = name
+        self.block_size = block_size
+
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0               # exclusive
+        self.blocks = 0
+
+    def _reserve(self, count):
+        """Reserve ``count`` ids in the database and return the first one"""
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "UPDATE id_sequences SET next_value = next_value + ? WHERE name = ? RETURNING next_value",
+                (count, self.name)
+            ).fetchone()
+            if row is None:
+                conn.rollback()
+                raise sqlite3.OperationalError(f"Unknown id sequence: {self.name}")
+            conn.commit()
+        self.blocks += 1
+        return row[0] - count
+
+    def take(self, count):
+        """Allocate ``count`` ids
+
+        Returns:
+            list: The allocated ids in increasing order
+        """
+        with self._lock:
+            ids = []
+            while len(ids) < count:
+                if self._next >= self._end:
+                    size = max(self.block_size, count - len(ids))
+                    try:
+                        self._next = self._reserve(size)
+                    except sqlite3.Error as e:
+                        logging.error(f"Error reserving id block: {str(e)}")
+                        raise
+                    self._end = self._next + size
+                take = min(count - len(ids), self._end - self._next)
+                ids.extend(range(self._next, self._next + take))
+                self._next += take
+            return ids
+
+    def next_id(self):
+        """Allocate a single id"""
+        return self.take(1)[0]
@@ -0,0 +1,169 @@
+"""
+Move inline prompts and responses into the content-addressed blob store.
+
+Rows are processed in batches ordered by id, first activity_details, then
+activity_responses. Each batch is hashed and compressed while no
+transaction is open, then written in one short transaction that stores
+any new blobs and points the rows at them. A row is only rewritten if its
+text is still the one that was read. The position is saved to a
+checkpoint file after every batch, so an interrupted run continues where
+it stopped. Unreferenced blobs are collected at the end, and a report of
+the space saved is printed.
+
+The freed pages are reused by SQLite but the file only shrinks after
+VACUUM (--vacuum).
+
+    python migrate_blobs.py [database.db] [--batch-size 1000] [--train-dictionary] [--report] [--vacuum] [--restart]
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+from db_pool import ConnectionPool
+from blob_store import BlobStore
+
+# (phase, table, key column, text column, hash column, compress)
+PHASES = (
+    ('prompts', 'activity_details', 'id', 'prompt', 'prompt_hash', False),
+    ('responses', 'activity_responses', 'id', 'response', 'response_hash', True),
+)
+
+
+def load_checkpoint(path):
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return {'phase': PHASES[0][0], 'last_id': '', 'moved': 0, 'skipped': 0}
+
+
+def save_checkpoint(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def train_dictionary(pool, blobs, sample_size=2000):
+    """Train a shared dictionary from a sample of stored responses"""
+    with pool.connection() as conn:
+        rows = conn.execute(
+            "SELECT response FROM activity_responses WHERE response_hash IS NULL AND response != '' "
+            "ORDER BY rowid DESC LIMIT ?",
+            (sample_size,)
+        ).fetchall()
+    dict_id = blobs.train_dictionary([row[0] for row in rows])
+    if dict_id is None:
+        print("Not enough responses to train a dictionary; compressing without one")
+    else:
+        print(f"Trained {blobs.codec} dictionary {dict_id} from {len(rows)} responses")
+
+
+def migrate(pool, blobs, state, checkpoint, batch_size):
+    """Move every inline text after ``state['last_id']`` into blobs, phase by phase"""
+    phase_names = [phase[0] for phase in PHASES]
+    for phase, table, key, text_column, hash_column, compress in PHASES[phase_names.index(state['phase']):]:
+        if state['phase'] != phase:
+            state.update(phase=phase, last_id='')
+        while True:
+            with pool.connection() as conn:
+                rows = conn.execute(
+                    f"SELECT {key}, {text_column} FROM {table} "
+                    f"WHERE {key} > ? AND {hash_column} IS NULL ORDER BY {key} LIMIT ?",
+                    (state['last_id'], batch_size)
+                ).fetchall()
+            if not rows:
+                break
+
+            # Hash and compress outside any transaction so writers are not blocked
+            encoded = [blobs.encode(text or '', compress=compress) for _, text in rows]
+
+            with pool.connection() as conn:
+                blobs.store(conn, encoded)
+                # Only move texts nobody changed while they were being compressed
+                updated = conn.executemany(
+                    f"UPDATE {table} SET {text_column} = '', {hash_column} = ? "
+                    f"WHERE {key} = ? AND {text_column} = ? AND {hash_column} IS NULL",
+                    [(blob[0], row_id, text) for (row_id, text), blob in zip(rows, encoded)]
+                ).rowcount
+                conn.commit()
+            state['moved'] += updated
+            state['skipped'] += len(rows) - updated
+            state['last_id'] = rows[-1][0]
+            save_checkpoint(checkpoint, state)
+            print(f"... {phase} up to id {state['last_id']}: {state['moved']} moved", flush=True)
+    return state
+
+
+def print_report(report):
+    def mib(n):
+        return f"{n / 2**20:,.1f} MiB"
+
+    print(f"Blobs: {report['blobs']:,} for {report['references']:,} references "
+          f"({report['unreferenced_blobs']:,} unreferenced)")
+    print(f"  text referenced:   {mib(report['logical_bytes'])}")
+    print(f"  distinct text:     {mib(report['unique_bytes'])}  (dedupe {report['dedupe_ratio']:.2f}x)")
+    print(f"  stored:            {mib(report['stored_bytes'])}  (compression {report['compression_ratio']:.2f}x)")
+    print(f"  saved:             {mib(report['saved_bytes'])}")
+    for codec, stats in sorted(report['by_codec'].items()):
+        print(f"  {codec:<6} {stats['blobs']:>10,} blobs  {mib(stats['bytes']):>12} -> {mib(stats['stored_bytes'])}")
+    print(f"Still inline: {report['inline_prompts']:,} prompts ({mib(report['inline_prompt_bytes'])}), "
+          f"{report['inline_responses']:,} responses ({mib(report['inline_response_bytes'])})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('db_path', nargs='?', default='database.db')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--codec', choices=('zlib', 'zstd'), default=None, help="Defaults to zstd if installed")
+    parser.add_argument('--train-dictionary', action='store_true', help="Train a shared dictionary first")
+    parser.add_argument('--report', action='store_true', help="Only print the space report")
+    parser.add_argument('--vacuum', action='store_true', help="VACUUM afterwards to shrink the file")
+    parser.add_argument('--checkpoint', default='migrate_blobs.checkpoint.json')
+    parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint")
+    args = parser.parse_args()
+
+    pool = ConnectionPool(args.db_path, size=1)
+    blobs = BlobStore(pool, codec=args.codec)
+    if args.report:
+        report = blobs.space_report()
+        pool.close()
+        if report is None:
+            return 1
+        print_report(report)
+        return 0
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    state = load_checkpoint(args.checkpoint)
+    start = time.perf_counter()
+    try:
+        if args.train_dictionary:
+            train_dictionary(pool, blobs)
+        state = migrate(pool, blobs, state, args.checkpoint, args.batch_size)
+        collected = blobs.gc()
+        if args.vacuum:
+            with pool.connection() as conn:
+                conn.execute("VACUUM")
+        report = blobs.space_report()
+    except sqlite3.Error as e:
+        logging.error(f"Error migrating blobs: {str(e)}")
+        return 1
+    finally:
+        pool.close()
+
+    print(f"Blob migration complete in {time.perf_counter() - start:.1f}s: "
+          f"{state['moved']} rows moved, {state['skipped']} changed during the run, "
+          f"{collected} unreferenced blobs collected")
+    if report is not None:
+        print_report(report)
+    if os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,26 +1,127 @@
+"""
+Hash legacy plaintext passwords with bcrypt at the password policy cost.
+
+Users are processed in batches ordered by id. Each batch is hashed across
+CPU cores by a process pool while no transaction is open, then written in
+one short transaction that only replaces a password that is still the one
+that was read. The last finished id is saved to a checkpoint file after
+every batch, so an interrupted run continues where it stopped.
+
+bcrypt hashes whose cost is out of policy cannot be rehashed without the
+password; they are counted here and rehashed when their owner next logs in.
+
+    python migrate_passwords.py [database.db] [--batch-size 200] [--workers N] [--restart]
+"""
+
+import os
+import sys
+import json
+import time
 import sqlite3
-import bcrypt
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from db_pool import ConnectionPool
+from password_service import _hashpw
+from password_policy import password_policy, bcrypt_cost
+
+
+def load_checkpoint(path):
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return {'last_id': '', 'hashed': 0, 'out_of_policy': 0, 'skipped': 0}
+
+
+def save_checkpoint(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def drop_salt_column(conn):
+    """Drop users.password_salt, left over from the pre-bcrypt schema"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+    if 'password_salt' in columns:
+        conn.execute('ALTER TABLE users DROP COLUMN password_salt')
+        conn.commit()
+
+
+def migrate(pool, executor, state, checkpoint, batch_size, rounds):
+    """Hash every plaintext password after ``state['last_id']``"""
+    while True:
+        with pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT id, password FROM users WHERE id > ? ORDER BY id LIMIT ?",
+                (state['last_id'], batch_size)
+            ).fetchall()
+        if not rows:
+            return state
+
+        plaintext = []
+        for user_id, password in rows:
+            cost = bcrypt_cost(password)
+            if cost is None:
+                plaintext.append((user_id, password))
+            elif password_policy.needs_rehash(password):
+                state['out_of_policy'] += 1
+
+        # Hash outside any transaction so writers are never blocked on bcrypt
+        hashes = list(executor.map(
+            _hashpw, [password.encode('utf-8') for _, password in plaintext], [rounds] * len(plaintext)
+        ))
+
+        if plaintext:
+            with pool.connection() as conn:
+                # Only replace passwords nobody changed while they were being hashed
+                updated = conn.executemany(
+                    "UPDATE users SET password = ? WHERE id = ? AND password = ?",
+                    [(hashed, user_id, password) for (user_id, password), hashed in zip(plaintext, hashes)]
+                ).rowcount
+                conn.commit()
+            state['hashed'] += updated
+            state['skipped'] += len(plaintext) - updated
+        state['last_id'] = rows[-1][0]
+        save_checkpoint(checkpoint, state)
+        print(f"... up to id {state['last_id']}: {state['hashed']} hashed", flush=True)
 
-# Connect to database
-db_path = 'database.db'
-conn = sqlite3.connect(db_path)
-cursor = conn.cursor()
 
-# Remove password_salt column
-cursor.execute('ALTER TABLE users DROP COLUMN password_salt')
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('db_path', nargs='?', default='database.db')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--checkpoint', default='migrate_passwords.checkpoint.json')
+    parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint")
+    args = parser.parse_args()
 
-# Update existing password hashes
-cursor.execute('SELECT id, password FROM users')
-users = cursor.fetchall()
+    pool = ConnectionPool(args.db_path, size=1)
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    state = load_checkpoint(args.checkpoint)
+    start = time.perf_counter()
+    try:
+        with pool.connection() as conn:
+            drop_salt_column(conn)
+        with ProcessPoolExecutor(max_workers=args.workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            state = migrate(pool, executor, state, args.checkpoint, args.batch_size, password_policy.rounds)
+    except sqlite3.Error as e:
+        logging.error(f"Error migrating passwords: {str(e)}")
+        return 1
+    finally:
+        pool.close()
 
-for user_id, password in users:
-    # Rehash password with bcrypt
-    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-    cursor.execute('UPDATE users SET password = ? WHERE id = ?', 
-                  (hashed.decode('utf-8'), user_id))
+    print(f"Password migration complete in {time.perf_counter() - start:.1f}s: "
+          f"{state['hashed']} hashed at cost {password_policy.rounds}, "
+          f"{state['skipped']} changed during the run, "
+          f"{state['out_of_policy']} out-of-policy hashes left for rehash on login")
+    if os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    return 0
 
-# Commit changes
-conn.commit()
-conn.close()
 
-print('Password migration complete!')
+if __name__ == '__main__':
+    sys.exit(main())
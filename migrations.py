@@ -0,0 +1,870 @@
+"""
+Versioned schema migrations for database.db
+
+Every migration has a number, a short description and a function that
+receives a cursor. Applied versions are recorded in the schema_version
+table, so each migration runs exactly once. Run this module at deploy time:
+
+    python migrations.py                  # apply pending migrations
+    python migrations.py --status         # list applied/pending migrations
+    python migrations.py --check-plans    # fail if a hot query stops using an index
+"""
+
+import sqlite3
+import json
+import uuid
+import sys
+import time
+import logging
+import re
+from datetime import datetime
+
+
+def _migration_001_baseline(cursor):
+    """Create the original tables and the default roles"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        full_name TEXT,
+        email TEXT UNIQUE NOT NULL,
+        bio TEXT,
+        profile_pic TEXT,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS user_roles (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        role TEXT NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS roles (
+        role_id TEXT PRIMARY KEY,
+        role_name TEXT UNIQUE NOT NULL,
+        permissions TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+    ''')
+
+    now = datetime.now().isoformat()
+    cursor.execute('''
+    INSERT OR IGNORE INTO roles (role_id, role_name, permissions, created_at, updated_at)
+    VALUES
+        (?, ?, ?, ?, ?),
+        (?, ?, ?, ?, ?),
+        (?, ?, ?, ?, ?),
+        (?, ?, ?, ?, ?)
+    ''', (
+        str(uuid.uuid4()), 'admin', json.dumps({"all": True, "manage_users": True, "manage_roles": True, "manage_content": True, "social_media": True, "prompting": True}), now, now,
+        str(uuid.uuid4()), 'medium_admin', json.dumps({"view_users": True, "manage_content": True, "social_media": True, "prompting": True}), now, now,
+        str(uuid.uuid4()), 'social_media_handler', json.dumps({"social_media": True, "prompting": True}), now, now,
+        str(uuid.uuid4()), 'basic_user', json.dumps({"prompting": True}), now, now
+    ))
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS api_keys (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        api_key TEXT UNIQUE NOT NULL,
+        api_secret TEXT NOT NULL,
+        api_id TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'Active',
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS api_role_permissions (
+        api_key_id TEXT NOT NULL,
+        permission_name TEXT NOT NULL,
+        FOREIGN KEY(api_key_id) REFERENCES api_keys(id)
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS user_activity (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        activity_type TEXT NOT NULL,
+        activity_timestamp TEXT NOT NULL,
+        activity_id TEXT NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS activity_details (
+        id TEXT PRIMARY KEY,
+        activity_id TEXT NOT NULL,
+        prompt TEXT NOT NULL,
+        prompt_timestamp TEXT NOT NULL,
+        prompt_id TEXT NOT NULL,
+        FOREIGN KEY (activity_id) REFERENCES user_activity(id)
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS activity_responses (
+        id TEXT PRIMARY KEY,
+        activity_detail_id TEXT NOT NULL,
+        response TEXT NOT NULL,
+        FOREIGN KEY (activity_detail_id) REFERENCES activity_details(id)
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS user_sessions (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        token TEXT NOT NULL,
+        expiration_time REAL NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS role_permissions (
+        id TEXT PRIMARY KEY,
+        role_id TEXT NOT NULL,
+        permission TEXT NOT NULL,
+        FOREIGN KEY (role_id) REFERENCES roles(role_id)
+    )
+    ''')
+
+
+def _migration_002_hot_path_indexes(cursor):
+    """Add covering indexes for the per-request lookups"""
+    # get_user / get_user_roles: WHERE user_id = ? returning id, role
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_roles_user_id ON user_roles (user_id, role, id)")
+    # delete_role: UPDATE user_roles ... WHERE role = ?
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_roles_role ON user_roles (role)")
+    # validate_session_token: WHERE token = ? AND expiration_time > ?
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_token ON user_sessions (token, expiration_time, user_id)")
+    # get_user_api_keys: WHERE user_id = ? ORDER BY created_at DESC
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_api_keys_user_id ON api_keys (user_id, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_api_role_permissions_key ON api_role_permissions (api_key_id, permission_name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_role_permissions_role ON role_permissions (role_id, permission)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_activity_user_id ON user_activity (user_id, activity_timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_activity_details_activity ON activity_details (activity_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_activity_responses_detail ON activity_responses (activity_detail_id)")
+
+
+def _migration_003_user_listing_indexes(cursor):
+    """Add indexes backing the keyset-paginated user listing sort orders"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_full_name ON users (COALESCE(full_name, ''), id)")
+
+
+def _migration_004_permission_epochs(cursor):
+    """Add the version counters used to invalidate cached permissions"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS permission_epochs (
+        scope TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO permission_epochs (scope, version) VALUES ('roles', 0), ('user_roles', 0)")
+
+
+def _migration_005_hashed_sessions(cursor):
+    """Move sessions to a table keyed by token hash and drop plaintext tokens"""
+    from session_store import hash_token
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sessions (
+        id INTEGER PRIMARY KEY,
+        token_hash TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        expiration_time REAL NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    ''')
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_token_hash ON sessions (token_hash, expiration_time, user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expiration ON sessions (expiration_time)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions (user_id)")
+
+    # Carry over sessions that are still valid; expired ones are simply dropped
+    now = time.time()
+    rows = cursor.execute(
+        "SELECT token, user_id, expiration_time FROM user_sessions WHERE expiration_time > ?", (now,)
+    ).fetchall()
+    cursor.executemany(
+        "INSERT OR IGNORE INTO sessions (token_hash, user_id, created_at, expiration_time) VALUES (?, ?, ?, ?)",
+        [(hash_token(token), user_id, now, expiration_time) for token, user_id, expiration_time in rows]
+    )
+    cursor.execute("DROP TABLE user_sessions")
+
+
+def _migration_006_revoked_tokens(cursor):
+    """Add the shared revocation list checked before session validation"""
+    # AUTOINCREMENT: other workers sync with ``id > last seen id``, so an id
+    # freed by the purge must never be handed out again
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS revoked_tokens (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        token_hash TEXT NOT NULL UNIQUE,
+        expires_at REAL NOT NULL
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires_at ON revoked_tokens (expires_at)")
+
+
+def _migration_007_rate_limits(cursor):
+    """Add the shared state tables for the GCRA and sliding-window rate limiters"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        limiter TEXT NOT NULL,
+        key TEXT NOT NULL,
+        tat REAL NOT NULL,
+        PRIMARY KEY (limiter, key)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_rate_limits_tat ON rate_limits (limiter, tat)")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS rate_limit_log (
+        limiter TEXT NOT NULL,
+        key TEXT NOT NULL,
+        ts REAL NOT NULL
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_rate_limit_log_key ON rate_limit_log (limiter, key, ts)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_rate_limit_log_ts ON rate_limit_log (limiter, ts)")
+
+
+def _migration_008_api_key_auth(cursor):
+    """Add the indexed key prefix and peppered secret hash used by API key authentication"""
+    from api_key_auth import KEY_PREFIX_LENGTH
+
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(api_keys)")]
+    if 'key_prefix' not in columns:
+        cursor.execute("ALTER TABLE api_keys ADD COLUMN key_prefix TEXT")
+    if 'secret_hash' not in columns:
+        # Filled in on first successful use, since the pepper is not available here
+        cursor.execute("ALTER TABLE api_keys ADD COLUMN secret_hash TEXT")
+    cursor.execute("UPDATE api_keys SET key_prefix = substr(api_key, 1, ?) WHERE key_prefix IS NULL", (KEY_PREFIX_LENGTH,))
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_api_keys_prefix ON api_keys (key_prefix)")
+
+
+def _migration_009_id_sequences(cursor):
+    """Add DB-backed id sequences and seed the API key sequence
+
+    The API key sequence continues after the highest numeric key id, or the
+    last value in the old api_key_id.json counter file if that is higher.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS id_sequences (
+        name TEXT PRIMARY KEY,
+        next_value INTEGER NOT NULL
+    )
+    ''')
+    highest = cursor.execute(
+        "SELECT MAX(CAST(id AS INTEGER)) FROM api_keys WHERE id != '' AND id NOT GLOB '*[^0-9]*'"
+    ).fetchone()[0] or 0
+    try:
+        with open('api_key_id.json', 'r') as f:
+            highest = max(highest, int(json.load(f)['api_key_id']))
+    except (FileNotFoundError, KeyError, ValueError):
+        pass
+    cursor.execute("INSERT OR IGNORE INTO id_sequences (name, next_value) VALUES ('api_key_id', ?)", (highest + 1,))
+
+
+def _migration_010_session_epochs(cursor):
+    """Add per-user session epochs used to revoke signed session tokens"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS session_epochs (
+        user_id TEXT PRIMARY KEY,
+        epoch INTEGER NOT NULL,
+        changed_seq INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_session_epochs_changed_seq ON session_epochs (changed_seq)")
+
+
+def _migration_011_web_sessions(cursor):
+    """Add the server-side store behind the Flask session cookie"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS web_sessions (
+        id TEXT PRIMARY KEY,
+        user_id TEXT,
+        data TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_web_sessions_expires_at ON web_sessions (expires_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_web_sessions_user_id ON web_sessions (user_id)")
+
+
+# A role grants a permission when its value in roles.permissions is truthy:
+# true, a non-zero number, a non-empty string, array or object. Malformed
+# or non-object JSON grants nothing instead of failing the write.
+_GRANTED_PERMISSIONS_SQL = '''
+SELECT ur.user_id, p.key FROM user_roles ur
+JOIN roles r ON r.role_name = lower(ur.role),
+json_each(CASE WHEN json_valid(r.permissions) AND json_type(r.permissions) = 'object'
+               THEN r.permissions ELSE '{{}}' END) p
+WHERE ur.user_id IN {users}
+AND (p.type = 'true'
+     OR (p.type IN ('integer', 'real') AND p.value != 0)
+     OR (p.type = 'text' AND p.value != '')
+     OR (p.type = 'array' AND p.value != '[]')
+     OR (p.type = 'object' AND p.value != '{{}}'))
+'''
+
+
+def _refresh_effective_permissions_sql(users, granted_sql=_GRANTED_PERMISSIONS_SQL):
+    """SQL that recomputes user_effective_permissions for the users in ``users``"""
+    return (
+        f"DELETE FROM user_effective_permissions WHERE user_id IN {users};\n"
+        "INSERT OR IGNORE INTO user_effective_permissions (user_id, permission)"
+        + granted_sql.format(users=users) + ";"
+    )
+
+
+def _migration_012_effective_permissions(cursor):
+    """Add user_effective_permissions, kept in sync with user_roles and roles by triggers"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS user_effective_permissions (
+        user_id TEXT NOT NULL,
+        permission TEXT NOT NULL,
+        PRIMARY KEY (user_id, permission)
+    ) WITHOUT ROWID
+    ''')
+    # "Which users have permission X" is a range scan on this index
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_effective_permissions_permission ON user_effective_permissions (permission, user_id)")
+    # Role triggers find the users holding a role through this expression
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_roles_role_lower ON user_roles (lower(role), user_id)")
+
+    triggers = {
+        'user_roles_insert': ("AFTER INSERT ON user_roles", "(NEW.user_id)"),
+        'user_roles_update': ("AFTER UPDATE ON user_roles", "(OLD.user_id, NEW.user_id)"),
+        'user_roles_delete': ("AFTER DELETE ON user_roles", "(OLD.user_id)"),
+        'roles_insert': ("AFTER INSERT ON roles",
+                         "(SELECT user_id FROM user_roles WHERE lower(role) = NEW.role_name)"),
+        'roles_update': ("AFTER UPDATE OF role_name, permissions ON roles",
+                         "(SELECT user_id FROM user_roles WHERE lower(role) IN (OLD.role_name, NEW.role_name))"),
+        'roles_delete': ("AFTER DELETE ON roles",
+                         "(SELECT user_id FROM user_roles WHERE lower(role) = OLD.role_name)"),
+    }
+    for name, (event, users) in triggers.items():
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_effective_permissions_{name}")
+        cursor.execute(
+            f"CREATE TRIGGER trg_effective_permissions_{name} {event} BEGIN\n"
+            f"{_refresh_effective_permissions_sql(users)}\nEND"
+        )
+
+    # Backfill every user that has a role
+    cursor.execute("DELETE FROM user_effective_permissions")
+    cursor.execute(
+        "INSERT OR IGNORE INTO user_effective_permissions (user_id, permission)"
+        + _GRANTED_PERMISSIONS_SQL.format(users="(SELECT user_id FROM user_roles)")
+    )
+
+
+# As _GRANTED_PERMISSIONS_SQL, but a user also receives the permissions of
+# every ancestor of each role they hold, read from role_closure.
+_INHERITED_PERMISSIONS_SQL = '''
+SELECT ur.user_id, p.key FROM user_roles ur
+JOIN role_closure c ON c.descendant = lower(ur.role)
+JOIN roles r ON r.role_name = c.ancestor,
+json_each(CASE WHEN json_valid(r.permissions) AND json_type(r.permissions) = 'object'
+               THEN r.permissions ELSE '{{}}' END) p
+WHERE ur.user_id IN {users}
+AND (p.type = 'true'
+     OR (p.type IN ('integer', 'real') AND p.value != 0)
+     OR (p.type = 'text' AND p.value != '')
+     OR (p.type = 'array' AND p.value != '[]')
+     OR (p.type = 'object' AND p.value != '{{}}'))
+'''
+
+
+def _migration_013_role_inheritance(cursor):
+    """Add role_parents and its transitive closure, and resolve permissions through it
+
+    role_closure holds one row per (ancestor, descendant) pair, including
+    each role paired with itself at depth 0. The triggers keep the self rows
+    and renames in step with roles; role_hierarchy rewrites the rest when
+    parent edges change.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS role_parents (
+        role_name TEXT NOT NULL,
+        parent_name TEXT NOT NULL,
+        PRIMARY KEY (role_name, parent_name)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_role_parents_parent ON role_parents (parent_name, role_name)")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS role_closure (
+        ancestor TEXT NOT NULL,
+        descendant TEXT NOT NULL,
+        depth INTEGER NOT NULL,
+        PRIMARY KEY (descendant, ancestor)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_role_closure_ancestor ON role_closure (ancestor, descendant)")
+
+    # Express the default tiers as inheritance; their JSON already holds the
+    # inherited permissions, so no user's effective permissions change
+    for role_name, parent_name in (('social_media_handler', 'basic_user'),
+                                   ('medium_admin', 'social_media_handler'),
+                                   ('admin', 'medium_admin')):
+        cursor.execute('''
+        INSERT OR IGNORE INTO role_parents (role_name, parent_name)
+        SELECT ?, ? WHERE (SELECT COUNT(*) FROM roles WHERE role_name IN (?, ?)) = 2
+        ''', (role_name, parent_name, role_name, parent_name))
+
+    cursor.execute("DELETE FROM role_closure")
+    cursor.execute('''
+    INSERT INTO role_closure (ancestor, descendant, depth)
+    WITH RECURSIVE walk(ancestor, descendant, depth) AS (
+        SELECT role_name, role_name, 0 FROM roles
+        UNION
+        SELECT p.parent_name, w.descendant, w.depth + 1
+        FROM walk w JOIN role_parents p ON p.role_name = w.ancestor
+    )
+    SELECT ancestor, descendant, MIN(depth) FROM walk
+    WHERE ancestor IN (SELECT role_name FROM roles)
+    GROUP BY ancestor, descendant
+    ''')
+
+    holders = "(SELECT user_id FROM user_roles WHERE lower(role) IN (SELECT descendant FROM role_closure WHERE ancestor = {role}))"
+    triggers = {
+        'user_roles_insert': ("AFTER INSERT ON user_roles", "", "(NEW.user_id)", ""),
+        'user_roles_update': ("AFTER UPDATE ON user_roles", "", "(OLD.user_id, NEW.user_id)", ""),
+        'user_roles_delete': ("AFTER DELETE ON user_roles", "", "(OLD.user_id)", ""),
+        'roles_insert': (
+            "AFTER INSERT ON roles",
+            "INSERT OR IGNORE INTO role_closure (ancestor, descendant, depth) VALUES (NEW.role_name, NEW.role_name, 0);",
+            holders.format(role="NEW.role_name"),
+            "",
+        ),
+        'roles_update': (
+            "AFTER UPDATE OF role_name, permissions ON roles",
+            "UPDATE role_parents SET role_name = NEW.role_name WHERE role_name = OLD.role_name;\n"
+            "UPDATE role_parents SET parent_name = NEW.role_name WHERE parent_name = OLD.role_name;\n"
+            "UPDATE role_closure SET ancestor = NEW.role_name WHERE ancestor = OLD.role_name;\n"
+            "UPDATE role_closure SET descendant = NEW.role_name WHERE descendant = OLD.role_name;",
+            "(SELECT user_id FROM user_roles WHERE lower(role) IN ("
+            "SELECT descendant FROM role_closure WHERE ancestor = NEW.role_name UNION SELECT OLD.role_name))",
+            "",
+        ),
+        # Descendants keep stale rows for the deleted role's ancestors until
+        # role_hierarchy.refresh_role_closure rewrites them
+        'roles_delete': (
+            "AFTER DELETE ON roles",
+            "",
+            holders.format(role="OLD.role_name"),
+            "DELETE FROM role_parents WHERE role_name = OLD.role_name OR parent_name = OLD.role_name;\n"
+            "DELETE FROM role_closure WHERE ancestor = OLD.role_name OR descendant = OLD.role_name;",
+        ),
+    }
+    for name, (event, before, users, after) in triggers.items():
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_effective_permissions_{name}")
+        cursor.execute(
+            f"CREATE TRIGGER trg_effective_permissions_{name} {event} BEGIN\n{before}\n"
+            f"{_refresh_effective_permissions_sql(users, _INHERITED_PERMISSIONS_SQL)}\n{after}\nEND"
+        )
+
+    cursor.execute("DELETE FROM user_effective_permissions")
+    cursor.execute(
+        "INSERT OR IGNORE INTO user_effective_permissions (user_id, permission)"
+        + _INHERITED_PERMISSIONS_SQL.format(users="(SELECT user_id FROM user_roles)")
+    )
+
+
+def _migration_014_prompt_search(cursor):
+    """Add an FTS5 index over activity_details.prompt, maintained by triggers
+
+    activity_details has a TEXT primary key, and its implicit rowids may be
+    renumbered by VACUUM, so the index is keyed by prompt_docs.docid
+    instead. prompt_docs also carries the owner and timestamp used for
+    history paging. The FTS table stores no text of its own; snippets read
+    the prompt back through prompt_search_source.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS prompt_docs (
+        docid INTEGER PRIMARY KEY,
+        detail_id TEXT NOT NULL UNIQUE,
+        user_id TEXT NOT NULL,
+        activity_type TEXT,
+        created_at TEXT NOT NULL
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_prompt_docs_user ON prompt_docs (user_id, docid)")
+    cursor.execute('''
+    CREATE VIEW IF NOT EXISTS prompt_search_source AS
+    SELECT p.docid, d.prompt, p.user_id AS owner
+    FROM prompt_docs p JOIN activity_details d ON d.id = p.detail_id
+    ''')
+    # The owner column lets a per-user search intersect posting lists
+    # instead of filtering every match afterwards
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS prompt_search USING fts5(
+        prompt, owner,
+        content='prompt_search_source', content_rowid='docid',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    ''')
+    # Rank by the prompt column only
+    cursor.execute("INSERT INTO prompt_search (prompt_search, rank) VALUES ('rank', 'bm25(1.0, 0.0)')")
+
+    cursor.execute("DROP TRIGGER IF EXISTS trg_prompt_search_insert")
+    cursor.execute('''
+    CREATE TRIGGER trg_prompt_search_insert AFTER INSERT ON activity_details BEGIN
+        INSERT INTO prompt_docs (detail_id, user_id, activity_type, created_at)
+        SELECT NEW.id, a.user_id, a.activity_type, NEW.prompt_timestamp
+        FROM user_activity a WHERE a.id = NEW.activity_id;
+        INSERT INTO prompt_search (rowid, prompt, owner)
+        SELECT docid, NEW.prompt, user_id FROM prompt_docs WHERE detail_id = NEW.id;
+    END
+    ''')
+    cursor.execute("DROP TRIGGER IF EXISTS trg_prompt_search_update")
+    cursor.execute('''
+    CREATE TRIGGER trg_prompt_search_update AFTER UPDATE OF prompt ON activity_details BEGIN
+        INSERT INTO prompt_search (prompt_search, rowid, prompt, owner)
+        SELECT 'delete', docid, OLD.prompt, user_id FROM prompt_docs WHERE detail_id = OLD.id;
+        INSERT INTO prompt_search (rowid, prompt, owner)
+        SELECT docid, NEW.prompt, user_id FROM prompt_docs WHERE detail_id = NEW.id;
+    END
+    ''')
+    cursor.execute("DROP TRIGGER IF EXISTS trg_prompt_search_delete")
+    cursor.execute('''
+    CREATE TRIGGER trg_prompt_search_delete AFTER DELETE ON activity_details BEGIN
+        INSERT INTO prompt_search (prompt_search, rowid, prompt, owner)
+        SELECT 'delete', docid, OLD.prompt, user_id FROM prompt_docs WHERE detail_id = OLD.id;
+        DELETE FROM prompt_docs WHERE detail_id = OLD.id;
+    END
+    ''')
+
+    # Backfill in prompt order so docids follow time, then build the index
+    cursor.execute('''
+    INSERT OR IGNORE INTO prompt_docs (detail_id, user_id, activity_type, created_at)
+    SELECT d.id, a.user_id, a.activity_type, d.prompt_timestamp
+    FROM activity_details d JOIN user_activity a ON a.id = d.activity_id
+    ORDER BY d.prompt_timestamp, d.id
+    ''')
+    cursor.execute("INSERT INTO prompt_search (prompt_search) VALUES ('rebuild')")
+
+
+def _prompt_text_sql(row):
+    """SQL for a prompt's text, whether stored inline or as an uncompressed blob"""
+    return (f"COALESCE(NULLIF({row}.prompt, ''), "
+            f"(SELECT CAST(data AS TEXT) FROM content_blobs WHERE hash = {row}.prompt_hash AND codec = 'raw'))")
+
+
+def _migration_015_content_blobs(cursor):
+    """Add content-addressed blobs for prompts and responses
+
+    Activity rows gain a hash column pointing into content_blobs; rows
+    written before this migration keep their inline text until
+    migrate_blobs.py moves them. refcount is kept by triggers, and the
+    prompt search triggers now read the prompt through the blob when the
+    inline column is empty.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS blob_dictionaries (
+        id INTEGER PRIMARY KEY,
+        codec TEXT NOT NULL,
+        data BLOB NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    ''')
+    # data is last so the small columns are read without touching overflow pages
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS content_blobs (
+        hash BLOB PRIMARY KEY,
+        codec TEXT NOT NULL,
+        dict_id INTEGER REFERENCES blob_dictionaries(id),
+        size INTEGER NOT NULL,
+        stored_size INTEGER NOT NULL,
+        refcount INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL,
+        data BLOB NOT NULL
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_content_blobs_unreferenced ON content_blobs (hash) WHERE refcount <= 0")
+
+    for table, column in (('activity_details', 'prompt_hash'), ('activity_responses', 'response_hash')):
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} BLOB")
+
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_blob_refs_{table}_insert")
+        cursor.execute(f'''
+        CREATE TRIGGER trg_blob_refs_{table}_insert AFTER INSERT ON {table}
+        WHEN NEW.{column} IS NOT NULL BEGIN
+            UPDATE content_blobs SET refcount = refcount + 1 WHERE hash = NEW.{column};
+        END
+        ''')
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_blob_refs_{table}_update")
+        cursor.execute(f'''
+        CREATE TRIGGER trg_blob_refs_{table}_update AFTER UPDATE OF {column} ON {table}
+        WHEN OLD.{column} IS NOT NEW.{column} BEGIN
+            UPDATE content_blobs SET refcount = refcount - 1 WHERE hash = OLD.{column};
+            UPDATE content_blobs SET refcount = refcount + 1 WHERE hash = NEW.{column};
+        END
+        ''')
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_blob_refs_{table}_delete")
+        cursor.execute(f'''
+        CREATE TRIGGER trg_blob_refs_{table}_delete AFTER DELETE ON {table}
+        WHEN OLD.{column} IS NOT NULL BEGIN
+            UPDATE content_blobs SET refcount = refcount - 1 WHERE hash = OLD.{column};
+        END
+        ''')
+
+    cursor.execute("DROP VIEW IF EXISTS prompt_search_source")
+    cursor.execute(f'''
+    CREATE VIEW prompt_search_source AS
+    SELECT p.docid, {_prompt_text_sql('d')} AS prompt, p.user_id AS owner
+    FROM prompt_docs p JOIN activity_details d ON d.id = p.detail_id
+    ''')
+    cursor.execute("DROP TRIGGER IF EXISTS trg_prompt_search_insert")
+    cursor.execute(f'''
+    CREATE TRIGGER trg_prompt_search_insert AFTER INSERT ON activity_details BEGIN
+        INSERT INTO prompt_docs (detail_id, user_id, activity_type, created_at)
+        SELECT NEW.id, a.user_id, a.activity_type, NEW.prompt_timestamp
+        FROM user_activity a WHERE a.id = NEW.activity_id;
+        INSERT INTO prompt_search (rowid, prompt, owner)
+        SELECT docid, {_prompt_text_sql('NEW')}, user_id FROM prompt_docs WHERE detail_id = NEW.id;
+    END
+    ''')
+    # Moving a prompt into a blob leaves its text unchanged; skip the reindex
+    cursor.execute("DROP TRIGGER IF EXISTS trg_prompt_search_update")
+    cursor.execute(f'''
+    CREATE TRIGGER trg_prompt_search_update AFTER UPDATE OF prompt, prompt_hash ON activity_details
+    WHEN {_prompt_text_sql('OLD')} IS NOT {_prompt_text_sql('NEW')} BEGIN
+        INSERT INTO prompt_search (prompt_search, rowid, prompt, owner)
+        SELECT 'delete', docid, {_prompt_text_sql('OLD')}, user_id FROM prompt_docs WHERE detail_id = OLD.id;
+        INSERT INTO prompt_search (rowid, prompt, owner)
+        SELECT docid, {_prompt_text_sql('NEW')}, user_id FROM prompt_docs WHERE detail_id = NEW.id;
+    END
+    ''')
+    cursor.execute("DROP TRIGGER IF EXISTS trg_prompt_search_delete")
+    cursor.execute(f'''
+    CREATE TRIGGER trg_prompt_search_delete AFTER DELETE ON activity_details BEGIN
+        INSERT INTO prompt_search (prompt_search, rowid, prompt, owner)
+        SELECT 'delete', docid, {_prompt_text_sql('OLD')}, user_id FROM prompt_docs WHERE detail_id = OLD.id;
+        DELETE FROM prompt_docs WHERE detail_id = OLD.id;
+    END
+    ''')
+
+
+def _migration_016_activity_partitions(cursor):
+    """Add the activity partition catalog and a timestamp index for sealing by month"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS activity_partitions (
+        month TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        path TEXT NOT NULL,
+        activities INTEGER NOT NULL DEFAULT 0,
+        details INTEGER NOT NULL DEFAULT 0,
+        responses INTEGER NOT NULL DEFAULT 0,
+        bytes INTEGER NOT NULL DEFAULT 0,
+        sealed_at TEXT,
+        archived_at TEXT
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_activity_timestamp ON user_activity (activity_timestamp, id)")
+
+
+# Ordered list of (version, description, function). Append new migrations
+# at the end with the next version number; never renumber or edit one that
+# has shipped.
+MIGRATIONS = [
+    (1, "baseline schema and default roles", _migration_001_baseline),
+    (2, "hot-path indexes", _migration_002_hot_path_indexes),
+    (3, "user listing sort indexes", _migration_003_user_listing_indexes),
+    (4, "permission epochs", _migration_004_permission_epochs),
+    (5, "hashed session tokens", _migration_005_hashed_sessions),
+    (6, "revoked token list", _migration_006_revoked_tokens),
+    (7, "rate limiter state", _migration_007_rate_limits),
+    (8, "API key prefix and secret hash", _migration_008_api_key_auth),
+    (9, "id sequences", _migration_009_id_sequences),
+    (10, "session epochs", _migration_010_session_epochs),
+    (11, "server-side web sessions", _migration_011_web_sessions),
+    (12, "trigger-maintained effective permissions", _migration_012_effective_permissions),
+    (13, "role inheritance closure", _migration_013_role_inheritance),
+    (14, "full-text prompt search", _migration_014_prompt_search),
+    (15, "content-addressed blobs", _migration_015_content_blobs),
+    (16, "activity partition catalog", _migration_016_activity_partitions),
+]
+
+# Queries that run on every request. Each one must be answered through an
+# index; check_query_plans() reports any that fall back to a table scan.
+HOT_QUERIES = {
+    'get_user': ("SELECT id, username, full_name, email, bio, profile_pic, created_at, updated_at FROM users WHERE id = ?", ('x',)),
+    'get_user_roles': ("SELECT id, role FROM user_roles WHERE user_id = ?", ('x',)),
+    'get_role_permissions': ("SELECT permission FROM role_permissions WHERE role_id = ?", ('x',)),
+    'validate_session_token': ("SELECT user_id, expiration_time FROM sessions WHERE token_hash = ? AND expiration_time > ?", ('x', 0)),
+    'sweep_expired_sessions': ("SELECT id FROM sessions WHERE expiration_time <= ? LIMIT ?", (0, 500)),
+    'sync_session_epochs': ("SELECT user_id, epoch, changed_seq FROM session_epochs WHERE changed_seq > ? ORDER BY changed_seq", (0,)),
+    'load_web_session': ("SELECT data, expires_at FROM web_sessions WHERE id = ? AND expires_at > ?", ('x', 0)),
+    'purge_web_sessions': ("SELECT id FROM web_sessions WHERE expires_at <= ? LIMIT ?", (0, 500)),
+    'user_effective_permissions': ("SELECT permission FROM user_effective_permissions WHERE user_id = ?", ('x',)),
+    'users_with_permission': ("SELECT user_id FROM user_effective_permissions WHERE permission = ? ORDER BY user_id", ('x',)),
+    'users_holding_role': ("SELECT user_id FROM user_roles WHERE lower(role) IN (?, ?)", ('x', 'y')),
+    'role_ancestors': ("SELECT ancestor, depth FROM role_closure WHERE descendant = ? AND depth > 0", ('x',)),
+    'role_descendants': ("SELECT descendant FROM role_closure WHERE ancestor = ?", ('x',)),
+    'role_parents': ("SELECT parent_name FROM role_parents WHERE role_name = ? ORDER BY parent_name", ('x',)),
+    'check_revoked_token': ("SELECT 1 FROM revoked_tokens WHERE token_hash = ? AND expires_at > ?", ('x', 0)),
+    'sync_revoked_tokens': ("SELECT id, token_hash FROM revoked_tokens WHERE id > ? ORDER BY id", (0,)),
+    'purge_revoked_tokens': ("SELECT id FROM revoked_tokens WHERE expires_at <= ? LIMIT ?", (0, 500)),
+    'rate_limit_gcra': ("SELECT tat FROM rate_limits WHERE limiter = ? AND key = ?", ('login', 'x')),
+    'rate_limit_window': ("SELECT COUNT(*), MIN(ts) FROM rate_limit_log WHERE limiter = ? AND key = ? AND ts > ?", ('login', 'x', 0)),
+    'purge_rate_limit_log': ("SELECT rowid FROM rate_limit_log WHERE limiter = ? AND ts <= ? LIMIT ?", ('login', 0, 500)),
+    'authenticate_api_key': ("SELECT id, user_id, api_key, secret_hash, api_secret FROM api_keys WHERE key_prefix = ? AND COALESCE(status, 'Active') = 'Active'", ('x',)),
+    'get_user_api_keys': ("SELECT id, api_key, created_at, status FROM api_keys WHERE user_id = ? ORDER BY created_at DESC", ('x',)),
+    'get_api_key_permissions': ("SELECT permission_name FROM api_role_permissions WHERE api_key_id = ?", ('x',)),
+    'delete_role_reassign': ("UPDATE user_roles SET role = ? WHERE role = ?", ('basic_user', 'x')),
+    'get_user_activity': ("SELECT id FROM user_activity WHERE user_id = ?", ('x',)),
+    'get_activity_details': ("SELECT id, prompt FROM activity_details WHERE activity_id = ?", ('x',)),
+    'prompt_history': ("SELECT docid FROM prompt_docs WHERE user_id = ? AND docid < ? ORDER BY docid DESC LIMIT 21", ('x', 1 << 62)),
+    'prompt_detail': ("SELECT d.id, d.prompt FROM prompt_docs p JOIN activity_details d ON d.id = p.detail_id WHERE p.docid = ?", (1,)),
+    'prompt_responses': ("SELECT activity_detail_id, response, response_hash FROM activity_responses WHERE activity_detail_id IN (?, ?)", ('x', 'y')),
+    'load_blobs': ("SELECT hash, codec, dict_id, data FROM content_blobs WHERE hash IN (?, ?)", (b'x', b'y')),
+    'collect_blobs': ("SELECT hash FROM content_blobs WHERE refcount <= 0 LIMIT ?", (500,)),
+    'blob_refcount': ("UPDATE content_blobs SET refcount = refcount + 1 WHERE hash = ?", (b'x',)),
+    'oldest_activity': ("SELECT MIN(activity_timestamp) FROM user_activity", ()),
+    'activity_in_month': ("SELECT id FROM user_activity WHERE activity_timestamp >= ? AND activity_timestamp < ? ORDER BY activity_timestamp, id LIMIT ?", ('2025-01', '2025-02', 1000)),
+    'list_users_by_username': ("SELECT u.id FROM users u WHERE u.username >= ? AND (u.username > ? OR u.id > ?) ORDER BY u.username, u.id LIMIT 51", ('a', 'a', 'x')),
+    'list_users_by_created_at': ("SELECT u.id FROM users u WHERE u.created_at <= ? AND (u.created_at < ? OR u.id < ?) ORDER BY u.created_at DESC, u.id DESC LIMIT 51", ('z', 'z', 'x')),
+    'list_users_by_full_name': ("SELECT u.id FROM users u WHERE COALESCE(u.full_name, '') >= ? AND (COALESCE(u.full_name, '') > ? OR u.id > ?) ORDER BY COALESCE(u.full_name, ''), u.id LIMIT 51", ('a', 'a', 'x')),
+}
+
+
+def _ensure_version_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )
+    ''')
+    conn.commit()
+
+
+def get_schema_version(conn):
+    """Get the highest applied migration version
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database
+
+    Returns:
+        int: The current schema version, 0 for an unmigrated database
+    """
+    try:
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def pending_migrations(conn):
+    """Get the migrations that have not been applied yet
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database
+
+    Returns:
+        list: (version, description, function) tuples in apply order
+    """
+    current = get_schema_version(conn)
+    return [m for m in MIGRATIONS if m[0] > current]
+
+
+def apply_migrations(conn):
+    """Apply all pending migrations, one transaction per migration
+
+    The write lock is taken before re-reading the version, so concurrent
+    deploys cannot apply the same migration twice.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database
+
+    Returns:
+        list: Versions that were applied
+    """
+    _ensure_version_table(conn)
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= get_schema_version(conn):
+                conn.rollback()
+                continue
+            migrate(conn.cursor())
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.now().isoformat())
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            logging.error(f"Migration {version} ({description}) failed: {str(e)}")
+            raise
+        logging.info(f"Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+_INDEX_SCAN = re.compile(r' USING (COVERING )?INDEX ')
+
+
+def check_query_plans(conn):
+    """Run EXPLAIN QUERY PLAN over HOT_QUERIES and report index misses
+
+    Args:
+        conn (sqlite3.Connection): Connection to a migrated database
+
+    Returns:
+        dict: Query name mapped to the offending plan lines; empty if all use indexes
+    """
+    problems = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        # A SCAN driven by an index (e.g. a partial one) is fine; a table scan is not
+        bad = [line for line in plan
+               if (line.startswith('SCAN ') and not _INDEX_SCAN.search(line)) or 'TEMP B-TREE' in line]
+        if bad:
+            problems[name] = bad
+    return problems
+
+
+if __name__ == '__main__':
+    from db_pool import ConnectionPool
+
+    logging.basicConfig(level=logging.INFO)
+    db_path = 'database.db'
+    args = sys.argv[1:]
+    if args and not args[0].startswith('--'):
+        db_path = args.pop(0)
+
+    pool = ConnectionPool(db_path, size=1)
+    with pool.connection() as conn:
+        if '--status' in args:
+            current = get_schema_version(conn)
+            for version, description, _ in MIGRATIONS:
+                state = 'applied' if version <= current else 'pending'
+                print(f"{version:>4}  {state:<8} {description}")
+        elif '--check-plans' in args:
+            problems = check_query_plans(conn)
+            for name, lines in problems.items():
+                print(f"{name}: {'; '.join(lines)}")
+            if problems:
+                sys.exit(1)
+            print(f"All {len(HOT_QUERIES)} hot queries use an index")
+        else:
+            applied = apply_migrations(conn)
+            print(f"Schema at version {get_schema_version(conn)} ({len(applied)} migration(s) applied)")
+    pool.close()
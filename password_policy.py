@@ -0,0 +1,171 @@
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import bcrypt
+from password_service import password_hasher
+
+# $2a$, $2b$ or $2y$ followed by the two-digit cost factor
+_BCRYPT_PATTERN = re.compile(r'^\$2[aby]\$(\d{2})\$')
+
+
+def bcrypt_cost(hashed):
+    """Get the cost factor of a bcrypt hash
+
+    Returns:
+        int: The cost factor, or None if ``hashed`` is not a bcrypt hash
+    """
+    if isinstance(hashed, bytes):
+        hashed = hashed.decode('utf-8', 'replace')
+    match = _BCRYPT_PATTERN.match(hashed or '')
+    return int(match.group(1)) if match else None
+
+
+class PasswordPolicy:
+    """The bcrypt cost factor used for new password hashes
+
+    The cost is read from ``policy_file``, written by ``--calibrate`` on the
+    deployed machine, so verification meets a target latency on that CPU
+    instead of relying on bcrypt's built-in default. Stored hashes whose
+    cost is below the policy, or above ``max_rounds``, are out of policy
+    and get rehashed the next time their owner logs in.
+    """
+
+    def __init__(self, policy_file="password_policy.json", rounds=12, min_rounds=10, max_rounds=16):
+        """Initialize the policy
+
+        Args:
+            policy_file (str, optional): JSON file written by calibrate. Defaults to "password_policy.json".
+            rounds (int, optional): Cost used when no policy file exists. Defaults to 12.
+            min_rounds (int, optional): Calibration never goes below this. Defaults to 10.
+            max_rounds (int, optional): Calibration never goes above this. Defaults to 16.
+        """
+        self.policy_file = policy_file
+        self.rounds = rounds
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+        self.target_ms = None
+        self.load()
+
+    def load(self):
+        """Read the calibrated cost from the policy file, if there is one"""
+        if not os.path.exists(self.policy_file):
+            return
+        try:
+            with open(self.policy_file, "r") as f:
+                data = json.load(f)
+            self.rounds = min(max(int(data['rounds']), self.min_rounds), self.max_rounds)
+            self.target_ms = data.get('target_ms')
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"Error loading password policy: {str(e)}")
+
+    def save(self):
+        """Write the current cost to the policy file"""
+        with open(self.policy_file, "w") as f:
+            json.dump({'rounds': self.rounds, 'target_ms': self.target_ms}, f, indent=2)
+
+    def calibrate(self, target_ms=250, samples=3):
+        """Pick the highest cost whose verification fits in ``target_ms`` on this CPU
+
+        Each extra round doubles the work, so costs are timed from
+        ``min_rounds`` upwards until one exceeds the target.
+
+        Args:
+            target_ms (float, optional): Verification latency budget in milliseconds. Defaults to 250.
+            samples (int, optional): Timings per cost; the fastest is used. Defaults to 3.
+
+        Returns:
+            dict: Chosen rounds and the measured milliseconds per cost
+        """
+        password = b'calibration-password'
+        timings = {}
+        chosen = self.min_rounds
+        for rounds in range(self.min_rounds, self.max_rounds + 1):
+            hashed = bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+            best = None
+            for _ in range(samples):
+                start = time.perf_counter()
+                bcrypt.checkpw(password, hashed)
+                elapsed = (time.perf_counter() - start) * 1000
+                best = elapsed if best is None else min(best, elapsed)
+            timings[rounds] = best
+            if best > target_ms:
+                break
+            chosen = rounds
+
+        self.rounds = chosen
+        self.target_ms = target_ms
+        return {'rounds': chosen, 'timings_ms': timings}
+
+    def needs_rehash(self, hashed):
+        """Check whether a stored hash is outside the current policy"""
+        cost = bcrypt_cost(hashed)
+        return cost is None or cost < self.rounds or cost > self.max_rounds
+
+
+# Shared by every caller in this process
+password_policy = PasswordPolicy()
+
+
+def hash_password(password):
+    """Hash a password at the policy cost in the password worker pool
+
+    Raises:
+        PasswordServiceBusy: If the worker pool is saturated
+    """
+    return password_hasher.hash(password, rounds=password_policy.rounds)
+
+
+def verify_password(stored_password, provided_password):
+    """Verify a password against its bcrypt hash in the password worker pool
+
+    Raises:
+        PasswordServiceBusy: If the worker pool is saturated
+    """
+    return password_hasher.verify(provided_password, stored_password)
+
+
+def verify_and_update(stored_password, provided_password):
+    """Verify a password and rehash it if the stored hash is out of policy
+
+    Rehashing is best effort: if the worker pool is busy the old hash is
+    kept and the login still succeeds.
+
+    Returns:
+        tuple: (valid, new_hash); new_hash is None unless a rehash is needed and was computed
+    """
+    if not verify_password(stored_password, provided_password):
+        return False, None
+    if not password_policy.needs_rehash(stored_password):
+        return True, None
+    try:
+        return True, hash_password(provided_password)
+    except Exception as e:
+        logging.warning(f"Skipping password rehash: {str(e)}")
+        return True, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or calibrate the bcrypt cost factor")
+    parser.add_argument('--calibrate', action='store_true', help="Time bcrypt on this CPU and save the chosen cost")
+    parser.add_argument('--target-ms', type=float, default=250, help="Verification latency budget (default 250)")
+    parser.add_argument('--policy-file', default="password_policy.json")
+    args = parser.parse_args()
+
+    policy = PasswordPolicy(policy_file=args.policy_file)
+    if args.calibrate:
+        result = policy.calibrate(target_ms=args.target_ms)
+        for rounds, ms in result['timings_ms'].items():
+            print(f"cost {rounds:>2}: {ms:8.1f} ms")
+        policy.save()
+        print(f"Saved cost {policy.rounds} (target {args.target_ms:g} ms) to {args.policy_file}")
+    else:
+        print(f"Cost factor: {policy.rounds} (target {policy.target_ms or 'not calibrated'} ms)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+
+
+class PasswordServiceBusy(Exception):
+    """Raised when the hashing pool is saturated; callers should answer 503"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PasswordServiceTimeout(PasswordServiceBusy):
+    """Raised when a hash or verify call did not finish within its timeout"""
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _checkpw(password, hashed):
+    try:
+        return bcrypt.checkpw(password, hashed)
+    except ValueError:
+        # Not a bcrypt hash
+        return False
+
+
+class PasswordHasher:
+    """bcrypt hashing and verification in a pool of worker processes
+
+    Request threads submit work and wait for the result. At most
+    ``max_pending`` calls may be queued or running at once. Past that,
+    ``hash`` and ``verify`` raise PasswordServiceBusy right away instead of
+    queuing, so a flood of logins cannot tie up every WSGI thread and cheap
+    routes keep answering. The process pool is started on first use.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None, timeout=5.0, rounds=12):
+        """Initialize the service
+
+        Args:
+            max_workers (int, optional): Worker processes. Defaults to the CPU count.
+            max_pending (int, optional): Calls allowed in flight before rejecting. Defaults to 4 per worker.
+            timeout (float, optional): Seconds a caller waits for its result. Defaults to 5.
+            rounds (int, optional): bcrypt cost factor for new hashes. Defaults to 12.
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 4
+        self.timeout = timeout
+        self.rounds = rounds
+
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+        # Metrics
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn avoids forking a process that is running threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _retry_after(self):
+        """Rough seconds until a slot frees up, from the average call latency"""
+        average = self.total_latency / self.completed if self.completed else 0.25
+        return max(int(average * self.max_pending / self.max_workers + 0.999), 1)
+
+    def _submit(self, func, *args):
+        try:
+            return self._get_executor().submit(func, *args)
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool and try once more
+            logging.error("Password worker pool broke; restarting it")
+            with self._lock:
+                self._executor = None
+            return self._get_executor().submit(func, *args)
+
+    def _run(self, func, *args, timeout=None):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordServiceBusy("Password service is busy", self._retry_after())
+
+        start = time.perf_counter()
+        with self._lock:
+            self.in_flight += 1
+
+        def _done(_future):
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.total_latency += elapsed
+                self.max_latency = max(self.max_latency, elapsed)
+            self._slots.release()
+
+        try:
+            future = self._submit(func, *args)
+        except Exception:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+            raise
+        # The slot is held until the work finishes, even if the caller gives up
+        future.add_done_callback(_done)
+
+        try:
+            return future.result(timeout=timeout or self.timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise PasswordServiceTimeout("Password service timed out", self._retry_after())
+
+    def hash(self, password, rounds=None):
+        """Hash a password
+
+        Returns:
+            str: The bcrypt hash
+        """
+        if isinstance(password, str):
+            password = password.encode('utf-8')
+        return self._run(_hashpw, password, rounds or self.rounds)
+
+    def verify(self, password, hashed):
+        """Check a password against a bcrypt hash
+
+        Returns:
+            bool: True if the password matches
+        """
+        if not password or not hashed:
+            return False
+        if isinstance(password, str):
+            password = password.encode('utf-8')
+        if isinstance(hashed, str):
+            hashed = hashed.encode('utf-8')
+        return self._run(_checkpw, password, hashed)
+
+    def stats(self):
+        """Get queue depth, rejections, timeouts and latency"""
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'in_flight': self.in_flight,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'avg_latency': self.total_latency / self.completed if self.completed else 0.0,
+                'max_latency': self.max_latency,
+            }
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+# Shared by every route in this process
+password_hasher = PasswordHasher()
@@ -0,0 +1,169 @@
+import sqlite3
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+# Scopes tracked in the permission_epochs table. Every write that changes
+# the roles table bumps 'roles'; every change to a user's role assignments
+# bumps 'user_roles'.
+ROLES_SCOPE = 'roles'
+USER_ROLES_SCOPE = 'user_roles'
+
+
+def bump_epoch(conn, scope):
+    """Increment a permission epoch inside the caller's transaction
+
+    Args:
+        conn (sqlite3.Connection): Connection holding the write transaction
+        scope (str): ROLES_SCOPE or USER_ROLES_SCOPE
+
+    Returns:
+        int: The new epoch value, or None if the epochs table is missing
+    """
+    try:
+        row = conn.execute(
+            "UPDATE permission_epochs SET version = version + 1 WHERE scope = ? RETURNING version",
+            (scope,)
+        ).fetchone()
+    except sqlite3.OperationalError as e:
+        logging.error(f"Error bumping permission epoch: {str(e)}")
+        return None
+    return row[0] if row else None
+
+
+class PermissionResolver:
+    """In-process cache of per-user permissions
+
+    A user's granted permissions are read from user_effective_permissions,
+    which triggers keep in step with roles and user_roles, so a cache miss is
+    one indexed lookup. Each user's permissions are cached in a bounded LRU,
+    so has_permission is a set lookup. Writes made through Database invalidate exactly the
+    affected entries. Writes from other processes are picked up by comparing
+    the permission_epochs counters at most every ``sync_interval`` seconds.
+    """
+
+    def __init__(self, pool, max_users=10000, sync_interval=1.0):
+        """Initialize the resolver
+
+        Args:
+            pool (ConnectionPool): Pool used to load effective permissions
+            max_users (int, optional): Maximum cached users. Defaults to 10000.
+            sync_interval (float, optional): Seconds between epoch checks. Defaults to 1.0.
+        """
+        self.pool = pool
+        self.max_users = max_users
+        self.sync_interval = sync_interval
+
+        self._lock = threading.Lock()
+        self._users = OrderedDict()         # user_id -> frozenset
+        self._generation = 0                # bumped by every invalidation
+        self._epochs = {}
+        self._last_sync = 0.0
+
+        self.hits = 0
+        self.misses = 0
+
+    def _sync_epochs(self):
+        """Drop cached state that another process has invalidated"""
+        now = time.monotonic()
+        if now - self._last_sync < self.sync_interval:
+            return
+        self._last_sync = now
+        try:
+            with self.pool.connection() as conn:
+                epochs = dict(conn.execute("SELECT scope, version FROM permission_epochs").fetchall())
+        except sqlite3.Error as e:
+            logging.error(f"Error reading permission epochs: {str(e)}")
+            return
+
+        with self._lock:
+            if epochs != self._epochs:
+                # We cannot tell which users changed elsewhere; drop them all
+                self._users.clear()
+                self._generation += 1
+            self._epochs = epochs
+
+    def _resolve(self, user_id):
+        """Get a user's merged permissions as a frozenset"""
+        self._sync_epochs()
+
+        with self._lock:
+            cached = self._users.get(user_id)
+            if cached is not None:
+                self._users.move_to_end(user_id)
+                self.hits += 1
+                return cached
+            self.misses += 1
+            generation = self._generation
+
+        with self.pool.connection() as conn:
+            merged = frozenset(row[0] for row in conn.execute(
+                "SELECT permission FROM user_effective_permissions WHERE user_id = ?", (user_id,)
+            ))
+
+        with self._lock:
+            # Only cache if nothing was invalidated while we were reading
+            if generation == self._generation:
+                self._users[user_id] = merged
+                if len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+        return merged
+
+    def get_user_permissions(self, user_id):
+        """Get all permissions for a user based on their roles
+
+        Returns:
+            dict: Combined permissions from all user roles, mapped to True
+        """
+        return dict.fromkeys(self._resolve(user_id), True)
+
+    def has_permission(self, user_id, permission):
+        """Check if a user has a specific permission (or 'all')"""
+        granted = self._resolve(user_id)
+        return 'all' in granted or permission in granted
+
+    def current_epoch(self):
+        """Get a token that changes whenever any role or role assignment changes
+
+        Returns:
+            str: The roles and user_roles epochs, as "<roles>.<user_roles>"
+        """
+        self._sync_epochs()
+        with self._lock:
+            return f"{self._epochs.get(ROLES_SCOPE)}.{self._epochs.get(USER_ROLES_SCOPE)}"
+
+    def invalidate_roles(self, epoch=None):
+        """Drop every cached user after a roles-table change"""
+        with self._lock:
+            self._users.clear()
+            self._generation += 1
+            self._adopt_epoch(ROLES_SCOPE, epoch)
+
+    def invalidate_user(self, user_id, epoch=None):
+        """Drop one user's cached permissions after their role assignments changed"""
+        with self._lock:
+            self._users.pop(user_id, None)
+            self._generation += 1
+            self._adopt_epoch(USER_ROLES_SCOPE, epoch)
+
+    def _adopt_epoch(self, scope, epoch):
+        """Record our own epoch bump so the next sync does not flush for it
+
+        Only a bump directly after the last seen value is adopted; a gap means
+        another process wrote in between, and the next sync must notice it.
+        """
+        known = self._epochs.get(scope)
+        if epoch is not None and known is not None and epoch == known + 1:
+            self._epochs[scope] = epoch
+
+    def stats(self):
+        """Get cache hit/miss counters and sizes"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'cached_users': len(self._users),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,258 @@
+import re
+import json
+import html
+import base64
+import sqlite3
+import logging
+
+# 'relevance' orders by bm25 (needs a query); 'recent' orders newest first
+SEARCH_SORTS = ('relevance', 'recent')
+
+# Highlight markers used inside SQL; replaced after the snippet is escaped
+_MARK_START = '\x01'
+_MARK_END = '\x02'
+_MAX_TERMS = 16
+
+
+def _quote(text):
+    """Quote text as an FTS5 string so none of its characters act as syntax"""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def build_match_query(text, prefix=True):
+    """Turn free text from a search box into a safe FTS5 query
+
+    Every word becomes a quoted term and all terms must match. With
+    ``prefix`` the last word also matches longer words, for search as you
+    type.
+
+    Args:
+        text (str): What the user typed
+        prefix (bool, optional): Treat the last word as a prefix. Defaults to True.
+
+    Returns:
+        str: The FTS5 query, or None if the text has no searchable words
+    """
+    terms = [term for term in re.split(r'[\W_]+', text or '') if term][:_MAX_TERMS]
+    if not terms:
+        return None
+    query = ' '.join(_quote(term) for term in terms)
+    return query + '*' if prefix else query
+
+
+def _highlight(snippet):
+    """HTML-escape a snippet and turn the match markers into <mark> tags"""
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+class PromptSearch:
+    """Prompt history and full-text search over activity_details
+
+    Prompts are indexed by the prompt_search FTS5 table, which triggers keep
+    in step with activity_details (see migration 14). Pages are fetched with
+    keyset cursors: by docid for history and recency, by (bm25 rank, docid)
+    for relevance, so a page costs the same however deep it is. bm25 scores
+    move slightly as the corpus grows, so a relevance cursor held across
+    many inserts may skip or repeat a borderline result.
+    """
+
+    def __init__(self, pool, blobs=None):
+        """Initialize the search helper
+
+        Args:
+            pool (ConnectionPool): Pool used for the queries
+            blobs (BlobStore, optional): Resolves prompts and responses stored as blobs. Defaults to None.
+        """
+        self.pool = pool
+        self.blobs = blobs
+
+    def history(self, user_id=None, query=None, limit=20, cursor=None, sort=None):
+        """Get one page of prompt history, optionally filtered by a search
+
+        Args:
+            user_id (str, optional): Only this user's prompts; None searches everyone. Defaults to None.
+            query (str, optional): Free-text search; None lists history newest first. Defaults to None.
+            limit (int, optional): Maximum items per page (1-100). Defaults to 20.
+            cursor (str, optional): The next_cursor returned for the previous page. Defaults to None.
+            sort (str, optional): One of SEARCH_SORTS. Defaults to 'relevance' with a query, else 'recent'.
+
+        Returns:
+            dict: 'items' (list of prompt dicts) and 'next_cursor' (str or None)
+
+        Raises:
+            ValueError: If the sort key or cursor is invalid
+        """
+        limit = max(1, min(int(limit), 100))
+        match = build_match_query(query) if query else None
+        if query and match is None:
+            return {'items': [], 'next_cursor': None}
+        sort = sort or ('relevance' if match else 'recent')
+        if sort not in SEARCH_SORTS:
+            raise ValueError(f"Invalid sort key: {sort}")
+        if sort == 'relevance' and match is None:
+            raise ValueError("Sorting by relevance needs a search query")
+        position = self._decode_cursor(cursor, sort) if cursor else None
+
+        if match is None:
+            rows = self._list_recent(user_id, limit + 1, position)
+        else:
+            match = f"prompt : ({match})"
+            if user_id is not None:
+                match = f"owner : {_quote(user_id)} AND {match}"
+            rows = self._search(match, sort, limit + 1, position)
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            docid, rank = rows[-1][0], rows[-1][1]
+            next_cursor = self._encode_cursor(sort, [rank, docid] if sort == 'relevance' else [docid])
+        return {'items': self._hydrate(rows), 'next_cursor': next_cursor}
+
+    def _list_recent(self, user_id, limit, position):
+        where, params = [], []
+        if user_id is not None:
+            where.append("user_id = ?")
+            params.append(user_id)
+        if position:
+            where.append("docid < ?")
+            params.append(position[0])
+        params.append(limit)
+        with self.pool.connection() as conn:
+            rows = conn.execute(f'''
+            SELECT docid FROM prompt_docs
+            {'WHERE ' + ' AND '.join(where) if where else ''}
+            ORDER BY docid DESC LIMIT ?
+            ''', params).fetchall()
+        return [(docid, None, None) for docid, in rows]
+
+    def _search(self, match, sort, limit, position):
+        params = [match]
+        if sort == 'relevance':
+            keyset = "AND (rank > ? OR (rank = ? AND rowid > ?))" if position else ""
+            if position:
+                params.extend([position[0], position[0], position[1]])
+            order = "rank, rowid"
+        else:
+            keyset = "AND rowid < ?" if position else ""
+            if position:
+                params.append(position[0])
+            order = "rowid DESC"
+        params.append(limit)
+        with self.pool.connection() as conn:
+            return conn.execute(f'''
+            SELECT rowid, rank, snippet(prompt_search, 0, char(1), char(2), '…', 12)
+            FROM prompt_search
+            WHERE prompt_search MATCH ? {keyset}
+            ORDER BY {order} LIMIT ?
+            ''', params).fetchall()
+
+    def _hydrate(self, rows):
+        """Load the prompt, owner and responses for one page of docids, keeping their order"""
+        if not rows:
+            return []
+        docids = [row[0] for row in rows]
+        placeholders = ', '.join('?' * len(docids))
+        with self.pool.connection() as conn:
+            details = {row[0]: row[1:] for row in conn.execute(f'''
+            SELECT p.docid, p.detail_id, p.user_id, p.activity_type, p.created_at, d.activity_id, d.prompt, d.prompt_hash
+            FROM prompt_docs p JOIN activity_details d ON d.id = p.detail_id
+            WHERE p.docid IN ({placeholders})
+            ''', docids)}
+            detail_ids = [detail[0] for detail in details.values()]
+            responses = {}
+            if detail_ids:
+                for detail_id, response, response_hash in conn.execute(
+                    f"SELECT activity_detail_id, response, response_hash FROM activity_responses WHERE activity_detail_id IN ({', '.join('?' * len(detail_ids))})",
+                    detail_ids
+                ):
+                    responses.setdefault(detail_id, []).append((response, response_hash))
+
+        # Texts moved into content_blobs leave the inline column empty
+        hashes = [detail[6] for detail in details.values() if detail[6] is not None]
+        hashes += [h for pairs in responses.values() for _, h in pairs if h is not None]
+        texts = self.blobs.get_many(hashes) if hashes and self.blobs is not None else {}
+
+        items = []
+        for docid, rank, snippet in rows:
+            detail = details.get(docid)
+            if detail is None:
+                continue
+            detail_id, user_id, activity_type, created_at, activity_id, prompt, prompt_hash = detail
+            if prompt_hash is not None:
+                prompt = texts.get(bytes(prompt_hash), prompt)
+            item_responses = [texts.get(bytes(h), response) if h is not None else response
+                              for response, h in responses.get(detail_id, [])]
+            items.append({
+                'id': detail_id,
+                'activity_id': activity_id,
+                'user_id': user_id,
+                'activity_type': activity_type,
+                'prompt': prompt,
+                'created_at': created_at,
+                'responses': item_responses,
+                # The generation UI renders the first response as the payload
+                'payload': item_responses[0] if item_responses else None,
+                'snippet': _highlight(snippet),
+                'score': -rank if rank is not None else None,
+            })
+        return items
+
+    def _encode_cursor(self, sort, position):
+        """Encode the position after the last row of a page as an opaque token"""
+        payload = json.dumps([sort] + position, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def _decode_cursor(self, cursor, sort):
+        """Decode a cursor, checking it was issued for the same sort order"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            cursor_sort, *position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        except (ValueError, TypeError):
+            raise ValueError("Invalid cursor")
+        if cursor_sort != sort:
+            raise ValueError("Cursor does not match the requested sort order")
+        if len(position) != (2 if sort == 'relevance' else 1):
+            raise ValueError("Invalid cursor")
+        return position
+
+    def optimize(self):
+        """Merge the index's segments into one; worth running after a bulk load
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            with self.pool.connection() as conn:
+                conn.execute("INSERT INTO prompt_search (prompt_search) VALUES ('optimize')")
+                conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Error optimizing prompt index: {str(e)}")
+            return False
+
+    def rebuild(self):
+        """Rebuild the index from activity_details, e.g. after rows were written with triggers off
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            with self.pool.connection() as conn:
+                conn.execute('''
+                DELETE FROM prompt_docs
+                WHERE NOT EXISTS (SELECT 1 FROM activity_details d WHERE d.id = prompt_docs.detail_id)
+                ''')
+                conn.execute('''
+                INSERT OR IGNORE INTO prompt_docs (detail_id, user_id, activity_type, created_at)
+                SELECT d.id, a.user_id, a.activity_type, d.prompt_timestamp
+                FROM activity_details d JOIN user_activity a ON a.id = d.activity_id
+                ORDER BY d.prompt_timestamp, d.id
+                ''')
+                conn.execute("INSERT INTO prompt_search (prompt_search) VALUES ('rebuild')")
+                conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Error rebuilding prompt index: {str(e)}")
+            return False
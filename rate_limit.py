@@ -0,0 +1,355 @@
+import sqlite3
+import time
+import threading
+import logging
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from functools import wraps
+from flask import request, jsonify, flash, redirect, url_for, current_app
+from api_key_auth import get_api_credentials
+
+
+@contextmanager
+def _transaction(conn, immediate=False):
+    """Run a block as its own transaction, or as a savepoint inside the caller's
+
+    A limiter used while the caller already has a transaction open must not
+    commit or roll back the caller's work.
+    """
+    if conn.in_transaction:
+        conn.execute("SAVEPOINT rate_limit")
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK TO SAVEPOINT rate_limit")
+            conn.execute("RELEASE SAVEPOINT rate_limit")
+            raise
+        conn.execute("RELEASE SAVEPOINT rate_limit")
+        return
+
+    if immediate:
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+class RateLimiter(ABC):
+    """Base class for rate limiters whose state is shared through SQLite
+
+    Every worker process that opens the same database sees the same
+    counters. Each limiter has a ``name`` that namespaces its keys, so one
+    table can hold several limiters. Keys that go idle are purged every
+    ``purge_interval`` seconds.
+
+    Once a key is denied, the time it may retry is remembered in a small
+    in-process dict. Further requests from that key are turned away without
+    touching SQLite until then, which keeps a client that is hammering an
+    endpoint off the write lock.
+    """
+
+    def __init__(self, pool, name, limit, period, purge_interval=60, max_denied=10000):
+        """Initialize the limiter
+
+        Args:
+            pool (ConnectionPool): Pool for the database holding the limiter tables
+            name (str): Namespace for this limiter's keys
+            limit (int): Requests allowed per period
+            period (float): Length of the period in seconds
+            purge_interval (float, optional): Seconds between idle-key purges. Defaults to 60.
+            max_denied (int, optional): Maximum keys in the local deny cache. Defaults to 10000.
+        """
+        self.pool = pool
+        self.name = name
+        self.limit = limit
+        self.period = period
+        self.purge_interval = purge_interval
+        self.max_denied = max_denied
+
+        self._denied = {}               # key -> monotonic time the key may retry
+        self._lock = threading.Lock()
+        self._last_purge = time.monotonic()
+
+        self.allowed = 0
+        self.rejected = 0
+        self.fast_rejected = 0
+
+    def hit(self, key):
+        """Record one request for a key
+
+        Args:
+            key (str): The client key (username, IP address, API key, ...)
+
+        Returns:
+            tuple: (allowed, retry_after) where retry_after is in seconds
+        """
+        now = time.monotonic()
+        until = self._denied.get(key)
+        if until is not None:
+            if until > now:
+                self.fast_rejected += 1
+                return False, until - now
+            self._denied.pop(key, None)
+
+        self._maybe_purge(now)
+        try:
+            allowed, retry_after = self._hit(key, time.time())
+        except sqlite3.Error as e:
+            # Fail open: an unavailable limiter must not lock everyone out
+            logging.error(f"Error updating rate limit: {str(e)}")
+            return True, 0.0
+
+        if allowed:
+            self.allowed += 1
+        else:
+            self.rejected += 1
+            self._remember_denied(key, now + retry_after)
+        return allowed, retry_after
+
+    def peek(self, key):
+        """Check whether a request for a key would be allowed, without recording it
+
+        Returns:
+            tuple: (allowed, retry_after) where retry_after is in seconds
+        """
+        now = time.monotonic()
+        until = self._denied.get(key)
+        if until is not None and until > now:
+            return False, until - now
+        try:
+            return self._peek(key, time.time())
+        except sqlite3.Error as e:
+            logging.error(f"Error reading rate limit: {str(e)}")
+            return True, 0.0
+
+    def reset(self, key):
+        """Forget all recorded requests for a key"""
+        self._denied.pop(key, None)
+        try:
+            self._reset(key)
+        except sqlite3.Error as e:
+            logging.error(f"Error resetting rate limit: {str(e)}")
+
+    def _remember_denied(self, key, until):
+        with self._lock:
+            if len(self._denied) >= self.max_denied:
+                now = time.monotonic()
+                for stale in [k for k, v in self._denied.items() if v <= now]:
+                    del self._denied[stale]
+                if len(self._denied) >= self.max_denied:
+                    return
+            self._denied[key] = until
+
+    def _maybe_purge(self, now):
+        if now - self._last_purge < self.purge_interval:
+            return
+        with self._lock:
+            if now - self._last_purge < self.purge_interval:
+                return
+            self._last_purge = now
+        try:
+            self._purge(time.time())
+        except sqlite3.Error as e:
+            logging.error(f"Error purging rate limits: {str(e)}")
+
+    @abstractmethod
+    def _hit(self, key, now):
+        """Record a request at ``now``; returns (allowed, retry_after)"""
+
+    @abstractmethod
+    def _peek(self, key, now):
+        """Check a request at ``now`` without recording it; returns (allowed, retry_after)"""
+
+    @abstractmethod
+    def _reset(self, key):
+        """Delete the stored state of a key"""
+
+    @abstractmethod
+    def _purge(self, now):
+        """Delete the state of keys that are idle at ``now``"""
+
+    def stats(self):
+        """Get allow/reject counters"""
+        return {
+            'name': self.name,
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+            'fast_rejected': self.fast_rejected,
+            'denied_keys': len(self._denied),
+        }
+
+
+class GCRALimiter(RateLimiter):
+    """Generic cell rate algorithm (a token bucket without a refill timer)
+
+    Each key is one row holding its theoretical arrival time (TAT). A request
+    is allowed if pushing the TAT forward by one emission interval keeps it
+    within ``period`` of now. This allows bursts of up to ``limit`` requests,
+    then one every ``period / limit`` seconds. The check and the update are a
+    single UPSERT, so concurrent workers cannot both take the last slot. A
+    key is idle once its TAT is in the past.
+    """
+
+    def _hit(self, key, now):
+        interval = self.period / self.limit
+        with self.pool.connection() as conn:
+            with _transaction(conn):
+                row = conn.execute('''
+                INSERT INTO rate_limits (limiter, key, tat) VALUES (?1, ?2, ?3 + ?4)
+                ON CONFLICT(limiter, key) DO UPDATE SET tat = MAX(tat, ?3) + ?4
+                WHERE MAX(tat, ?3) + ?4 - ?3 <= ?5
+                RETURNING tat
+                ''', (self.name, key, now, interval, self.period)).fetchone()
+            if row is not None:
+                return True, 0.0
+            tat = conn.execute(
+                "SELECT tat FROM rate_limits WHERE limiter = ? AND key = ?", (self.name, key)
+            ).fetchone()
+        if tat is None:
+            return True, 0.0
+        return False, max(tat[0] + interval - now - self.period, 0.0)
+
+    def _peek(self, key, now):
+        interval = self.period / self.limit
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT tat FROM rate_limits WHERE limiter = ? AND key = ?", (self.name, key)
+            ).fetchone()
+        if row is None:
+            return True, 0.0
+        retry_after = max(row[0], now) + interval - now - self.period
+        return retry_after <= 0, max(retry_after, 0.0)
+
+    def _reset(self, key):
+        with self.pool.connection() as conn:
+            with _transaction(conn):
+                conn.execute("DELETE FROM rate_limits WHERE limiter = ? AND key = ?", (self.name, key))
+
+    def _purge(self, now):
+        with self.pool.connection() as conn:
+            with _transaction(conn):
+                conn.execute("DELETE FROM rate_limits WHERE limiter = ? AND tat <= ?", (self.name, now))
+
+
+class SlidingWindowLimiter(RateLimiter):
+    """Sliding-window log: at most ``limit`` requests in any ``period`` seconds
+
+    Every request is logged with its timestamp. A request is allowed if fewer
+    than ``limit`` requests for the key fall inside the trailing window. This
+    is exact at the boundaries, at the cost of one row per request. Use it for
+    low-volume keys such as failed logins, where exactness matters more than
+    storage.
+    """
+
+    def _hit(self, key, now):
+        with self.pool.connection() as conn:
+            # Immediate, so the count and the insert see no concurrent writer
+            with _transaction(conn, immediate=True):
+                conn.execute(
+                    "DELETE FROM rate_limit_log WHERE limiter = ? AND key = ? AND ts <= ?",
+                    (self.name, key, now - self.period)
+                )
+                count, oldest = conn.execute(
+                    "SELECT COUNT(*), MIN(ts) FROM rate_limit_log WHERE limiter = ? AND key = ?",
+                    (self.name, key)
+                ).fetchone()
+                if count >= self.limit:
+                    return False, max(oldest + self.period - now, 0.0)
+                conn.execute(
+                    "INSERT INTO rate_limit_log (limiter, key, ts) VALUES (?, ?, ?)", (self.name, key, now)
+                )
+        return True, 0.0
+
+    def _peek(self, key, now):
+        with self.pool.connection() as conn:
+            count, oldest = conn.execute(
+                "SELECT COUNT(*), MIN(ts) FROM rate_limit_log WHERE limiter = ? AND key = ? AND ts > ?",
+                (self.name, key, now - self.period)
+            ).fetchone()
+        if count < self.limit:
+            return True, 0.0
+        return False, max(oldest + self.period - now, 0.0)
+
+    def _reset(self, key):
+        with self.pool.connection() as conn:
+            with _transaction(conn):
+                conn.execute("DELETE FROM rate_limit_log WHERE limiter = ? AND key = ?", (self.name, key))
+
+    def _purge(self, now, batch_size=500):
+        while True:
+            with self.pool.connection() as conn:
+                with _transaction(conn):
+                    deleted = conn.execute('''
+                    DELETE FROM rate_limit_log WHERE rowid IN (
+                        SELECT rowid FROM rate_limit_log WHERE limiter = ? AND ts <= ? LIMIT ?
+                    )
+                    ''', (self.name, now - self.period, batch_size)).rowcount
+            if deleted < batch_size:
+                break
+
+
+def client_ip():
+    """Key function: the client's IP address"""
+    return request.remote_addr or 'unknown'
+
+
+def form_field(name):
+    """Key function factory: a field from the form or JSON body, lowercased and prefixed with its name"""
+    def key_func():
+        data = request.get_json(silent=True) if request.is_json else request.form
+        value = (data or {}).get(name)
+        return f"{name}:{str(value).lower()}" if value else None
+    return key_func
+
+
+def api_key():
+    """Key function: the API key, from a Bearer token or the X-API-Key header"""
+    value, _ = get_api_credentials()
+    return f"api_key:{value}" if value else None
+
+
+def rate_limited(*rules, methods=('POST',)):
+    """Decorator applying one or more (limiter, key_func) rules to a route
+
+    Limiters are given by name and looked up in
+    ``current_app.extensions['rate_limiters']``, so they can be created by the
+    app factory rather than at import time. Every rule whose key function
+    returns a key is counted; the request is rejected if any of them is over
+    its limit. API routes get a JSON 429. Page routes flash a message and
+    redirect back. Both set Retry-After.
+
+    Args:
+        *rules: (limiter_name, key_func) pairs
+        methods (tuple, optional): HTTP methods to limit. Defaults to ('POST',).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method in methods:
+                limiters = current_app.extensions['rate_limiters']
+                for limiter_name, key_func in rules:
+                    key = key_func()
+                    if key is None:
+                        continue
+                    allowed, retry_after = limiters[limiter_name].hit(key)
+                    if not allowed:
+                        return _too_many_requests(retry_after)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def _too_many_requests(retry_after):
+    retry_after = max(int(retry_after + 0.999), 1)
+    message = f'Too many requests. Please try again in {retry_after} seconds.'
+    if request.path.startswith('/api/'):
+        response = jsonify({'success': False, 'message': message})
+        response.status_code = 429
+    else:
+        flash(message, 'error')
+        response = redirect(request.referrer or url_for('login'))
+    response.headers['Retry-After'] = str(retry_after)
+    return response
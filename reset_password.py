@@ -1,21 +1,22 @@
-import sqlite3
 import bcrypt
+from db_pool import ConnectionPool
+from password_policy import password_policy
 
 # Connect to database
 db_path = 'database.db'
-conn = sqlite3.connect(db_path)
-cursor = conn.cursor()
+pool = ConnectionPool(db_path, size=1)
 
 # Hash the new password
 new_password = 'A0ZzaE=asC#3'
-hashed = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+hashed = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt(password_policy.rounds))
 
-# Update password for TerminalThor
-cursor.execute('UPDATE users SET password = ? WHERE username = ?', 
-              (hashed.decode('utf-8'), 'TerminalThor'))
+with pool.connection() as conn:
+    # Update password for TerminalThor
+    conn.execute('UPDATE users SET password = ? WHERE username = ?', 
+                 (hashed.decode('utf-8'), 'TerminalThor'))
 
-# Commit changes
-conn.commit()
-conn.close()
+    # Commit changes
+    conn.commit()
+pool.close()
 
 print('Password reset complete! Use A0ZzaE=asC#3 to login')
@@ -0,0 +1,199 @@
+import sqlite3
+import math
+import threading
+import time
+import logging
+from session_store import hash_token
+
+
+class BloomFilter:
+    """A fixed-size Bloom filter over hex token hashes
+
+    Bit positions are sliced straight out of the SHA-256 hex digest, so a
+    membership test does no extra hashing.
+    """
+
+    def __init__(self, capacity, fp_rate=0.01):
+        """Initialize the filter
+
+        Args:
+            capacity (int): Number of items the filter is sized for
+            fp_rate (float, optional): Target false-positive rate at capacity. Defaults to 0.01.
+        """
+        self.capacity = max(capacity, 1)
+        self.size = max(int(-self.capacity * math.log(fp_rate) / (math.log(2) ** 2)), 8)
+        # A 64-char hex digest yields at most eight 32-bit slices
+        self.hash_count = min(max(int(round(self.size / self.capacity * math.log(2))), 1), 8)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def add(self, token_hash):
+        for i in range(self.hash_count):
+            position = int(token_hash[i * 8:(i + 1) * 8], 16) % self.size
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, token_hash):
+        bits = self.bits
+        size = self.size
+        for i in range(self.hash_count):
+            position = int(token_hash[i * 8:(i + 1) * 8], 16) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class RevocationList:
+    """Revoked session tokens shared by every worker through SQLite
+
+    Revoked token hashes are stored in revoked_tokens with the time the
+    underlying session would have expired anyway, and are purged after that.
+    Each process keeps a Bloom filter of the live entries. The common "not
+    revoked" answer therefore never touches the database, and only Bloom
+    hits are confirmed with an indexed lookup. Revocations made by other
+    processes are folded into the filter every ``sync_interval`` seconds.
+    """
+
+    def __init__(self, pool, capacity=100000, fp_rate=0.01, sync_interval=1.0, purge_interval=300):
+        """Initialize the revocation list
+
+        Args:
+            pool (ConnectionPool): Pool used to read and write revoked_tokens
+            capacity (int, optional): Initial Bloom filter capacity; grows as needed. Defaults to 100000.
+            fp_rate (float, optional): Target Bloom false-positive rate. Defaults to 0.01.
+            sync_interval (float, optional): Seconds between syncs with other processes. Defaults to 1.0.
+            purge_interval (float, optional): Seconds between purges of expired entries. Defaults to 300.
+        """
+        self.pool = pool
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.sync_interval = sync_interval
+        self.purge_interval = purge_interval
+
+        self._lock = threading.Lock()
+        self._bloom = BloomFilter(capacity, fp_rate)
+        self._last_id = 0
+        self._last_sync = 0.0
+        self._last_purge = time.monotonic()
+
+        self.checks = 0
+        self.bloom_hits = 0
+
+    def revoke(self, session_token, expires_at):
+        """Revoke a session token until the time it would have expired
+
+        Args:
+            session_token (str): The raw token to revoke
+            expires_at (float): Unix timestamp after which the entry can be forgotten
+
+        Returns:
+            bool: True if recorded, False otherwise
+        """
+        token_hash = hash_token(session_token)
+        try:
+            with self.pool.connection() as conn:
+                conn.execute('''
+                INSERT INTO revoked_tokens (token_hash, expires_at) VALUES (?, ?)
+                ON CONFLICT(token_hash) DO UPDATE SET expires_at = MAX(expires_at, excluded.expires_at)
+                ''', (token_hash, expires_at))
+                conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error revoking token: {str(e)}")
+            return False
+
+        with self._lock:
+            self._bloom.add(token_hash)
+        return True
+
+    def is_revoked(self, session_token):
+        """Check whether a session token has been revoked
+
+        Returns:
+            bool: True if the token is on the revocation list
+        """
+        self._sync()
+        token_hash = hash_token(session_token)
+        self.checks += 1
+        if token_hash not in self._bloom:
+            return False
+
+        self.bloom_hits += 1
+        try:
+            with self.pool.connection() as conn:
+                row = conn.execute(
+                    "SELECT 1 FROM revoked_tokens WHERE token_hash = ? AND expires_at > ?",
+                    (token_hash, time.time())
+                ).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Error checking revoked token: {str(e)}")
+            # A Bloom hit we cannot confirm is treated as revoked
+            return True
+        return row is not None
+
+    def _sync(self):
+        """Add entries revoked by other processes and purge expired ones"""
+        now = time.monotonic()
+        if now - self._last_sync < self.sync_interval:
+            return
+        with self._lock:
+            if now - self._last_sync < self.sync_interval:
+                return
+            self._last_sync = now
+            try:
+                if now - self._last_purge >= self.purge_interval:
+                    self._last_purge = now
+                    self._purge_and_rebuild()
+                else:
+                    with self.pool.connection() as conn:
+                        rows = conn.execute(
+                            "SELECT id, token_hash FROM revoked_tokens WHERE id > ? ORDER BY id",
+                            (self._last_id,)
+                        ).fetchall()
+                    for row_id, token_hash in rows:
+                        self._bloom.add(token_hash)
+                        self._last_id = row_id
+                    if self._bloom.count > self._bloom.capacity:
+                        self._purge_and_rebuild()
+            except sqlite3.Error as e:
+                logging.error(f"Error syncing revocation list: {str(e)}")
+
+    def _purge_and_rebuild(self, batch_size=500):
+        """Delete expired entries in small batches and rebuild the filter from live ones
+
+        Called with self._lock held.
+        """
+        now = time.time()
+        while True:
+            with self.pool.connection() as conn:
+                deleted = conn.execute('''
+                DELETE FROM revoked_tokens WHERE id IN (
+                    SELECT id FROM revoked_tokens WHERE expires_at <= ? LIMIT ?
+                )
+                ''', (now, batch_size)).rowcount
+                conn.commit()
+            if deleted < batch_size:
+                break
+
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT id, token_hash FROM revoked_tokens ORDER BY id").fetchall()
+
+        # Keep the filter at most half full so the false-positive rate holds
+        capacity = self.capacity
+        while capacity < len(rows) * 2:
+            capacity *= 2
+        bloom = BloomFilter(capacity, self.fp_rate)
+        for row_id, token_hash in rows:
+            bloom.add(token_hash)
+        self._bloom = bloom
+        self._last_id = rows[-1][0] if rows else self._last_id
+
+    def stats(self):
+        """Get filter size and check counters"""
+        with self._lock:
+            return {
+                'bloom_entries': self._bloom.count,
+                'bloom_capacity': self._bloom.capacity,
+                'bloom_bytes': len(self._bloom.bits),
+                'checks': self.checks,
+                'bloom_hits': self.bloom_hits,
+            }
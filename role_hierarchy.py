@@ -0,0 +1,131 @@
+from collections import defaultdict, deque
+
+
+class RoleHierarchyError(ValueError):
+    """Raised when a parent assignment names an unknown role or creates a cycle"""
+
+
+def _load_edges(conn):
+    parents = defaultdict(set)
+    children = defaultdict(set)
+    for role_name, parent_name in conn.execute("SELECT role_name, parent_name FROM role_parents"):
+        parents[role_name].add(parent_name)
+        children[parent_name].add(role_name)
+    return parents, children
+
+
+def _reachable(start, edges):
+    """Breadth-first walk from ``start``; returns {role: shortest distance}, start included"""
+    seen = {start: 0}
+    queue = deque([start])
+    while queue:
+        role_name = queue.popleft()
+        for neighbour in edges.get(role_name, ()):
+            if neighbour not in seen:
+                seen[neighbour] = seen[role_name] + 1
+                queue.append(neighbour)
+    return seen
+
+
+def get_role_parents(conn, role_name):
+    """Get the roles a role directly inherits from
+
+    Returns:
+        list: Sorted parent role names
+    """
+    return [row[0] for row in conn.execute(
+        "SELECT parent_name FROM role_parents WHERE role_name = ? ORDER BY parent_name", (role_name,)
+    )]
+
+
+def get_role_ancestors(conn, role_name):
+    """Get every role a role inherits from, directly or transitively
+
+    Returns:
+        dict: Ancestor role name -> distance in inheritance steps, excluding the role itself
+    """
+    return dict(conn.execute(
+        "SELECT ancestor, depth FROM role_closure WHERE descendant = ? AND depth > 0", (role_name,)
+    ).fetchall())
+
+
+def set_role_parents(conn, role_name, parent_names):
+    """Replace a role's direct parents and update the closure, inside the caller's transaction
+
+    Args:
+        conn (sqlite3.Connection): Connection holding the write transaction
+        role_name (str): The role whose parents change
+        parent_names (list): Names of the roles it should inherit from
+
+    Raises:
+        RoleHierarchyError: If a parent does not exist or the change would create a cycle
+    """
+    parent_names = set(parent_names or ())
+    if parent_names:
+        placeholders = ', '.join('?' * len(parent_names))
+        known = {row[0] for row in conn.execute(
+            f"SELECT role_name FROM roles WHERE role_name IN ({placeholders})", tuple(parent_names)
+        )}
+        missing = parent_names - known
+        if missing:
+            raise RoleHierarchyError(f"Unknown parent role(s): {', '.join(sorted(missing))}")
+
+        # A cycle exists if any new parent already descends from this role
+        descendants = {row[0] for row in conn.execute(
+            "SELECT descendant FROM role_closure WHERE ancestor = ?", (role_name,)
+        )}
+        descendants.add(role_name)
+        cyclic = parent_names & descendants
+        if cyclic:
+            raise RoleHierarchyError(f"Inheriting from {', '.join(sorted(cyclic))} would create a cycle")
+
+    conn.execute("DELETE FROM role_parents WHERE role_name = ?", (role_name,))
+    conn.executemany(
+        "INSERT INTO role_parents (role_name, parent_name) VALUES (?, ?)",
+        [(role_name, parent_name) for parent_name in sorted(parent_names)]
+    )
+    refresh_role_closure(conn, [role_name])
+
+
+def refresh_role_closure(conn, role_names):
+    """Recompute the closure rows of some roles and everything that inherits from them
+
+    Only the affected subtree is rewritten; closure rows of unrelated roles
+    are left alone. Users holding an affected role have their effective
+    permissions recomputed by the roles triggers.
+
+    Args:
+        conn (sqlite3.Connection): Connection holding the write transaction
+        role_names (list): Roles whose parent edges changed
+
+    Returns:
+        int: Number of roles whose closure was rewritten
+    """
+    parents, children = _load_edges(conn)
+    existing = {row[0] for row in conn.execute("SELECT role_name FROM roles")}
+
+    affected = set()
+    for role_name in role_names:
+        if role_name in existing:
+            affected.update(_reachable(role_name, children))
+    affected &= existing
+    if not affected:
+        return 0
+
+    rows = []
+    for role_name in affected:
+        for ancestor, depth in _reachable(role_name, parents).items():
+            if ancestor in existing:
+                rows.append((ancestor, role_name, depth))
+
+    affected = sorted(affected)
+    conn.executemany("DELETE FROM role_closure WHERE descendant = ?", [(role_name,) for role_name in affected])
+    conn.executemany("INSERT INTO role_closure (ancestor, descendant, depth) VALUES (?, ?, ?)", rows)
+
+    # A no-op write fires the roles update trigger, which recomputes the
+    # effective permissions of every user holding the role or a descendant
+    conn.executemany(
+        "UPDATE roles SET permissions = permissions WHERE role_name = ?",
+        [(role_name,) for role_name in role_names if role_name in existing]
+    )
+    return len(affected)
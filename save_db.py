@@ -0,0 +1,470 @@
+"""
+Online SQLite backups through the backup API.
+
+    python save_db.py [database.db] [--dir backups] [--pages 256] [--list] [--verify FILE] [--restore FILE TARGET]
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; gzip is always available
+    zstandard = None
+
+CODECS = ('none', 'gzip', 'zstd')
+_EXTENSIONS = {'none': '.db', 'gzip': '.db.gz', 'zstd': '.db.zst'}
+_MANIFEST_SUFFIX = '.manifest.json'
+_CHUNK = 1024 * 1024
+
+
+class BackupError(Exception):
+    """Raised when a backup cannot be taken, verified or restored"""
+
+
+class _TooManyRestarts(Exception):
+    """Raised from the progress callback to abandon a stepped copy"""
+
+
+class BackupEngine:
+    """Consistent online backups of a SQLite database
+
+    The database is copied with ``sqlite3.Connection.backup`` ``pages_per_step``
+    pages at a time, sleeping ``step_sleep`` seconds between steps so request
+    threads get the disk and the GIL back. No lock is held between steps. If
+    another connection writes to the database during the copy, SQLite
+    restarts it from the first page. After ``max_restarts`` restarts the copy
+    is done in a single step instead. In WAL mode that step only holds a
+    read snapshot, so writers carry on while it runs.
+
+    A passive WAL checkpoint runs before the copy so less of the database
+    has to be read out of the WAL. The copy is switched out of WAL mode,
+    checked with PRAGMA quick_check, compressed, and written under a
+    temporary name that is renamed when complete. A JSON manifest next to it
+    records the SHA-256 of the file, its sizes, the duration and the
+    throughput. Old backups are then pruned by the retention policy: the
+    newest ``keep_last``, plus the newest of each of the last ``keep_daily``
+    days and ``keep_weekly`` ISO weeks.
+    """
+
+    def __init__(self, db_path="database.db", backup_dir="backups", pages_per_step=256, step_sleep=0.005,
+                 max_restarts=3, codec=None, level=None, keep_last=24, keep_daily=7, keep_weekly=4, verify=True):
+        """Initialize the engine
+
+        Args:
+            db_path (str, optional): Database to back up. Defaults to "database.db".
+            backup_dir (str, optional): Where backups and manifests are written. Defaults to "backups".
+            pages_per_step (int, optional): Pages copied per backup step. Defaults to 256.
+            step_sleep (float, optional): Seconds to yield between steps. Defaults to 0.005.
+            max_restarts (int, optional): Restarts caused by writers before copying in one step. Defaults to 3.
+            codec (str, optional): One of CODECS. Defaults to zstd if installed, otherwise gzip.
+            level (int, optional): Compression level. Defaults to the codec's default.
+            keep_last (int, optional): Most recent backups always kept. Defaults to 24.
+            keep_daily (int, optional): Days for which the newest backup is kept. Defaults to 7.
+            keep_weekly (int, optional): ISO weeks for which the newest backup is kept. Defaults to 4.
+            verify (bool, optional): Run PRAGMA quick_check on each copy. Defaults to True.
+        """
+        if codec is None:
+            codec = 'zstd' if zstandard is not None else 'gzip'
+        if codec not in CODECS:
+            raise ValueError(f"Unknown backup codec: {codec}")
+        if codec == 'zstd' and zstandard is None:
+            raise ValueError("The zstd codec needs the zstandard package")
+
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self.max_restarts = max_restarts
+        self.codec = codec
+        self.level = level
+        self.keep_last = keep_last
+        self.keep_daily = keep_daily
+        self.keep_weekly = keep_weekly
+        self.verify = verify
+
+        # One backup at a time
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+        # Metrics
+        self.backups = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+        self.total_bytes = 0
+        self.last = None
+        self.last_error = None
+
+    # Taking backups
+
+    def backup(self):
+        """Take one backup and apply the retention policy
+
+        Returns:
+            dict: The manifest of the new backup
+
+        Raises:
+            BackupError: If the copy fails its check or cannot be written
+        """
+        with self._lock:
+            try:
+                manifest = self._backup()
+            except (sqlite3.Error, OSError, BackupError) as e:
+                with self._stats_lock:
+                    self.failures += 1
+                    self.last_error = str(e)
+                if isinstance(e, BackupError):
+                    raise
+                raise BackupError(f"Backup of {self.db_path} failed: {str(e)}") from e
+            with self._stats_lock:
+                self.backups += 1
+                self.total_seconds += manifest['duration_seconds']
+                self.total_bytes += manifest['database_bytes']
+                self.last = manifest
+                self.last_error = None
+            manifest['pruned'] = self.prune()
+            return manifest
+
+    def _backup(self):
+        os.makedirs(self.backup_dir, exist_ok=True)
+        started = datetime.now()
+        name = f"{os.path.splitext(os.path.basename(self.db_path))[0]}_{started.strftime('%Y%m%d_%H%M%S_%f')}"
+        copy_path = os.path.join(self.backup_dir, f".{name}.copy")
+        final_path = os.path.join(self.backup_dir, name + _EXTENSIONS[self.codec])
+        start = time.perf_counter()
+
+        try:
+            source = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                checkpoint = self._checkpoint(source)
+                copy_start = time.perf_counter()
+                pages, restarts, stepped = self._copy(source, copy_path)
+                copy_seconds = time.perf_counter() - copy_start
+            finally:
+                source.close()
+
+            database_bytes = os.path.getsize(copy_path)
+            compress_start = time.perf_counter()
+            stored_bytes, sha256 = self._compress(copy_path, final_path)
+            compress_seconds = time.perf_counter() - compress_start
+        finally:
+            if os.path.exists(copy_path):
+                os.remove(copy_path)
+
+        duration = time.perf_counter() - start
+        manifest = {
+            'file': os.path.basename(final_path),
+            'source': os.path.abspath(self.db_path),
+            'created_at': started.isoformat(),
+            'codec': self.codec,
+            'sha256': sha256,
+            'pages': pages,
+            'database_bytes': database_bytes,
+            'stored_bytes': stored_bytes,
+            'compression_ratio': database_bytes / stored_bytes if stored_bytes else 0.0,
+            'pages_per_step': self.pages_per_step if stepped else -1,
+            'restarts': restarts,
+            'wal_checkpoint': checkpoint,
+            'copy_seconds': round(copy_seconds, 4),
+            'compress_seconds': round(compress_seconds, 4),
+            'duration_seconds': round(duration, 4),
+            'throughput_mib_s': round(database_bytes / 2**20 / duration, 2) if duration else 0.0,
+        }
+        self._write_manifest(final_path, manifest)
+        logging.info(f"Backed up {self.db_path} to {final_path}: {database_bytes / 2**20:.1f} MiB in {duration:.2f}s "
+                     f"({manifest['throughput_mib_s']} MiB/s, {restarts} restarts)")
+        return manifest
+
+    def _checkpoint(self, source):
+        """Passive WAL checkpoint; never waits for readers or writers"""
+        mode = source.execute("PRAGMA journal_mode").fetchone()[0]
+        if mode.lower() != 'wal':
+            return None
+        busy, wal_pages, checkpointed = source.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        return {'wal_pages': wal_pages, 'checkpointed': checkpointed}
+
+    def _copy(self, source, copy_path):
+        """Copy the database, stepped if writers allow it
+
+        Returns:
+            tuple: (pages, restarts, stepped)
+        """
+        state = {'remaining': None, 'restarts': 0, 'total': 0}
+
+        def progress(status, remaining, total):
+            if state['remaining'] is not None and remaining > state['remaining']:
+                state['restarts'] += 1
+                if state['restarts'] > self.max_restarts:
+                    raise _TooManyRestarts()
+            state['remaining'] = remaining
+            state['total'] = total
+            if remaining and self.step_sleep:
+                time.sleep(self.step_sleep)
+
+        stepped = True
+        target = sqlite3.connect(copy_path)
+        try:
+            try:
+                source.backup(target, pages=self.pages_per_step, progress=progress)
+            except (_TooManyRestarts, sqlite3.Error) as e:
+                if not isinstance(e, _TooManyRestarts) and not isinstance(e.__context__, _TooManyRestarts):
+                    raise
+                logging.warning(f"Backup of {self.db_path} restarted {state['restarts']} times by writers; "
+                                f"copying in one step")
+                stepped = False
+                source.backup(target, pages=-1)
+                state['total'] = target.execute("PRAGMA page_count").fetchone()[0]
+
+            # The copy is a standalone file; take it out of WAL mode
+            target.execute("PRAGMA journal_mode = DELETE")
+            if self.verify:
+                result = target.execute("PRAGMA quick_check").fetchone()[0]
+                if result != 'ok':
+                    raise BackupError(f"Backup copy of {self.db_path} failed quick_check: {result}")
+        finally:
+            target.close()
+        return state['total'], state['restarts'], stepped
+
+    def _open_writer(self, path):
+        if self.codec == 'gzip':
+            return gzip.open(path, 'wb', compresslevel=self.level if self.level is not None else 6)
+        if self.codec == 'zstd':
+            compressor = zstandard.ZstdCompressor(level=self.level if self.level is not None else 3)
+            return compressor.stream_writer(open(path, 'wb'), closefd=True)
+        return open(path, 'wb')
+
+    def _compress(self, copy_path, final_path):
+        """Compress the copy to ``final_path`` atomically
+
+        Returns:
+            tuple: (stored bytes, hex SHA-256 of the stored file)
+        """
+        tmp_path = final_path + ".tmp"
+        try:
+            with open(copy_path, 'rb') as src, self._open_writer(tmp_path) as dst:
+                shutil.copyfileobj(src, dst, _CHUNK)
+            sha256 = _file_sha256(tmp_path)
+            with open(tmp_path, 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, final_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return os.path.getsize(final_path), sha256
+
+    def _write_manifest(self, backup_path, manifest):
+        tmp_path = _manifest_path(backup_path) + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, _manifest_path(backup_path))
+
+    # Inspecting and restoring
+
+    def list_backups(self):
+        """List the manifests of the backups in backup_dir
+
+        Returns:
+            list: Manifest dicts, newest first, each with 'path' added
+        """
+        if not os.path.isdir(self.backup_dir):
+            return []
+        manifests = []
+        for name in os.listdir(self.backup_dir):
+            if not name.endswith(_MANIFEST_SUFFIX):
+                continue
+            try:
+                with open(os.path.join(self.backup_dir, name), 'r') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.error(f"Error reading backup manifest {name}: {str(e)}")
+                continue
+            if not isinstance(manifest, dict) or 'file' not in manifest or 'created_at' not in manifest:
+                logging.warning(f"Ignoring {name} in {self.backup_dir}: not a backup manifest")
+                continue
+            manifest['path'] = os.path.join(self.backup_dir, manifest['file'])
+            manifests.append(manifest)
+        return sorted(manifests, key=lambda manifest: manifest['created_at'], reverse=True)
+
+    def verify_backup(self, backup_path):
+        """Check a backup file against the checksum in its manifest
+
+        Returns:
+            bool: True if the file exists and its SHA-256 matches
+        """
+        try:
+            with open(_manifest_path(backup_path), 'r') as f:
+                manifest = json.load(f)
+            return _file_sha256(backup_path) == manifest['sha256']
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"Error verifying backup {backup_path}: {str(e)}")
+            return False
+
+    def restore(self, backup_path, target_path):
+        """Decompress a verified backup to ``target_path``
+
+        The target must not be open; it is replaced atomically.
+
+        Raises:
+            BackupError: If the checksum does not match or the result fails quick_check
+        """
+        if not self.verify_backup(backup_path):
+            raise BackupError(f"Backup {backup_path} does not match its checksum")
+        with open(_manifest_path(backup_path), 'r') as f:
+            codec = json.load(f)['codec']
+
+        tmp_path = target_path + ".restore"
+        if codec == 'gzip':
+            reader = gzip.open(backup_path, 'rb')
+        elif codec == 'zstd':
+            if zstandard is None:
+                raise BackupError("Restoring a zstd backup needs the zstandard package")
+            reader = zstandard.ZstdDecompressor().stream_reader(open(backup_path, 'rb'), closefd=True)
+        else:
+            reader = open(backup_path, 'rb')
+        try:
+            with reader, open(tmp_path, 'wb') as dst:
+                shutil.copyfileobj(reader, dst, _CHUNK)
+            check = sqlite3.connect(tmp_path)
+            try:
+                result = check.execute("PRAGMA quick_check").fetchone()[0]
+            finally:
+                check.close()
+            if result != 'ok':
+                raise BackupError(f"Restored database failed quick_check: {result}")
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(target_path + suffix):
+                    os.remove(target_path + suffix)
+            os.replace(tmp_path, target_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    # Retention
+
+    def prune(self):
+        """Delete backups the retention policy no longer keeps
+
+        Returns:
+            list: File names of the deleted backups
+        """
+        backups = self.list_backups()
+        keep = {manifest['file'] for manifest in backups[:self.keep_last]}
+        days, weeks = set(), set()
+        for manifest in backups:
+            created = datetime.fromisoformat(manifest['created_at'])
+            day = created.date()
+            week = created.isocalendar()[:2]
+            if day not in days and len(days) < self.keep_daily:
+                days.add(day)
+                keep.add(manifest['file'])
+            if week not in weeks and len(weeks) < self.keep_weekly:
+                weeks.add(week)
+                keep.add(manifest['file'])
+
+        deleted = []
+        for manifest in backups:
+            if manifest['file'] in keep:
+                continue
+            try:
+                if os.path.exists(manifest['path']):
+                    os.remove(manifest['path'])
+                os.remove(_manifest_path(manifest['path']))
+                deleted.append(manifest['file'])
+            except OSError as e:
+                logging.error(f"Error deleting backup {manifest['file']}: {str(e)}")
+        return deleted
+
+    def stats(self):
+        """Get backup counts, throughput and the last result"""
+        with self._stats_lock:
+            return {
+                'backups': self.backups,
+                'failures': self.failures,
+                'avg_duration_seconds': self.total_seconds / self.backups if self.backups else 0.0,
+                'avg_throughput_mib_s': self.total_bytes / 2**20 / self.total_seconds if self.total_seconds else 0.0,
+                'last': self.last,
+                'last_error': self.last_error,
+            }
+
+
+def _manifest_path(backup_path):
+    for extension in _EXTENSIONS.values():
+        if backup_path.endswith(extension):
+            return backup_path[:-len(extension)] + _MANIFEST_SUFFIX
+    return backup_path + _MANIFEST_SUFFIX
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def backup_database(db_path="database.db", backup_dir="backups"):
+    """Back up a database with a shared engine per (db_path, backup_dir)
+
+    Returns:
+        dict: The manifest of the new backup
+    """
+    with _engines_lock:
+        key = (os.path.abspath(db_path), os.path.abspath(backup_dir))
+        if key not in _engines:
+            _engines[key] = BackupEngine(db_path, backup_dir)
+        engine = _engines[key]
+    return engine.backup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('db_path', nargs='?', default='database.db')
+    parser.add_argument('--dir', default='backups')
+    parser.add_argument('--pages', type=int, default=256, help="Pages copied per step")
+    parser.add_argument('--codec', choices=CODECS, default=None, help="Defaults to zstd if installed, otherwise gzip")
+    parser.add_argument('--list', action='store_true', help="List backups instead of taking one")
+    parser.add_argument('--verify', metavar='FILE', help="Check a backup against its checksum")
+    parser.add_argument('--restore', nargs=2, metavar=('FILE', 'TARGET'), help="Restore a backup to TARGET")
+    args = parser.parse_args()
+
+    engine = BackupEngine(args.db_path, args.dir, pages_per_step=args.pages, codec=args.codec)
+    try:
+        if args.list:
+            for manifest in engine.list_backups():
+                print(f"{manifest['created_at']}  {manifest['file']:<48} {manifest['stored_bytes'] / 2**20:>9.1f} MiB  "
+                      f"{manifest['duration_seconds']:>7.2f}s  {manifest['throughput_mib_s']:>8.1f} MiB/s")
+        elif args.verify:
+            ok = engine.verify_backup(args.verify)
+            print(f"{args.verify}: {'ok' if ok else 'checksum mismatch'}")
+            return 0 if ok else 1
+        elif args.restore:
+            engine.restore(*args.restore)
+            print(f"Restored {args.restore[0]} to {args.restore[1]}")
+        else:
+            manifest = engine.backup()
+            print(f"{manifest['file']}: {manifest['database_bytes'] / 2**20:.1f} MiB -> "
+                  f"{manifest['stored_bytes'] / 2**20:.1f} MiB in {manifest['duration_seconds']:.2f}s "
+                  f"({manifest['throughput_mib_s']} MiB/s, {manifest['restarts']} restarts, "
+                  f"{len(manifest['pruned'])} old backups pruned)")
+    except BackupError as e:
+        logging.error(f"Error backing up database: {str(e)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
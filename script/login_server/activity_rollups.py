@@ -0,0 +1,344 @@
+"""
+Per-user activity rollups for the login server.
+
+user_activity_daily holds one counter per (username, day, activity_type) and
+user_activity_totals one per (username, activity_type). Triggers on
+user_activity keep both in step with every insert, delete and update, so
+/api/stats reads a handful of primary-key rows instead of counting a user's
+whole history. The first install() fills them from the existing rows.
+
+    python activity_rollups.py [users.db] [--rebuild] [--user USERNAME] [--days 30]
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import logging
+import argparse
+import datetime
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Days are the date part of created_at, which SQLite's CURRENT_TIMESTAMP writes in UTC
+_DAY = "COALESCE(substr({row}.created_at, 1, 10), date('now'))"
+
+
+def _count_sql(row, delta):
+    """Statements adding ``delta`` to the counters of one user_activity row"""
+    day = _DAY.format(row=row)
+    return f'''
+        INSERT INTO user_activity_daily (username, day, activity_type, count)
+        VALUES ({row}.username, {day}, {row}.activity_type, {delta})
+        ON CONFLICT(username, day, activity_type) DO UPDATE SET count = count + ({delta});
+        INSERT INTO user_activity_totals (username, activity_type, count)
+        VALUES ({row}.username, {row}.activity_type, {delta})
+        ON CONFLICT(username, activity_type) DO UPDATE SET count = count + ({delta});
+    '''
+
+
+_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS user_activity_daily (
+    username TEXT NOT NULL,
+    day TEXT NOT NULL,
+    activity_type TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (username, day, activity_type)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS user_activity_totals (
+    username TEXT NOT NULL,
+    activity_type TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (username, activity_type)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_activity_rollup_insert AFTER INSERT ON user_activity
+BEGIN
+    {_count_sql('NEW', 1)}
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_activity_rollup_delete AFTER DELETE ON user_activity
+BEGIN
+    {_count_sql('OLD', -1)}
+    DELETE FROM user_activity_daily
+    WHERE username = OLD.username AND day = {_DAY.format(row='OLD')} AND activity_type = OLD.activity_type AND count <= 0;
+    DELETE FROM user_activity_totals
+    WHERE username = OLD.username AND activity_type = OLD.activity_type AND count <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_activity_rollup_update AFTER UPDATE OF username, activity_type, created_at ON user_activity
+BEGIN
+    {_count_sql('OLD', -1)}
+    {_count_sql('NEW', 1)}
+    DELETE FROM user_activity_daily
+    WHERE username = OLD.username AND day = {_DAY.format(row='OLD')} AND activity_type = OLD.activity_type AND count <= 0;
+    DELETE FROM user_activity_totals
+    WHERE username = OLD.username AND activity_type = OLD.activity_type AND count <= 0;
+END;
+'''
+
+
+def install(db):
+    """Create the rollup tables and triggers, backfilling them the first time
+
+    Args:
+        db (sqlite3.Connection): Connection to the login server database
+
+    Returns:
+        bool: True if the rollups were created and backfilled by this call
+    """
+    exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_activity_totals'"
+    ).fetchone()
+    if exists:
+        # Triggers are recreated in case they were dropped
+        db.executescript(_SCHEMA)
+        return False
+    rebuild(db)
+    return True
+
+
+def rebuild(db):
+    """Recompute every counter from user_activity
+
+    Tables, triggers and counters are written in one transaction, so no
+    activity is counted twice or missed while it runs.
+
+    Args:
+        db (sqlite3.Connection): Connection to the login server database
+
+    Returns:
+        int: Number of activity rows counted
+    """
+    day = _DAY.format(row='user_activity')
+    db.commit()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        for statement in _split(_SCHEMA):
+            db.execute(statement)
+        db.execute("DELETE FROM user_activity_daily")
+        db.execute("DELETE FROM user_activity_totals")
+        db.execute(f'''
+            INSERT INTO user_activity_daily (username, day, activity_type, count)
+            SELECT username, {day}, activity_type, COUNT(*) FROM user_activity
+            GROUP BY username, {day}, activity_type
+        ''')
+        db.execute('''
+            INSERT INTO user_activity_totals (username, activity_type, count)
+            SELECT username, activity_type, SUM(count) FROM user_activity_daily
+            GROUP BY username, activity_type
+        ''')
+        counted = db.execute("SELECT COALESCE(SUM(count), 0) FROM user_activity_totals").fetchone()[0]
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return counted
+
+
+def _split(script):
+    """Split a script into statements, keeping trigger bodies whole"""
+    statements, current = [], ''
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            if current.strip():
+                statements.append(current.strip())
+            current = ''
+    return statements
+
+
+def get_stats(db, username, days=30, today=None):
+    """Totals by type and a daily series for one user, in one indexed read
+
+    Args:
+        db (sqlite3.Connection): Connection to the login server database
+        username (str): The user
+        days (int, optional): Length of the daily series, ending today. Defaults to 30.
+        today (datetime.date, optional): Last day of the series. Defaults to the current UTC date.
+
+    Returns:
+        dict: login_count, total_actions, activity_by_type (list of type/count)
+        and daily (one entry per day, oldest first, with date, total and by_type)
+    """
+    if today is None:
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+    first_day = today - datetime.timedelta(days=days - 1)
+
+    rows = db.execute('''
+        SELECT NULL, activity_type, count FROM user_activity_totals WHERE username = ?
+        UNION ALL
+        SELECT day, activity_type, count FROM user_activity_daily WHERE username = ? AND day >= ? AND day <= ?
+    ''', (username, username, first_day.isoformat(), today.isoformat())).fetchall()
+
+    by_type = {}
+    daily = {(first_day + datetime.timedelta(days=i)).isoformat(): {} for i in range(days)}
+    for day, activity_type, count in rows:
+        if day is None:
+            by_type[activity_type] = count
+        elif day in daily:
+            daily[day][activity_type] = count
+
+    return {
+        'login_count': by_type.get('login', 0),
+        'total_actions': sum(by_type.values()),
+        'activity_by_type': [{'type': activity_type, 'count': count}
+                             for activity_type, count in sorted(by_type.items(), key=lambda item: -item[1])],
+        'daily': [{'date': day, 'total': sum(counts.values()), 'by_type': counts}
+                  for day, counts in daily.items()],
+    }
+
+
+class ActivityRecorder:
+    """Batched writer for user_activity
+
+    track_user_activity() only queues the event; a background thread
+    inserts whatever has queued up in one transaction every
+    ``flush_interval`` seconds, or sooner once ``batch_size`` events are
+    waiting. The rollup triggers run inside that same transaction.
+    Events still queued are written on interpreter exit; a full queue drops
+    new events rather than blocking requests.
+    """
+
+    def __init__(self, connect, batch_size=200, flush_interval=0.5, max_queue=10000):
+        """Initialize the recorder; the thread starts with the first event
+
+        Args:
+            connect (callable): Returns a new sqlite3 connection to the login server database
+            batch_size (int, optional): Events per transaction. Defaults to 200.
+            flush_interval (float, optional): Maximum seconds an event waits. Defaults to 0.5.
+            max_queue (int, optional): Maximum queued events. Defaults to 10000.
+        """
+        self.connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def record(self, username, activity_type, payload=None):
+        """Queue one activity
+
+        Returns:
+            bool: False if the queue was full and the event was dropped
+        """
+        created_at = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='activity-recorder', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+        try:
+            self._queue.put_nowait((username, activity_type, payload, created_at))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logger.warning(f'Activity queue full, dropped {activity_type} for {username}')
+            return False
+
+    def _run(self):
+        db = self.connect()
+        try:
+            while True:
+                batch = [self._queue.get()]
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+                self._write(db, batch)
+        finally:
+            db.close()
+
+    def _write(self, db, batch):
+        events = [event for event in batch if event is not None]
+        if events:
+            try:
+                db.executemany('''
+                    INSERT INTO user_activity (username, activity_type, payload, created_at)
+                    VALUES (?, ?, ?, ?)
+                ''', events)
+                db.commit()
+                with self._lock:
+                    self.written += len(events)
+            except Exception as e:
+                db.rollback()
+                with self._lock:
+                    self.failed += len(events)
+                logger.error(f'Failed to write {len(events)} activities: {str(e)}')
+        for _ in batch:
+            self._queue.task_done()
+
+    def flush(self, timeout=10.0):
+        """Wait until every queued event has been written
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to 10.0.
+
+        Returns:
+            bool: True if flushed, False on timeout or if the writer thread is not running
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return self._queue.empty()
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stats(self):
+        """Queue depth and write counters"""
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('db_path', nargs='?', default=os.path.join(os.path.dirname(__file__), 'users.db'))
+    parser.add_argument('--rebuild', action='store_true', help="Recompute every counter from user_activity")
+    parser.add_argument('--user', help="Print one user's stats")
+    parser.add_argument('--days', type=int, default=30)
+    args = parser.parse_args()
+
+    db = sqlite3.connect(args.db_path)
+    try:
+        if args.rebuild:
+            start = time.perf_counter()
+            counted = rebuild(db)
+            print(f"Rebuilt rollups from {counted:,} activities in {time.perf_counter() - start:.1f}s")
+        elif install(db):
+            print("Created and backfilled the rollup tables")
+        if args.user:
+            print(json.dumps(get_stats(db, args.user, args.days), indent=2))
+    except sqlite3.Error as e:
+        logger.error(f'Failed to maintain activity rollups: {str(e)}')
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,18 +1,19 @@
 import threading
-import time
 import os
 import sys
 import logging
 
 # Add the project root to Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
-from save_db import backup_database
+from save_db import BackupEngine, BackupError
 
 class DbBackupService:
-    def __init__(self, backup_interval=3600):  # Default backup every hour
+    def __init__(self, backup_interval=3600, engine=None):  # Default backup every hour
         self.backup_interval = backup_interval
+        self.engine = engine or BackupEngine()
         self.running = False
         self.thread = None
+        self._stop = threading.Event()
         self.logger = self._setup_logger()
 
     def _setup_logger(self):
@@ -30,27 +31,49 @@ class DbBackupService:
             return
 
         self.running = True
+        self._stop.clear()
         self.thread = threading.Thread(target=self._backup_loop, daemon=True)
         self.thread.start()
         self.logger.info("Database backup service started")
 
-    def stop(self):
+    def stop(self, timeout=60):
+        """Stop the loop, waiting up to ``timeout`` seconds for a backup in progress"""
         self.running = False
+        self._stop.set()
         if self.thread:
-            self.thread.join(timeout=1)
+            self.thread.join(timeout=timeout)
         self.logger.info("Database backup service stopped")
 
+    def backup_now(self):
+        """Take a backup immediately; returns its manifest, or None if it failed"""
+        try:
+            manifest = self.engine.backup()
+        except BackupError as e:
+            self.logger.error(f"Error during database backup: {e}")
+            return None
+        except Exception as e:
+            # Never let an unexpected error end the scheduled loop
+            self.logger.exception(f"Unexpected error during database backup: {e}")
+            return None
+        self.logger.info(
+            f"Backup {manifest['file']} completed: {manifest['database_bytes'] / 2**20:.1f} MiB in "
+            f"{manifest['duration_seconds']:.2f}s ({manifest['throughput_mib_s']} MiB/s), "
+            f"{len(manifest['pruned'])} old backups pruned"
+        )
+        return manifest
+
+    def stats(self):
+        """Backup counts, throughput and the last result"""
+        return dict(self.engine.stats(), running=self.running, interval=self.backup_interval)
+
     def _backup_loop(self):
         while self.running:
+            self.logger.info("Performing scheduled database backup")
             try:
-                self.logger.info("Performing scheduled database backup")
-                backup_database()
-                self.logger.info("Backup completed successfully")
+                self.backup_now()
             except Exception as e:
-                self.logger.error(f"Error during scheduled backup: {e}")
+                self.logger.exception(f"Error during scheduled backup: {e}")
 
-            # Sleep for the interval, but check periodically if we should stop
-            for _ in range(self.backup_interval // 10):
-                if not self.running:
-                    break
-                time.sleep(10)  # Check every 10 seconds if we should stop
\ No newline at end of file
+            # Returns as soon as stop() is called
+            if self._stop.wait(self.backup_interval):
+                break
@@ -141,6 +141,10 @@ def init_db():
                 (4, 'basic_user', '{"prompting": true}')
         ''')
         db.commit()
+
+        # Per-user activity counters, backfilled from history on first start
+        if activity_rollups.install(db):
+            logger.info('Activity rollups created from existing activity')
         logger.info('Database initialized successfully')
         cursor.close()
         db.close()
@@ -167,7 +171,13 @@ def get_db():
     return db
 
 
+try:
+    import activity_rollups
+except ImportError:
+    from script.login_server import activity_rollups
+
 init_db()
+activity_recorder = activity_rollups.ActivityRecorder(get_db)
 
 
 def validate_password(password: str) -> Tuple[bool, str]:
@@ -374,6 +384,7 @@ def login():
                     'UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE username = ?',
                     (data['username'], ))
                 db.commit()
+                track_user_activity(user['username'], 'login', 'Logged in')
 
                 # Generate token with role information
                 token = jwt.encode(
@@ -451,7 +462,7 @@ def get_user_activity(user):
             # Get last 10 activities for the user
             activities = db.execute(
                 '''
-                SELECT type, description, created_at 
+                SELECT activity_type, payload, created_at 
                 FROM user_activity 
                 WHERE username = ? 
                 ORDER BY created_at DESC 
@@ -459,8 +470,8 @@ def get_user_activity(user):
             ''', (user['username'], )).fetchall()
 
             return jsonify([{
-                'type': activity['type'],
-                'description': activity['description'],
+                'type': activity['activity_type'],
+                'description': activity['payload'],
                 'timestamp': activity['created_at']
             } for activity in activities]), 200
 
@@ -472,43 +483,15 @@ def get_user_activity(user):
 @app.route('/api/stats', methods=['GET'])
 @token_required
 def get_user_stats(user):
+    """Activity totals by type and a daily series for the last ?days= days (default 30)"""
     try:
-        with get_db() as db:
-            # Get login count
-            login_count = db.execute(
-                '''
-                SELECT COUNT(*) as count 
-                FROM user_activity 
-                WHERE username = ? AND type = 'login'
-            ''', (user['username'], )).fetchone()['count']
+        days = min(max(int(request.args.get('days', 30)), 1), 366)
+    except ValueError:
+        return jsonify({'error': 'days must be a number'}), 400
 
-            # Get total actions count
-            total_actions = db.execute(
-                '''
-                SELECT COUNT(*) as count 
-                FROM user_activity 
-                WHERE username = ?
-            ''', (user['username'], )).fetchone()['count']
-
-            # Get activity by type
-            activity_by_type = db.execute(
-                '''
-                SELECT type, COUNT(*) as count 
-                FROM user_activity 
-                WHERE username = ? 
-                GROUP BY type
-            ''', (user['username'], )).fetchall()
-
-            return jsonify({
-                'login_count':
-                login_count,
-                'total_actions':
-                total_actions,
-                'activity_by_type': [{
-                    'type': act['type'],
-                    'count': act['count']
-                } for act in activity_by_type]
-            }), 200
+    try:
+        with get_db() as db:
+            return jsonify(activity_rollups.get_stats(db, user['username'], days)), 200
 
     except Exception as e:
         logger.error(f'Failed to get user stats: {str(e)}')
@@ -906,15 +889,9 @@ def logout(user):
 
 
 def track_user_activity(username: str, activity_type: str, description: str):
-    """Track user activity in the database"""
+    """Queue a user activity; it is written with the next batch"""
     try:
-        with get_db() as db:
-            db.execute(
-                '''
-                INSERT INTO user_activity (username, type, description, created_at)
-                VALUES (?, ?, ?, datetime('now'))
-            ''', (username, activity_type, description))
-            db.commit()
+        activity_recorder.record(username, activity_type, description)
     except Exception as e:
         logger.error(f'Failed to track user activity: {str(e)}')
 
@@ -1,21 +1,29 @@
-from flask import Flask, render_template, send_from_directory, request, jsonify, session, redirect, url_for, flash
+from flask import Flask, render_template, send_from_directory, request, jsonify, session, redirect, url_for, flash, g
 import os
 import base64
 import string
 import random
 import sys
-from database_handler import auth_handler, login_required
+import threading
+from database import get_db
+from database_handler import auth_handler, login_required, permission_required, load_current_user
 from werkzeug.utils import secure_filename
 # Import the EmailHandler for password recovery
 sys.path.append(os.path.join(os.path.dirname(__file__), 'ai-agency-server', 'script'))
 from email_handler.email_handler import EmailHandler
 # Import the API key generation module
 from api_key_generation import get_user_api_keys, delete_api_key, get_api_secret
-import bcrypt
-import sqlite3
+from migrations import apply_migrations
+from api_key_auth import api_key_required
+from rate_limit import GCRALimiter, rate_limited, client_ip, form_field, api_key
+from password_service import PasswordServiceBusy
+import password_policy
+from server_session import ServerSessionInterface
 
 app = Flask(__name__, template_folder='templates')
 app.secret_key = os.urandom(24)  # For secure session management
+# Session state lives in SQLite; the cookie only carries a random session id
+app.session_interface = ServerSessionInterface(lambda: auth_handler.db)
 
 # Configure allowed file extensions for profile pictures
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
@@ -26,6 +34,68 @@ def allowed_file(filename):
 # Initialize the EmailHandler
 email_handler = EmailHandler()
 
+_init_lock = threading.Lock()
+
+
+def create_app(db_path="database.db"):
+    """Open the database and start background services, then return the app
+
+    Nothing touches the database at import time; this runs once, either when
+    a WSGI server calls it as the app factory or on the first request.
+
+    Args:
+        db_path (str, optional): Path to the SQLite database. Defaults to "database.db".
+
+    Returns:
+        Flask: The configured application
+    """
+    if 'rate_limiters' in app.extensions:
+        return app
+    with _init_lock:
+        if 'rate_limiters' in app.extensions:
+            return app
+        db = get_db(db_path)
+
+        # Periodically delete expired sessions in the background
+        db.sessions.start_sweeper()
+
+        # Request rate limits shared by all worker processes. Failed logins
+        # per username are limited separately inside AuthHandler.
+        app.extensions['rate_limiters'] = {
+            'ip': GCRALimiter(db.pool, 'ip', limit=30, period=60),
+            'recovery': GCRALimiter(db.pool, 'recovery', limit=3, period=15 * 60),
+            'verify_password': GCRALimiter(db.pool, 'verify_password', limit=5, period=5 * 60),
+        }
+    return app
+
+
+@app.before_request
+def _ensure_initialized():
+    create_app()
+
+
+# Static files skip the lookup; every other request resolves g.user once
+_STATIC_ENDPOINTS = {'static', 'serve_static', 'serve_static_files'}
+
+
+@app.before_request
+def _load_current_user():
+    if request.endpoint not in _STATIC_ENDPOINTS:
+        load_current_user()
+
+
+@app.errorhandler(PasswordServiceBusy)
+def password_service_busy(e):
+    """Shed load with a fast 503 when the bcrypt worker pool is saturated"""
+    message = 'The server is busy. Please try again shortly.'
+    if request.path.startswith('/api/'):
+        response = jsonify({'success': False, 'message': message})
+    else:
+        response = app.make_response(message)
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
 @app.route('/')
 def index():
     """Render the index page or redirect to dashboard if logged in"""
@@ -36,6 +106,7 @@ def index():
     return render_template('index.html')
 
 @app.route('/login', methods=['GET', 'POST'])
+@rate_limited(('ip', client_ip))
 def login():
     if request.method == 'POST':
         data = request.form
@@ -50,13 +121,11 @@ def login():
         result = auth_handler.login_user(username, password)
         
         if result['success']:
-            # Set session variables
+            # Set session variables under a fresh session id
+            session.regenerate()
             session['user_id'] = result['user_id']
             session['username'] = username
-            
-            # Get user permissions and store in session
-            permissions = auth_handler.db.get_user_permissions(result['user_id'])
-            session['permissions'] = permissions
+            session['session_token'] = result['session_token']
             
             flash('Login successful!', 'success')
             next_page = request.args.get('next') or url_for('dashboard')
@@ -97,13 +166,10 @@ def register():
                 encoded_image = base64.b64encode(file_data).decode('utf-8')
                 profile_pic_data = f"data:{file.content_type};base64,{encoded_image}"
 
-        # Hash the password
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-
-        # Register user
+        # Register user; register_user validates and hashes the password
         result = auth_handler.register_user(
             username,
-            hashed_password,
+            password,
             email,
             full_name,
             bio,
@@ -113,13 +179,10 @@ def register():
 
         if result['success']:
             # Set session variables to log the user in automatically
+            session.regenerate()
             session['user_id'] = result['user_id']
             session['username'] = username
             
-            # Store permissions in session
-            if 'permissions' in result:
-                session['permissions'] = result['permissions']
-            
             flash('Registration successful! You have been automatically logged in.', 'success')
             return redirect(url_for('dashboard'))
         else:
@@ -130,48 +193,25 @@ def register():
 @app.route('/logout')
 def logout():
     """Log out the user"""
-    # Clear the session
+    # Revoke the session token, then clear the session
+    if session.get('session_token'):
+        auth_handler.logout_user(session['session_token'])
     session.clear()
     return redirect(url_for('login'))
 
 @app.route('/profile')
+@login_required
 def profile():
     """Render the profile page"""
-    # Check if user is logged in
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    # Get user data
-    user_id = session['user_id']
-    user = auth_handler.db.get_user(user_id)
-    
-    # Get user permissions from session or fetch them if not available
-    permissions = session.get('permissions')
-    if not permissions:
-        permissions = auth_handler.db.get_user_permissions(user_id)
-        session['permissions'] = permissions
-    
-    return render_template('profile.html', user=user, permissions=permissions)
+    return render_template('profile.html', user=g.user, permissions=g.permissions)
 
 @app.route('/users')
-@login_required
+@permission_required('manage_users')
 def users():
-    # Get all users from database
-    users_list = auth_handler.db.get_all_users()
-    
-    # Get user permissions from session or fetch them if not available
-    user_id = session['user_id']
-    permissions = session.get('permissions')
-    if not permissions:
-        permissions = auth_handler.db.get_user_permissions(user_id)
-        session['permissions'] = permissions
-    
-    # Check if user has permission to manage users
-    if not permissions.get('manage_users') and not permissions.get('all'):
-        flash('You do not have permission to access this page', 'error')
-        return redirect(url_for('dashboard'))
+    # Users are loaded page by page from /api/users by the page itself
+    all_roles = auth_handler.db.get_all_roles()
     
-    return render_template('users.html', users=users_list, permissions=permissions)
+    return render_template('users.html', roles=all_roles, permissions=g.permissions)
 
 @app.route('/api/generate-key', methods=['POST'])
 @login_required
@@ -190,35 +230,18 @@ def generate_api_key():
 @login_required
 def api_keys():
     """Render the API keys page"""
-    # Check if user is logged in
-    if 'user_id' not in session:
-        return redirect(url_for('login', next=request.url))
-    
-    # Get user data
-    user_id = session['user_id']
-    user = auth_handler.db.get_user(user_id)
-    
-    # Get user permissions from session or fetch them if not available
-    permissions = session.get('permissions')
-    if not permissions:
-        permissions = auth_handler.db.get_user_permissions(user_id)
-        session['permissions'] = permissions
-    
     # Get user's API keys
-    keys = auth_handler.db.get_user_api_keys(user_id)
+    keys = auth_handler.db.get_user_api_keys(g.user['id'])
     
-    return render_template('api_keys.html', user=user, keys=keys, permissions=permissions)
+    return render_template('api_keys.html', user=g.user, keys=keys, permissions=g.permissions)
 
 
 @app.route('/api/keys', methods=['GET'])
+@api_key_required(lambda: auth_handler.db.api_key_auth)
 def get_keys():
-    """Get API keys for the current user"""
-    # Check if user is logged in
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Authentication required'}), 401
-    
+    """Get API keys for the current user or API client"""
     # Get user's API keys
-    user_id = session['user_id']
+    user_id = g.user_id
     keys = auth_handler.db.get_user_api_keys(user_id)
     
     return jsonify({'success': True, 'keys': keys})
@@ -236,6 +259,34 @@ def create_key():
     
     return jsonify({'success': True, 'key': key})
 
+@app.route('/api/keys/bulk', methods=['POST'])
+@api_key_required(lambda: auth_handler.db.api_key_auth)
+def create_keys_bulk():
+    """Provision API keys for several users in one transaction
+
+    JSON body: {"user_ids": [...], "count": 1, "permissions": [...]}. Without
+    user_ids the keys are created for the caller. Creating keys for anyone
+    else requires the manage_users permission.
+    """
+    data = request.get_json(silent=True) or {}
+    user_ids = data.get('user_ids') or [g.user_id]
+    count = data.get('count', 1)
+    if not isinstance(user_ids, list) or not isinstance(count, int) or isinstance(count, bool) or count < 1:
+        return jsonify({'success': False, 'message': 'user_ids must be a list and count a positive integer'}), 400
+    
+    if any(user_id != g.user_id for user_id in user_ids) and \
+            not auth_handler.db.has_permission(g.user_id, 'manage_users'):
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    
+    try:
+        keys = auth_handler.db.create_api_keys(user_ids, count=count, permissions=data.get('permissions'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    if keys is None:
+        return jsonify({'success': False, 'message': 'Failed to create API keys'}), 500
+    return jsonify({'success': True, 'keys': keys})
+
 @app.route('/api/keys/<key_id>', methods=['DELETE'])
 def delete_key(key_id):
     """Delete an API key"""
@@ -320,7 +371,7 @@ def update_username():
         
         # Verify password
         user = auth_handler.db.get_user(user_id)
-        if not bcrypt.checkpw(data['password'].encode('utf-8'), user['password_hash']):
+        if not password_policy.verify_password(auth_handler.db.get_password_hash(user_id), data['password']):
             return jsonify({'success': False, 'message': 'Invalid password'})
         
         # Check if username is already taken
@@ -332,6 +383,8 @@ def update_username():
         session['username'] = data['new_username']
         
         return jsonify({'success': True})
+    except PasswordServiceBusy:
+        raise
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -350,19 +403,21 @@ def update_password():
             return jsonify({'success': False, 'message': 'Missing required fields'})
         
         # Verify current password
-        user = auth_handler.db.get_user(user_id)
-        if not bcrypt.checkpw(data['current_password'].encode('utf-8'), user['password_hash']):
+        if not password_policy.verify_password(auth_handler.db.get_password_hash(user_id), data['current_password']):
             return jsonify({'success': False, 'message': 'Current password is incorrect'})
         
         # Update password
-        password_hash = bcrypt.hashpw(data['new_password'].encode('utf-8'), bcrypt.gensalt())
-        auth_handler.db.update_user(user_id, {'password_hash': password_hash})
+        password_hash = password_policy.hash_password(data['new_password'])
+        auth_handler.db.update_user(user_id, {'password': password_hash})
         
         return jsonify({'success': True})
+    except PasswordServiceBusy:
+        raise
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/recover-password', methods=['POST'])
+@rate_limited(('ip', client_ip), ('recovery', form_field('email')))
 def recover_password():
     if request.method == 'POST':
         email = request.form.get('email')
@@ -378,15 +433,10 @@ def recover_password():
         new_password = generate_secure_password()
         
         # Hash the new password
-        hashed = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+        hashed = password_policy.hash_password(new_password)
         
         # Update password in database
-        conn = sqlite3.connect('database.db')
-        cursor = conn.cursor()
-        cursor.execute('UPDATE users SET password = ? WHERE id = ?', 
-                      (hashed.decode('utf-8'), user['id']))
-        conn.commit()
-        conn.close()
+        auth_handler.db.update_user(user['id'], {'password': hashed})
         
         # Send recovery email with the new password
         email_sent = email_handler.send_password_recovery_email(
@@ -437,50 +487,19 @@ def serve_static_files(filename):
     return send_from_directory('static', filename)
 
 @app.route('/dashboard')
+@login_required
 def dashboard():
     """Render the dashboard page"""
-    # Check if user is logged in
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-        
-    # Get user data
-    user_id = session['user_id']
-    user = auth_handler.db.get_user(user_id)
-    
-    # Get user permissions from session or fetch them if not available
-    permissions = session.get('permissions')
-    if not permissions:
-        permissions = auth_handler.db.get_user_permissions(user_id)
-        session['permissions'] = permissions
-    
-    return render_template('dashboard.html', user=user, permissions=permissions)
+    return render_template('dashboard.html', user=g.user, permissions=g.permissions)
 
 @app.route('/roles')
+@permission_required('manage_roles')
 def roles_page():
     """Render the roles management page"""
-    # Check if user is logged in
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    # Get user data
-    user_id = session['user_id']
-    user = auth_handler.db.get_user(user_id)
-    
-    # Get user permissions from session or fetch them if not available
-    permissions = session.get('permissions')
-    if not permissions:
-        permissions = auth_handler.db.get_user_permissions(user_id)
-        session['permissions'] = permissions
-    
-    # Check if user has permission to manage roles
-    if not permissions.get('manage_roles') and not permissions.get('all'):
-        flash('You do not have permission to access this page', 'danger')
-        return redirect(url_for('dashboard'))
-    
     # Get all roles
     roles = auth_handler.db.get_all_roles()
     
-    return render_template('roles.html', user=user, roles=roles, permissions=permissions)
+    return render_template('roles.html', user=g.user, roles=roles, permissions=g.permissions)
 
 # API endpoints for role management
 @app.route('/api/roles', methods=['GET'])
@@ -525,44 +544,60 @@ def get_all_roles_api():
         print(f"Error in get_all_roles_api: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
+@app.route('/api/generations/history', methods=['GET'])
+@login_required
+def generation_history():
+    """Get one page of the user's prompt history, optionally searched
+
+    Query parameters: q (words to search for), sort ('relevance' or
+    'recent'), limit, cursor. Users with manage_content may pass user_id to
+    see another user's prompts, or user_id=all for everyone's.
+    """
+    user_id = g.user['id']
+    requested = request.args.get('user_id')
+    if requested and requested != user_id:
+        if not g.permissions.get('manage_content') and not g.permissions.get('all'):
+            return jsonify({'success': False, 'message': 'Permission denied'}), 403
+        user_id = None if requested == 'all' else requested
+
+    try:
+        page = auth_handler.db.get_prompt_history(
+            user_id=user_id,
+            query=request.args.get('q', '').strip() or None,
+            limit=request.args.get('limit', 20, type=int),
+            cursor=request.args.get('cursor') or None,
+            sort=request.args.get('sort') or None
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    return jsonify({'success': True, 'items': page['items'], 'next_cursor': page['next_cursor']})
+
+@app.route('/api/permissions/<permission>/users', methods=['GET'])
+@permission_required('manage_users')
+def get_permission_users(permission):
+    """Get the IDs of the users granted a permission"""
+    include_all = request.args.get('include_all', 'true').lower() != 'false'
+    user_ids = auth_handler.db.get_users_with_permission(permission, include_all=include_all)
+    return jsonify({'success': True, 'permission': permission, 'user_ids': user_ids})
+
 @app.route('/api/roles/<int:role_id>', methods=['GET'])
+@permission_required('manage_roles')
 def get_role(role_id):
     """Get a specific role"""
-    # Check if user is logged in
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Authentication required'}), 401
-    
-    # Get user permissions
-    user_id = session['user_id']
-    permissions = auth_handler.db.get_user_permissions(user_id)
-    
-    # Check if user has permission to manage roles
-    if not permissions.get('manage_roles') and not permissions.get('all'):
-        return jsonify({'success': False, 'message': 'Permission denied'}), 403
-    
     # Get the role
     role = auth_handler.db.get_role(role_id=role_id)
     
     if not role:
         return jsonify({'success': False, 'message': 'Role not found'}), 404
     
+    role.update(auth_handler.db.get_role_inheritance(role['role_name']))
     return jsonify({'success': True, 'role': role})
 
 @app.route('/api/roles', methods=['POST'])
+@permission_required('manage_roles')
 def create_role():
     """Create a new role"""
-    # Check if user is logged in
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Authentication required'}), 401
-    
-    # Get user permissions
-    user_id = session['user_id']
-    permissions = auth_handler.db.get_user_permissions(user_id)
-    
-    # Check if user has permission to manage roles
-    if not permissions.get('manage_roles') and not permissions.get('all'):
-        return jsonify({'success': False, 'message': 'Permission denied'}), 403
-    
     # Get role data from request
     data = request.json
     
@@ -570,7 +605,7 @@ def create_role():
         return jsonify({'success': False, 'message': 'Invalid role data'}), 400
     
     # Create the role
-    role_id = auth_handler.db.create_role(data['name'], data['permissions'], data.get('description', ''))
+    role_id = auth_handler.db.create_role(data['name'], data['permissions'], inherits=data.get('inherits'))
     
     if not role_id:
         return jsonify({'success': False, 'message': 'Failed to create role'}), 500
@@ -578,20 +613,9 @@ def create_role():
     return jsonify({'success': True, 'role_id': role_id}), 201
 
 @app.route('/api/roles/<int:role_id>', methods=['PUT'])
+@permission_required('manage_roles')
 def update_role(role_id):
     """Update a role"""
-    # Check if user is logged in
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Authentication required'}), 401
-    
-    # Get user permissions
-    user_id = session['user_id']
-    permissions = auth_handler.db.get_user_permissions(user_id)
-    
-    # Check if user has permission to manage roles
-    if not permissions.get('manage_roles') and not permissions.get('all'):
-        return jsonify({'success': False, 'message': 'Permission denied'}), 403
-    
     # Get role data from request
     data = request.json
     
@@ -612,6 +636,8 @@ def update_role(role_id):
         updates['permissions'] = data['permissions']
     if 'description' in data:
         updates['description'] = data['description']
+    if 'inherits' in data:
+        updates['inherits'] = data['inherits']
     
     # Update the role
     success = auth_handler.db.update_role(role_id, updates)
@@ -622,20 +648,9 @@ def update_role(role_id):
     return jsonify({'success': True, 'message': 'Role updated successfully'})
 
 @app.route('/api/roles/<int:role_id>', methods=['DELETE'])
+@permission_required('manage_roles')
 def delete_role(role_id):
     """Delete a role"""
-    # Check if user is logged in
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Authentication required'}), 401
-    
-    # Get user permissions
-    user_id = session['user_id']
-    permissions = auth_handler.db.get_user_permissions(user_id)
-    
-    # Check if user has permission to manage roles
-    if not permissions.get('manage_roles') and not permissions.get('all'):
-        return jsonify({'success': False, 'message': 'Permission denied'}), 403
-    
     # Check if role exists
     role = auth_handler.db.get_role(role_id)
     
@@ -651,18 +666,12 @@ def delete_role(role_id):
     return jsonify({'success': True})
 
 @app.route('/api/users/<int:user_id>/roles', methods=['GET'])
+@login_required
 def get_user_roles(user_id):
     """Get roles for a specific user"""
-    # Check if user is logged in
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Authentication required'}), 401
-    
-    # Get user permissions
-    current_user_id = session['user_id']
-    permissions = auth_handler.db.get_user_permissions(current_user_id)
-    
     # Check if user has permission to manage roles or is requesting their own roles
-    if current_user_id != user_id and not permissions.get('manage_roles') and not permissions.get('all'):
+    permissions = g.permissions
+    if g.user['id'] != user_id and not permissions.get('manage_roles') and not permissions.get('all'):
         return jsonify({'success': False, 'message': 'Permission denied'}), 403
     
     # Check if user exists
@@ -677,20 +686,9 @@ def get_user_roles(user_id):
     return jsonify({'success': True, 'roles': roles})
 
 @app.route('/api/users/<int:user_id>/roles/<role_name>', methods=['POST'])
+@permission_required('manage_roles')
 def assign_role_to_user(user_id, role_name):
     """Assign a role to a user"""
-    # Check if user is logged in
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Authentication required'}), 401
-    
-    # Get user permissions
-    current_user_id = session['user_id']
-    permissions = auth_handler.db.get_user_permissions(current_user_id)
-    
-    # Check if user has permission to manage roles
-    if not permissions.get('manage_roles') and not permissions.get('all'):
-        return jsonify({'success': False, 'message': 'Permission denied'}), 403
-    
     # Check if user exists
     user = auth_handler.db.get_user(user_id)
     
@@ -709,26 +707,14 @@ def assign_role_to_user(user_id, role_name):
     if not success:
         return jsonify({'success': False, 'message': 'Failed to assign role to user'}), 500
     
-    # Update session permissions if this is the current user
-    update_session_permissions(user_id)
-    
+    # Role assignments bump the permission epoch, so the user's cached
+    # permissions are reloaded on their next request
     return jsonify({'success': True})
 
 @app.route('/api/users/<int:user_id>/roles/<role_name>', methods=['DELETE'])
+@permission_required('manage_roles')
 def remove_role_from_user(user_id, role_name):
     """Remove a role from a user"""
-    # Check if user is logged in
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Authentication required'}), 401
-    
-    # Get user permissions
-    current_user_id = session['user_id']
-    permissions = auth_handler.db.get_user_permissions(current_user_id)
-    
-    # Check if user has permission to manage roles
-    if not permissions.get('manage_roles') and not permissions.get('all'):
-        return jsonify({'success': False, 'message': 'Permission denied'}), 403
-    
     # Check if user exists
     user = auth_handler.db.get_user(user_id)
     
@@ -747,35 +733,37 @@ def remove_role_from_user(user_id, role_name):
     if not success:
         return jsonify({'success': False, 'message': 'Failed to remove role from user'}), 500
     
-    # Update session permissions if this is the current user
-    update_session_permissions(user_id)
-    
+    # Role assignments bump the permission epoch, so the user's cached
+    # permissions are reloaded on their next request
     return jsonify({'success': True})
 
-# Add a utility function to update user permissions in session
-def update_session_permissions(user_id):
-    """Update the user permissions in the session"""
-    if 'user_id' in session and session['user_id'] == user_id:
-        permissions = auth_handler.db.get_user_permissions(user_id)
-        session['permissions'] = permissions
-        return permissions
-    return None
-
 # API routes for user management
-@app.route('/api/users', methods=['POST'])
-@login_required
-def create_user():
-    """Create a new user"""
+@app.route('/api/users', methods=['GET'])
+@api_key_required(lambda: auth_handler.db.api_key_auth)
+def list_users():
+    """Get one page of users with search, sorting and role filtering"""
     # Check if user has permission to manage users
-    user_id = session['user_id']
-    permissions = session.get('permissions')
-    if not permissions:
-        permissions = auth_handler.db.get_user_permissions(user_id)
-        session['permissions'] = permissions
+    if not auth_handler.db.has_permission(g.user_id, 'manage_users'):
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
     
-    if not permissions.get('manage_users') and not permissions.get('all'):
-        return jsonify({'success': False, 'message': 'You do not have permission to create users'}), 403
+    try:
+        page = auth_handler.db.list_users(
+            limit=request.args.get('limit', 50, type=int),
+            cursor=request.args.get('cursor') or None,
+            search=request.args.get('q', '').strip() or None,
+            sort=request.args.get('sort', 'username'),
+            descending=request.args.get('order', 'asc').lower() == 'desc',
+            role=request.args.get('role') or None
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     
+    return jsonify({'success': True, 'users': page['users'], 'next_cursor': page['next_cursor']})
+
+@app.route('/api/users', methods=['POST'])
+@permission_required('manage_users', 'You do not have permission to create users')
+def create_user():
+    """Create a new user"""
     # Get data from request
     data = request.json
     username = data.get('username')
@@ -791,13 +779,10 @@ def create_user():
     # Create role data
     role = {'name': role_name}
     
-    # Hash the password
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-
-    # Register the user
+    # Register the user; register_user validates and hashes the password
     result = auth_handler.register_user(
         username, 
-        hashed_password, 
+        password, 
         email, 
         full_name, 
         bio=None, 
@@ -811,19 +796,9 @@ def create_user():
         return jsonify({'success': False, 'message': result['message']}), 400
 
 @app.route('/api/users/<username>', methods=['GET'])
-@login_required
+@permission_required('manage_users', 'You do not have permission to view user details')
 def get_user(username):
     """Get user details"""
-    # Check if user has permission to manage users
-    user_id = session['user_id']
-    permissions = session.get('permissions')
-    if not permissions:
-        permissions = auth_handler.db.get_user_permissions(user_id)
-        session['permissions'] = permissions
-    
-    if not permissions.get('manage_users') and not permissions.get('all'):
-        return jsonify({'success': False, 'message': 'You do not have permission to view user details'}), 403
-    
     # Get user details
     user = auth_handler.db.get_user_by_username(username)
     if not user:
@@ -836,19 +811,9 @@ def get_user(username):
     return jsonify({'success': True, 'user': user})
 
 @app.route('/api/users/<username>', methods=['PUT'])
-@login_required
+@permission_required('manage_users', 'You do not have permission to update users')
 def update_user(username):
     """Update user details"""
-    # Check if user has permission to manage users
-    user_id = session['user_id']
-    permissions = session.get('permissions')
-    if not permissions:
-        permissions = auth_handler.db.get_user_permissions(user_id)
-        session['permissions'] = permissions
-    
-    if not permissions.get('manage_users') and not permissions.get('all'):
-        return jsonify({'success': False, 'message': 'You do not have permission to update users'}), 403
-    
     # Get user details
     user = auth_handler.db.get_user_by_username(username)
     if not user:
@@ -869,8 +834,7 @@ def update_user(username):
     # Update password if provided
     if 'password' in data and data['password']:
         # Hash the password
-        hashed_password = bcrypt.hashpw(data['password'].encode('utf-8'), bcrypt.gensalt())
-        update_data['password'] = hashed_password
+        update_data['password'] = password_policy.hash_password(data['password'])
     
     # Update the user
     success = auth_handler.db.update_user(user['id'], update_data)
@@ -881,26 +845,16 @@ def update_user(username):
         return jsonify({'success': False, 'message': 'Failed to update user'}), 500
 
 @app.route('/api/users/<username>', methods=['DELETE'])
-@login_required
+@permission_required('manage_users', 'You do not have permission to delete users')
 def delete_user(username):
     """Delete a user"""
-    # Check if user has permission to manage users
-    user_id = session['user_id']
-    permissions = session.get('permissions')
-    if not permissions:
-        permissions = auth_handler.db.get_user_permissions(user_id)
-        session['permissions'] = permissions
-    
-    if not permissions.get('manage_users') and not permissions.get('all'):
-        return jsonify({'success': False, 'message': 'You do not have permission to delete users'}), 403
-    
     # Get user details
     user = auth_handler.db.get_user_by_username(username)
     if not user:
         return jsonify({'success': False, 'message': 'User not found'}), 404
     
     # Cannot delete yourself
-    if user['id'] == user_id:
+    if user['id'] == g.user['id']:
         return jsonify({'success': False, 'message': 'You cannot delete your own account'}), 400
     
     # Delete the user
@@ -912,20 +866,9 @@ def delete_user(username):
         return jsonify({'success': False, 'message': 'Failed to delete user'}), 500
 
 @app.route('/users/<username>', methods=['GET'])
-@login_required
+@permission_required('manage_users', 'You do not have permission to view user profiles')
 def view_user(username):
     """View a specific user's profile"""
-    # Check if user has permission to manage users
-    user_id = session['user_id']
-    permissions = session.get('permissions')
-    if not permissions:
-        permissions = auth_handler.db.get_user_permissions(user_id)
-        session['permissions'] = permissions
-    
-    if not permissions.get('manage_users') and not permissions.get('all'):
-        flash('You do not have permission to view user profiles', 'error')
-        return redirect(url_for('dashboard'))
-    
     # Get user details
     user = auth_handler.db.get_user_by_username(username)
     if not user:
@@ -943,23 +886,12 @@ def view_user(username):
     # Get user permissions
     user_permissions = auth_handler.db.get_user_permissions(user['id'])
     
-    return render_template('user_profile.html', user=user, user_roles=user_roles, user_permissions=user_permissions, permissions=permissions)
+    return render_template('user_profile.html', user=user, user_roles=user_roles, user_permissions=user_permissions, permissions=g.permissions)
 
 @app.route('/users/<username>/edit', methods=['GET'])
-@login_required
+@permission_required('manage_users', 'You do not have permission to edit user profiles')
 def edit_user(username):
     """Edit a specific user's profile"""
-    # Check if user has permission to manage users
-    user_id = session['user_id']
-    permissions = session.get('permissions')
-    if not permissions:
-        permissions = auth_handler.db.get_user_permissions(user_id)
-        session['permissions'] = permissions
-    
-    if not permissions.get('manage_users') and not permissions.get('all'):
-        flash('You do not have permission to edit user profiles', 'error')
-        return redirect(url_for('dashboard'))
-    
     # Get user details
     user = auth_handler.db.get_user_by_username(username)
     if not user:
@@ -977,22 +909,12 @@ def edit_user(username):
         if role:
             user_roles.append(role)
     
-    return render_template('edit_user.html', user=user, all_roles=all_roles, user_roles=user_roles, permissions=permissions)
+    return render_template('edit_user.html', user=user, all_roles=all_roles, user_roles=user_roles, permissions=g.permissions)
 
 @app.route('/api/users/<username>/roles', methods=['PATCH'])
-@login_required
+@permission_required('manage_users')
 def update_user_roles(username):
     """Update a user's roles"""
-    # Check if user has permission to manage users
-    user_id = session['user_id']
-    permissions = session.get('permissions')
-    if not permissions:
-        permissions = auth_handler.db.get_user_permissions(user_id)
-        session['permissions'] = permissions
-    
-    if not permissions.get('manage_users') and not permissions.get('all'):
-        return jsonify({'success': False, 'message': 'Permission denied'}), 403
-    
     # Get user details
     user = auth_handler.db.get_user_by_username(username)
     if not user:
@@ -1012,19 +934,9 @@ def update_user_roles(username):
         return jsonify({'success': False, 'message': 'Failed to update user roles'}), 500
 
 @app.route('/api/users/<username>', methods=['GET'])
-@login_required
+@permission_required('manage_users')
 def get_user_api(username):
     """Get user details"""
-    # Check if user has permission to manage users
-    user_id = session['user_id']
-    permissions = session.get('permissions')
-    if not permissions:
-        permissions = auth_handler.db.get_user_permissions(user_id)
-        session['permissions'] = permissions
-    
-    if not permissions.get('manage_users') and not permissions.get('all'):
-        return jsonify({'success': False, 'message': 'Permission denied'}), 403
-    
     # Get user details
     user = auth_handler.db.get_user_by_username(username)
     if not user:
@@ -1040,21 +952,13 @@ def get_user_api(username):
     return jsonify({'success': True, 'user': user_data})
 
 @app.route('/api/verify-password', methods=['POST']) #kette kell majd bontani, mert ez így egy szar xd: profile/username/apikeySecretre is kell, hogy hanalhato legyen
+@rate_limited(('ip', client_ip), ('verify_password', form_field('key_id')),
+              ('verify_password', form_field('username')), ('verify_password', api_key))
 def verify_password():
     """Verify user password and retrieve API secret"""
     # Check if user is logged in
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Authentication required'}), 401
-    import bcrypt
-    def verify_password(stored_password, provided_password):
-        """Verify a password against its bcrypt hash"""
-        try:
-            # Convert both inputs to bytes
-            return bcrypt.checkpw(provided_password.encode('utf-8'), stored_password.encode('utf-8'))
-        except Exception as e:
-            print(f"Error verifying password: {str(e)}")
-            return False
-    
     # Get request data
     data = request.json
     password = data.get('password', None)
@@ -1077,13 +981,14 @@ def verify_password():
         return jsonify({'success': False, 'message': 'User not found'}), 404
     
     # Verify password
-    if not verify_password(user['password'], password):
+    if not password_policy.verify_password(auth_handler.db.get_password_hash(user['id']), password):
         print(f"Debug: Password verification failed for user {user['username']}")
         return jsonify({'success': False, 'message': 'Incorrect password'}), 401
     
     if key_id:
         # Get API secret
-        api_secret = get_api_secret(auth_handler.db.conn, key_id, user_id)
+        with auth_handler.db.connection() as conn:
+            api_secret = get_api_secret(conn, key_id, user_id)
         
         if not api_secret:
             return jsonify({'success': False, 'message': 'API key not found or does not belong to you'}), 404
@@ -1103,4 +1008,9 @@ if __name__ == '__main__':
     #kill all python processes
     #os.system('taskkill /F /IM python.exe')
     
+    # Development runs apply pending migrations; deployments run migrations.py
+    create_app()
+    with auth_handler.db.connection() as conn:
+        apply_migrations(conn)
+    
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,189 @@
+import sqlite3
+import secrets
+import threading
+import time
+import logging
+from datetime import timedelta
+from flask.sessions import SessionInterface, SessionMixin
+from flask.json.tag import TaggedJSONSerializer
+from werkzeug.datastructures import CallbackDict
+from session_store import hash_token
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session data kept in the web_sessions table; the cookie only holds its id"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.expires_at = 0.0
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """Move the data to a fresh id on the next save, e.g. after login"""
+        if self.sid:
+            self.replaced_sid = self.sid
+            self.sid = None
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session backend that stores session state in SQLite
+
+    The cookie carries a random id; only its SHA-256 hash is stored.
+    Permissions are not kept in the session; each request resolves them
+    through the UserCache. Expiry slides with activity, but an unchanged
+    session is written back at most every ``touch_interval`` seconds.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, get_db, lifetime=timedelta(days=1), touch_interval=60, purge_interval=300):
+        """Initialize the session backend
+
+        Args:
+            get_db (callable): Returns the Database; resolved on first use
+            lifetime (timedelta, optional): Idle time after which a session expires. Defaults to one day.
+            touch_interval (float, optional): Seconds between expiry refreshes of an unchanged session. Defaults to 60.
+            purge_interval (float, optional): Seconds between deletes of expired sessions. Defaults to 300.
+        """
+        self.get_db = get_db
+        self.lifetime = lifetime
+        self.touch_interval = touch_interval
+        self.purge_interval = purge_interval
+
+        self._lock = threading.Lock()
+        self._last_purge = time.monotonic()
+
+        self.loads = 0
+        self.saves = 0
+        self.touches = 0
+
+    def open_session(self, app, request):
+        db = self.get_db()
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return ServerSession(new=True)
+
+        try:
+            with db.connection() as conn:
+                row = conn.execute(
+                    "SELECT data, expires_at FROM web_sessions WHERE id = ? AND expires_at > ?",
+                    (hash_token(sid), time.time())
+                ).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Error loading session: {str(e)}")
+            return ServerSession(new=True)
+        if row is None:
+            return ServerSession(new=True)
+
+        data, expires_at = row
+        try:
+            data = self.serializer.loads(data)
+        except ValueError:
+            return ServerSession(new=True)
+        self.loads += 1
+
+        session = ServerSession(data, sid=sid)
+        session.expires_at = expires_at
+        return session
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        db = self.get_db()
+
+        if session.replaced_sid:
+            self._delete(db, session.replaced_sid)
+        if not session:
+            if (session.sid or session.replaced_sid) and session.modified:
+                if session.sid:
+                    self._delete(db, session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        expires_at = now + self.lifetime.total_seconds()
+        if not session.modified and session.sid:
+            # Slide the expiry, but not on every request
+            if expires_at - session.expires_at >= self.touch_interval:
+                self._touch(db, session.sid, expires_at)
+            return
+
+        sid = session.sid or secrets.token_urlsafe(32)
+        try:
+            with db.connection() as conn:
+                conn.execute('''
+                INSERT INTO web_sessions (id, user_id, data, expires_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    user_id = excluded.user_id, data = excluded.data, expires_at = excluded.expires_at
+                ''', (hash_token(sid), session.get('user_id'), self.serializer.dumps(dict(session)), expires_at))
+                conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error saving session: {str(e)}")
+            return
+        self.saves += 1
+        self._maybe_purge(db)
+
+        if sid != session.sid:
+            response.set_cookie(
+                name, sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+    def _touch(self, db, sid, expires_at):
+        try:
+            with db.connection() as conn:
+                conn.execute("UPDATE web_sessions SET expires_at = ? WHERE id = ?", (expires_at, hash_token(sid)))
+                conn.commit()
+            self.touches += 1
+        except sqlite3.Error as e:
+            logging.error(f"Error refreshing session expiry: {str(e)}")
+
+    def _delete(self, db, sid):
+        try:
+            with db.connection() as conn:
+                conn.execute("DELETE FROM web_sessions WHERE id = ?", (hash_token(sid),))
+                conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error deleting session: {str(e)}")
+
+    def _maybe_purge(self, db, batch_size=500):
+        """Delete expired sessions in small batches every ``purge_interval`` seconds"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_purge < self.purge_interval:
+                return
+            self._last_purge = now
+        try:
+            while True:
+                with db.connection() as conn:
+                    deleted = conn.execute('''
+                    DELETE FROM web_sessions WHERE id IN (
+                        SELECT id FROM web_sessions WHERE expires_at <= ? LIMIT ?
+                    )
+                    ''', (time.time(), batch_size)).rowcount
+                    conn.commit()
+                if deleted < batch_size:
+                    break
+        except sqlite3.Error as e:
+            logging.error(f"Error purging expired sessions: {str(e)}")
+
+    def stats(self):
+        """Get load, save and touch counters"""
+        return {
+            'loads': self.loads,
+            'saves': self.saves,
+            'touches': self.touches,
+        }
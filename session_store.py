@@ -0,0 +1,248 @@
+import sqlite3
+import hashlib
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+
+def hash_token(session_token):
+    """Hash a session token for storage; only the hash ever reaches the database"""
+    return hashlib.sha256(session_token.encode('utf-8')).hexdigest()
+
+
+class SessionStore:
+    """Session tokens stored as SHA-256 hashes in the sessions table
+
+    Recently validated tokens are kept in a bounded LRU so that repeated
+    validations of the same token skip SQLite. LRU entries live for at most
+    ``lru_ttl`` seconds, which bounds how long a session revoked by another
+    worker process can still validate here. A background sweeper deletes
+    expired rows in small batches so no single transaction holds the write
+    lock for long.
+    """
+
+    def __init__(self, pool, lru_size=10000, lru_ttl=30.0, sweep_batch_size=500):
+        """Initialize the session store
+
+        Args:
+            pool (ConnectionPool): Pool used for session reads and writes
+            lru_size (int, optional): Maximum cached tokens. Defaults to 10000.
+            lru_ttl (float, optional): Seconds a cached validation stays trusted. Defaults to 30.
+            sweep_batch_size (int, optional): Expired rows deleted per transaction. Defaults to 500.
+        """
+        self.pool = pool
+        self.lru_size = lru_size
+        self.lru_ttl = lru_ttl
+        self.sweep_batch_size = sweep_batch_size
+
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()       # token_hash -> (user_id, expiration_time, cached_at)
+        self._sweeper = None
+        self._stop_sweeper = threading.Event()
+
+        # Metrics
+        self.lookups = 0
+        self.hits = 0
+        self.sweeps = 0
+        self.swept_rows = 0
+        self.last_sweep_duration = 0.0
+        self.last_sweep_at = None
+
+    def create(self, user_id, session_token, expiration_time):
+        """Store a new session
+
+        Args:
+            user_id (str): The ID of the user the session belongs to
+            session_token (str): The raw token handed to the client
+            expiration_time (float): Unix timestamp after which the session is invalid
+
+        Returns:
+            bool: True if stored, False otherwise
+        """
+        try:
+            with self.pool.connection() as conn:
+                conn.execute('''
+                INSERT INTO sessions (token_hash, user_id, created_at, expiration_time)
+                VALUES (?, ?, ?, ?)
+                ''', (hash_token(session_token), user_id, time.time(), expiration_time))
+                conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Error storing session token: {str(e)}")
+            return False
+
+    def validate(self, session_token):
+        """Validate a session token
+
+        Args:
+            session_token (str): The raw token presented by the client
+
+        Returns:
+            str: The user_id if the session exists and has not expired, None otherwise
+        """
+        token_hash = hash_token(session_token)
+        now = time.time()
+
+        with self._lock:
+            self.lookups += 1
+            cached = self._lru.get(token_hash)
+            if cached is not None:
+                user_id, expiration_time, cached_at = cached
+                if expiration_time > now and now - cached_at < self.lru_ttl:
+                    self._lru.move_to_end(token_hash)
+                    self.hits += 1
+                    return user_id
+                del self._lru[token_hash]
+
+        try:
+            with self.pool.connection() as conn:
+                row = conn.execute('''
+                SELECT user_id, expiration_time FROM sessions
+                WHERE token_hash = ? AND expiration_time > ?
+                ''', (token_hash, now)).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Error validating session token: {str(e)}")
+            return None
+
+        if not row:
+            return None
+
+        with self._lock:
+            self._lru[token_hash] = (row[0], row[1], now)
+            if len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+        return row[0]
+
+    def get_expiration(self, session_token):
+        """Get the expiration time of a stored session
+
+        Returns:
+            float: Unix timestamp the session expires at, or None if it does not exist
+        """
+        try:
+            with self.pool.connection() as conn:
+                row = conn.execute(
+                    "SELECT expiration_time FROM sessions WHERE token_hash = ?", (hash_token(session_token),)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Error reading session expiration: {str(e)}")
+            return None
+        return row[0] if row else None
+
+    def revoke(self, session_token):
+        """Delete a session so the token stops validating
+
+        Returns:
+            bool: True if a session was deleted, False otherwise
+        """
+        token_hash = hash_token(session_token)
+        with self._lock:
+            self._lru.pop(token_hash, None)
+        try:
+            with self.pool.connection() as conn:
+                deleted = conn.execute("DELETE FROM sessions WHERE token_hash = ?", (token_hash,)).rowcount
+                conn.commit()
+            return deleted > 0
+        except sqlite3.Error as e:
+            logging.error(f"Error revoking session token: {str(e)}")
+            return False
+
+    def revoke_user_sessions(self, user_id):
+        """Delete every session belonging to a user
+
+        Returns:
+            int: Number of sessions deleted
+        """
+        with self._lock:
+            for token_hash in [h for h, entry in self._lru.items() if entry[0] == user_id]:
+                del self._lru[token_hash]
+        try:
+            with self.pool.connection() as conn:
+                deleted = conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,)).rowcount
+                conn.commit()
+            return deleted
+        except sqlite3.Error as e:
+            logging.error(f"Error revoking user sessions: {str(e)}")
+            return 0
+
+    def sweep(self, pause=0.01):
+        """Delete expired sessions in batches of ``sweep_batch_size``
+
+        Each batch is its own short transaction, with a brief pause in between
+        so request threads can take the write lock.
+
+        Args:
+            pause (float, optional): Seconds to sleep between batches. Defaults to 0.01.
+
+        Returns:
+            int: Number of expired sessions deleted
+        """
+        start = time.perf_counter()
+        now = time.time()
+        deleted = 0
+        try:
+            while not self._stop_sweeper.is_set():
+                with self.pool.connection() as conn:
+                    batch = conn.execute('''
+                    DELETE FROM sessions WHERE id IN (
+                        SELECT id FROM sessions WHERE expiration_time <= ? LIMIT ?
+                    )
+                    ''', (now, self.sweep_batch_size)).rowcount
+                    conn.commit()
+                deleted += batch
+                if batch < self.sweep_batch_size:
+                    break
+                time.sleep(pause)
+        except sqlite3.Error as e:
+            logging.error(f"Error sweeping expired sessions: {str(e)}")
+
+        duration = time.perf_counter() - start
+        with self._lock:
+            self.sweeps += 1
+            self.swept_rows += deleted
+            self.last_sweep_duration = duration
+            self.last_sweep_at = now
+        return deleted
+
+    def start_sweeper(self, interval=300):
+        """Start a daemon thread that sweeps expired sessions every ``interval`` seconds"""
+        if self._sweeper and self._sweeper.is_alive():
+            return
+        self._stop_sweeper.clear()
+
+        def _sweep_loop():
+            while not self._stop_sweeper.wait(interval):
+                self.sweep()
+
+        self._sweeper = threading.Thread(target=_sweep_loop, name='session-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        """Stop the background sweeper thread"""
+        self._stop_sweeper.set()
+        if self._sweeper:
+            self._sweeper.join(timeout=5)
+            self._sweeper = None
+
+    def stats(self):
+        """Get LRU hit rate, sweep metrics and the current table size"""
+        table_size = None
+        try:
+            with self.pool.connection() as conn:
+                table_size = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        except sqlite3.Error as e:
+            logging.error(f"Error counting sessions: {str(e)}")
+
+        with self._lock:
+            return {
+                'lookups': self.lookups,
+                'lru_hits': self.hits,
+                'lru_hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+                'lru_size': len(self._lru),
+                'sweeps': self.sweeps,
+                'swept_rows': self.swept_rows,
+                'last_sweep_duration': self.last_sweep_duration,
+                'last_sweep_at': self.last_sweep_at,
+                'table_size': table_size,
+            }
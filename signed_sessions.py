@@ -0,0 +1,173 @@
+import hmac
+import base64
+import hashlib
+import sqlite3
+import threading
+import time
+import logging
+
+# Signed tokens look like s1.<expiry>.<epoch>.<user_id>.<signature>. The
+# marker tells them apart from the random tokens stored in the sessions
+# table, which never contain a dot. The claims are plain text rather than
+# JSON so that validating a token is little more than one HMAC.
+TOKEN_PREFIX = 's1.'
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def is_signed_token(session_token):
+    """Check whether a session token uses the signed format"""
+    return bool(session_token) and session_token.startswith(TOKEN_PREFIX)
+
+
+class SignedSessionTokens:
+    """Stateless session tokens signed with HMAC-SHA256
+
+    A token carries the user id, its expiry and the user's session epoch, so
+    validating it is a signature check plus an in-memory epoch comparison;
+    no session row is read. Bumping a user's epoch in session_epochs revokes
+    every token issued before the bump. Each process keeps a copy of the
+    epochs and picks up changes made by other processes every
+    ``sync_interval`` seconds. Single tokens are revoked through the
+    RevocationList, as for database-backed sessions.
+    """
+
+    def __init__(self, pool, secret, sync_interval=1.0):
+        """Initialize the token codec
+
+        Args:
+            pool (ConnectionPool): Pool used to read and bump session epochs
+            secret (bytes): HMAC signing key; never stored in the database
+            sync_interval (float, optional): Seconds between epoch syncs. Defaults to 1.0.
+        """
+        self.pool = pool
+        self.secret = secret
+        self._mac = hmac.new(secret, digestmod=hashlib.sha256)
+        self.sync_interval = sync_interval
+
+        self._lock = threading.Lock()
+        self._epochs = {}               # user_id -> epoch; users never revoked are absent
+        self._last_seq = 0
+        self._last_sync = 0.0
+
+        self.issued = 0
+        self.verified = 0
+        self.rejected = 0
+
+    def _sign(self, payload):
+        mac = self._mac.copy()
+        mac.update(payload.encode('utf-8'))
+        return _b64encode(mac.digest())
+
+    def issue(self, user_id, expiration_time):
+        """Create a signed token for a user
+
+        The epoch is read from the database, not the local copy, so a token
+        issued right after a revocation in another process is not born stale.
+
+        Args:
+            user_id (str): The ID of the user the session belongs to
+            expiration_time (float): Unix timestamp after which the token is invalid
+
+        Returns:
+            str: The token, or None if the epoch could not be read
+        """
+        try:
+            with self.pool.connection() as conn:
+                row = conn.execute("SELECT epoch FROM session_epochs WHERE user_id = ?", (user_id,)).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Error reading session epoch: {str(e)}")
+            return None
+
+        payload = f"{TOKEN_PREFIX}{int(expiration_time)}.{row[0] if row else 0}.{user_id}"
+        self.issued += 1
+        return f"{payload}.{self._sign(payload)}"
+
+    def decode(self, session_token):
+        """Check a token's signature and return its claims without checking expiry or epoch
+
+        Returns:
+            dict: {'user_id', 'expiration_time', 'epoch'}, or None if the token is malformed or forged
+        """
+        if not is_signed_token(session_token):
+            return None
+        payload, _, signature = session_token.rpartition('.')
+        if not hmac.compare_digest(self._sign(payload), signature):
+            return None
+        try:
+            expiration_time, epoch, user_id = payload[len(TOKEN_PREFIX):].split('.', 2)
+            return {'user_id': user_id, 'expiration_time': int(expiration_time), 'epoch': int(epoch)}
+        except ValueError:
+            return None
+
+    def verify(self, session_token):
+        """Validate a signed token
+
+        Returns:
+            str: The user_id if the token is authentic, unexpired and not revoked by epoch, None otherwise
+        """
+        self._sync()
+        claims = self.decode(session_token)
+        if (claims is None or claims['expiration_time'] <= time.time()
+                or claims['epoch'] < self._epochs.get(claims['user_id'], 0)):
+            self.rejected += 1
+            return None
+        self.verified += 1
+        return claims['user_id']
+
+    def revoke_user(self, user_id):
+        """Invalidate every token issued to a user so far
+
+        Returns:
+            int: The user's new epoch, or None if it could not be bumped
+        """
+        try:
+            with self.pool.connection() as conn:
+                row = conn.execute('''
+                INSERT INTO session_epochs (user_id, epoch, changed_seq)
+                VALUES (?, 1, (SELECT COALESCE(MAX(changed_seq), 0) + 1 FROM session_epochs))
+                ON CONFLICT(user_id) DO UPDATE SET epoch = epoch + 1, changed_seq = excluded.changed_seq
+                RETURNING epoch
+                ''', (user_id,)).fetchone()
+                conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error bumping session epoch: {str(e)}")
+            return None
+
+        with self._lock:
+            self._epochs[user_id] = max(self._epochs.get(user_id, 0), row[0])
+        return row[0]
+
+    def _sync(self):
+        """Fold in epochs bumped by other processes since the last sync"""
+        now = time.monotonic()
+        if now - self._last_sync < self.sync_interval:
+            return
+        with self._lock:
+            if now - self._last_sync < self.sync_interval:
+                return
+            self._last_sync = now
+            try:
+                with self.pool.connection() as conn:
+                    rows = conn.execute(
+                        "SELECT user_id, epoch, changed_seq FROM session_epochs WHERE changed_seq > ? ORDER BY changed_seq",
+                        (self._last_seq,)
+                    ).fetchall()
+            except sqlite3.Error as e:
+                logging.error(f"Error syncing session epochs: {str(e)}")
+                return
+            for user_id, epoch, changed_seq in rows:
+                self._epochs[user_id] = max(self._epochs.get(user_id, 0), epoch)
+                self._last_seq = changed_seq
+
+    def stats(self):
+        """Get issue and verification counters"""
+        with self._lock:
+            return {
+                'issued': self.issued,
+                'verified': self.verified,
+                'rejected': self.rejected,
+                'tracked_epochs': len(self._epochs),
+            }
@@ -0,0 +1,37 @@
+import os
+import sys
+import sqlite3
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_pool import ConnectionPool
+from migrations import apply_migrations
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A database file with every migration applied"""
+    path = str(tmp_path / "database.db")
+    conn = sqlite3.connect(path)
+    apply_migrations(conn)
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def pool(db_path):
+    pool = ConnectionPool(db_path, size=2)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def db(db_path, tmp_path, monkeypatch):
+    """A Database on the migrated file; run from tmp_path since it keeps files in the working directory"""
+    monkeypatch.chdir(tmp_path)
+    from database import Database
+    database = Database(db_path)
+    yield database
+    database.close()
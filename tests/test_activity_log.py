@@ -0,0 +1,30 @@
+from activity_log import ActivityWriter, _FlushMarker
+
+
+def test_invalid_event_does_not_drop_the_rest_of_its_batch(pool):
+    # A long flush interval keeps every event in a single batch
+    writer = ActivityWriter(pool, batch_size=100, flush_interval=5.0)
+    good = [writer.submit(f"user{i}", 'generate', f"prompt {i}", "response") for i in range(5)]
+    writer.submit(None, 'generate', "prompt without a user")  # violates user_id NOT NULL
+    good += [writer.submit(f"user{i}", 'generate', f"prompt {i}") for i in range(5, 10)]
+    assert writer.flush()
+    writer.close()
+
+    with pool.connection() as conn:
+        stored = {row[0] for row in conn.execute("SELECT id FROM user_activity")}
+        details = conn.execute("SELECT COUNT(*) FROM activity_details").fetchone()[0]
+    assert stored == set(good)
+    assert details == 10
+    stats = writer.stats()
+    assert stats['written'] == 10
+    assert stats['failed'] == 1
+
+
+def test_drop_oldest_gives_up_on_a_queue_of_flush_markers(pool):
+    writer = ActivityWriter(pool, max_queue=2, overflow='drop_oldest')
+    markers = [_FlushMarker(), _FlushMarker()]
+    for marker in markers:
+        writer._queue.put_nowait(marker)
+
+    assert writer._put(('event',)) is False
+    assert set(writer._queue.queue) == set(markers)
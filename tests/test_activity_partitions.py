@@ -0,0 +1,44 @@
+from datetime import datetime
+
+from activity_partitions import add_months
+
+
+def _backdate(db, month, count):
+    """Move ``count`` of the activities written this month into ``month``"""
+    current = datetime.now().strftime('%Y-%m')
+    with db.pool.connection() as conn:
+        ids = [row[0] for row in conn.execute(
+            "SELECT id FROM user_activity WHERE activity_timestamp >= ? LIMIT ?", (current, count)
+        )]
+        conn.executemany(
+            "UPDATE user_activity SET activity_timestamp = ? WHERE id = ?",
+            [(f"{month}-10T12:00:00", activity_id) for activity_id in ids]
+        )
+        conn.commit()
+
+
+def test_late_rows_in_an_archived_month_do_not_block_later_months(db, tmp_path):
+    partitions = db.partitions
+    partitions.directory = str(tmp_path / "partitions")
+    current = datetime.now().strftime('%Y-%m')
+    archived_month, later_month = add_months(current, -30), add_months(current, -12)
+
+    for i in range(5):
+        db.activity.submit(f"user{i}", 'generate', f"prompt {i}")
+    assert db.activity.flush()
+    _backdate(db, archived_month, 2)
+    _backdate(db, later_month, 3)
+    with db.pool.connection() as conn:
+        # A late row for a month that has already gone to Parquet
+        conn.execute(
+            "INSERT INTO activity_partitions (month, state, path) VALUES (?, 'archived', 'archive.parquet')",
+            (archived_month,)
+        )
+        conn.commit()
+
+    assert partitions.seal_expired() == [later_month]
+
+    with db.pool.connection() as conn:
+        months = {row[0][:7] for row in conn.execute("SELECT activity_timestamp FROM user_activity")}
+    assert archived_month in months
+    assert later_month not in months
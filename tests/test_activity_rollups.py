@@ -0,0 +1,125 @@
+import os
+import sys
+import sqlite3
+import datetime
+
+import pytest
+
+# Appended, so the login server's server.py does not shadow the main one
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'script', 'login_server'))
+
+from activity_rollups import ActivityRecorder, get_stats, install, rebuild
+
+_USER_ACTIVITY = '''
+CREATE TABLE user_activity (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    activity_type TEXT NOT NULL,
+    prompt TEXT,
+    payload TEXT,
+    result TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+)
+'''
+
+
+@pytest.fixture
+def users_db(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'users.db'))
+    conn.execute(_USER_ACTIVITY)
+    yield conn
+    conn.close()
+
+
+def _add(db, username, activity_type, created_at):
+    cursor = db.execute("INSERT INTO user_activity (username, activity_type, created_at) VALUES (?, ?, ?)",
+                        (username, activity_type, created_at))
+    db.commit()
+    return cursor.lastrowid
+
+
+def _counters(db):
+    daily = {row[:3]: row[3] for row in db.execute("SELECT username, day, activity_type, count FROM user_activity_daily")}
+    totals = {row[:2]: row[2] for row in db.execute("SELECT username, activity_type, count FROM user_activity_totals")}
+    return daily, totals
+
+
+def test_install_backfills_existing_rows(users_db):
+    _add(users_db, 'ann', 'login', '2026-03-01 08:00:00')
+    _add(users_db, 'ann', 'login', '2026-03-02 08:00:00')
+    _add(users_db, 'ann', 'generate', '2026-03-02 09:00:00')
+
+    assert install(users_db)
+    assert not install(users_db)
+
+    daily, totals = _counters(users_db)
+    assert daily == {('ann', '2026-03-01', 'login'): 1, ('ann', '2026-03-02', 'login'): 1,
+                     ('ann', '2026-03-02', 'generate'): 1}
+    assert totals == {('ann', 'login'): 2, ('ann', 'generate'): 1}
+
+
+def test_triggers_track_inserts_updates_and_deletes(users_db):
+    install(users_db)
+    first = _add(users_db, 'ann', 'login', '2026-03-01 08:00:00')
+    second = _add(users_db, 'ann', 'login', '2026-03-01 09:00:00')
+    assert _counters(users_db) == ({('ann', '2026-03-01', 'login'): 2}, {('ann', 'login'): 2})
+
+    users_db.execute("UPDATE user_activity SET activity_type = 'generate', created_at = '2026-03-02 10:00:00' WHERE id = ?",
+                     (second,))
+    users_db.commit()
+    assert _counters(users_db) == (
+        {('ann', '2026-03-01', 'login'): 1, ('ann', '2026-03-02', 'generate'): 1},
+        {('ann', 'login'): 1, ('ann', 'generate'): 1},
+    )
+
+    users_db.execute("DELETE FROM user_activity WHERE id = ?", (first,))
+    users_db.commit()
+    # Counters that reach zero are removed rather than kept at 0
+    assert _counters(users_db) == ({('ann', '2026-03-02', 'generate'): 1}, {('ann', 'generate'): 1})
+
+    assert rebuild(users_db) == 1
+    assert _counters(users_db) == ({('ann', '2026-03-02', 'generate'): 1}, {('ann', 'generate'): 1})
+
+
+def test_stats_fill_days_without_activity(users_db):
+    install(users_db)
+    _add(users_db, 'ann', 'login', '2026-03-01 08:00:00')
+    _add(users_db, 'ann', 'login', '2026-03-03 08:00:00')
+    _add(users_db, 'ann', 'generate', '2026-03-03 09:00:00')
+    _add(users_db, 'bob', 'login', '2026-03-03 09:00:00')
+
+    stats = get_stats(users_db, 'ann', days=4, today=datetime.date(2026, 3, 4))
+
+    assert stats['login_count'] == 2
+    assert stats['total_actions'] == 3
+    assert stats['activity_by_type'] == [{'type': 'login', 'count': 2}, {'type': 'generate', 'count': 1}]
+    assert stats['daily'] == [
+        {'date': '2026-03-01', 'total': 1, 'by_type': {'login': 1}},
+        {'date': '2026-03-02', 'total': 0, 'by_type': {}},
+        {'date': '2026-03-03', 'total': 2, 'by_type': {'login': 1, 'generate': 1}},
+        {'date': '2026-03-04', 'total': 0, 'by_type': {}},
+    ]
+
+
+def test_recorder_writes_through_the_triggers(users_db, tmp_path):
+    install(users_db)
+    path = str(tmp_path / 'users.db')
+    recorder = ActivityRecorder(lambda: sqlite3.connect(path, check_same_thread=False), flush_interval=0.01)
+    for _ in range(3):
+        assert recorder.record('ann', 'login')
+    assert recorder.flush()
+
+    assert recorder.stats()['written'] == 3
+    assert get_stats(users_db, 'ann', days=1)['login_count'] == 3
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_flush_returns_when_the_writer_thread_died(tmp_path):
+    def connect():
+        raise sqlite3.OperationalError('unable to open database file')
+
+    recorder = ActivityRecorder(connect)
+    recorder.record('ann', 'login')
+    recorder._thread.join(5)
+
+    assert recorder.flush(timeout=1) is False
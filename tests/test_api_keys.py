@@ -0,0 +1,27 @@
+import pytest
+
+
+def test_bulk_keys_for_unknown_users_are_rejected_before_any_are_created(db):
+    user_id = db.create_user('bob', 'Secret-pass1', 'bob@example.com')
+
+    with pytest.raises(ValueError, match='no-such-user'):
+        db.create_api_keys([user_id, 'no-such-user'])
+
+    with db.pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM api_keys").fetchone()[0] == 0
+
+    keys = db.create_api_keys([user_id], count=2)
+    assert [key['user_id'] for key in keys] == [user_id, user_id]
+
+
+def test_deleting_a_user_revokes_their_cached_keys(db):
+    user_id = db.create_user('carol', 'Secret-pass1', 'carol@example.com')
+    key = db.create_api_key(user_id)
+    assert db.api_key_auth.authenticate(key['api_key'], key['api_secret'])
+
+    assert db.delete_user(user_id)
+
+    assert db.api_key_auth.authenticate(key['api_key'], key['api_secret']) is None
+    with db.pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM api_role_permissions WHERE api_key_id = ?",
+                            (key['id'],)).fetchone()[0] == 0
@@ -0,0 +1,117 @@
+import os
+import sys
+import json
+import sqlite3
+
+import pytest
+
+from save_db import BackupEngine, BackupError
+
+# Appended, so the login server's server.py does not shadow the main one
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'script', 'login_server'))
+from db_backup_service import DbBackupService
+
+
+def _engine(db_path, tmp_path, **options):
+    options.setdefault('codec', 'gzip')
+    return BackupEngine(db_path, str(tmp_path / "backups"), step_sleep=0, **options)
+
+
+def _names(path):
+    conn = sqlite3.connect(path)
+    try:
+        return [row[0] for row in conn.execute(
+            "SELECT name FROM id_sequences WHERE name IN ('before', 'in_wal', 'after') ORDER BY name"
+        )]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('codec', ['none', 'gzip'])
+def test_backup_verify_and_restore_round_trip(db_path, tmp_path, codec):
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO id_sequences (name, next_value) VALUES ('before', 1)")
+    conn.commit()
+    # Written to the WAL only, so the backup must include it
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("INSERT INTO id_sequences (name, next_value) VALUES ('in_wal', 1)")
+    conn.commit()
+
+    engine = _engine(db_path, tmp_path, codec=codec, pages_per_step=1)
+    manifest = engine.backup()
+    conn.execute("INSERT INTO id_sequences (name, next_value) VALUES ('after', 1)")
+    conn.commit()
+    conn.close()
+
+    path = engine.list_backups()[0]['path']
+    assert manifest['codec'] == codec
+    assert engine.verify_backup(path)
+
+    target = str(tmp_path / "restored.db")
+    engine.restore(path, target)
+    assert _names(target) == ['before', 'in_wal']
+    assert engine.stats()['backups'] == 1
+
+
+def test_corrupted_backup_is_not_restored(db_path, tmp_path):
+    engine = _engine(db_path, tmp_path)
+    engine.backup()
+    path = engine.list_backups()[0]['path']
+    with open(path, 'r+b') as f:
+        f.seek(20)
+        f.write(b'corrupt')
+
+    assert not engine.verify_backup(path)
+    target = str(tmp_path / "restored.db")
+    with pytest.raises(BackupError):
+        engine.restore(path, target)
+    assert not os.path.exists(target)
+
+
+def test_retention_keeps_the_newest_backups(db_path, tmp_path):
+    engine = _engine(db_path, tmp_path, keep_last=2, keep_daily=0, keep_weekly=0)
+    files = [engine.backup()['file'] for _ in range(4)]
+
+    assert [backup['file'] for backup in engine.list_backups()] == files[:1:-1]
+    assert sorted(os.listdir(engine.backup_dir)) == sorted(
+        files[2:] + [name.split('.')[0] + '.manifest.json' for name in files[2:]]
+    )
+
+
+def test_unrelated_json_in_the_backup_directory_is_ignored(db_path, tmp_path):
+    engine = _engine(db_path, tmp_path)
+    os.makedirs(engine.backup_dir)
+    with open(os.path.join(engine.backup_dir, "notes.json"), "w") as f:
+        json.dump({'note': 'not a manifest'}, f)
+    with open(os.path.join(engine.backup_dir, "stray.manifest.json"), "w") as f:
+        json.dump(['not', 'a', 'dict'], f)
+
+    manifest = engine.backup()
+
+    assert [backup['file'] for backup in engine.list_backups()] == [manifest['file']]
+    assert os.path.exists(os.path.join(engine.backup_dir, "notes.json"))
+
+
+def test_scheduled_backups_survive_unexpected_errors(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    class FailingEngine:
+        calls = 0
+
+        def backup(self):
+            FailingEngine.calls += 1
+            raise KeyError('file')
+
+    service = DbBackupService(backup_interval=0.01, engine=FailingEngine())
+    assert service.backup_now() is None
+
+    service.start()
+    try:
+        for _ in range(200):
+            if FailingEngine.calls >= 4:
+                break
+            service._stop.wait(0.01)
+        assert service.thread.is_alive()
+    finally:
+        service.stop()
+    assert FailingEngine.calls >= 4
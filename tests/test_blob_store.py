@@ -0,0 +1,68 @@
+from blob_store import BlobStore, content_hash
+
+LONG_TEXT = "a generated response that repeats itself " * 20
+
+
+def _refcounts(pool):
+    with pool.connection() as conn:
+        return {bytes(digest): refcount for digest, refcount in conn.execute("SELECT hash, refcount FROM content_blobs")}
+
+
+def _respond(conn, response_id, digest):
+    conn.execute(
+        "INSERT INTO activity_responses (id, activity_detail_id, response, response_hash) VALUES (?, 'detail', '', ?)",
+        (response_id, digest)
+    )
+
+
+def test_texts_round_trip_compressed_or_raw(pool):
+    blobs = BlobStore(pool, codec='zlib')
+    long_row = blobs.encode(LONG_TEXT)
+    short_row = blobs.encode("short")
+
+    assert long_row[0] == content_hash(LONG_TEXT.encode())
+    assert long_row[1] == 'zlib' and long_row[4] < long_row[3]
+    assert short_row[1] == 'raw'
+    assert blobs.encode(LONG_TEXT, compress=False)[1] == 'raw'
+
+    with pool.connection() as conn:
+        blobs.store(conn, [long_row, short_row])
+        conn.commit()
+    assert blobs.get_many([long_row[0], short_row[0], None]) == {long_row[0]: LONG_TEXT, short_row[0]: "short"}
+
+
+def test_refcounts_follow_the_referencing_rows(pool):
+    blobs = BlobStore(pool, codec='zlib')
+    first, second = blobs.encode(LONG_TEXT), blobs.encode("another response")
+
+    with pool.connection() as conn:
+        # Storing the same text twice keeps one blob
+        blobs.store(conn, [first, first, second])
+        _respond(conn, 'r1', first[0])
+        _respond(conn, 'r2', first[0])
+        conn.commit()
+    assert _refcounts(pool) == {first[0]: 2, second[0]: 0}
+
+    with pool.connection() as conn:
+        conn.execute("UPDATE activity_responses SET response_hash = ? WHERE id = 'r2'", (second[0],))
+        conn.commit()
+    assert _refcounts(pool) == {first[0]: 1, second[0]: 1}
+
+    with pool.connection() as conn:
+        conn.execute("DELETE FROM activity_responses WHERE id = 'r1'")
+        conn.commit()
+    assert _refcounts(pool) == {first[0]: 0, second[0]: 1}
+
+
+def test_gc_removes_only_unreferenced_blobs(pool):
+    blobs = BlobStore(pool, codec='zlib')
+    rows = [blobs.encode(f"response number {i}") for i in range(5)]
+    with pool.connection() as conn:
+        blobs.store(conn, rows)
+        _respond(conn, 'kept', rows[0][0])
+        conn.commit()
+
+    assert blobs.gc(batch_size=2) == 4
+
+    assert list(_refcounts(pool)) == [rows[0][0]]
+    assert blobs.get(rows[0][0]) == "response number 0"
@@ -0,0 +1,30 @@
+import sqlite3
+
+import pytest
+
+
+def test_failing_nested_block_keeps_the_outer_transaction(pool):
+    with pool.connection() as conn:
+        conn.execute("INSERT INTO id_sequences (name, next_value) VALUES ('outer', 1)")
+        with pytest.raises(sqlite3.IntegrityError):
+            with pool.connection() as nested:
+                nested.execute("INSERT INTO id_sequences (name, next_value) VALUES ('inner', 1)")
+                nested.execute("INSERT INTO id_sequences (name, next_value) VALUES ('outer', 2)")
+        assert conn.in_transaction
+        conn.commit()
+
+    with pool.connection() as conn:
+        names = {row[0] for row in conn.execute("SELECT name FROM id_sequences")}
+    assert 'outer' in names
+    assert 'inner' not in names
+
+
+def test_outermost_block_rolls_back_on_error(pool):
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            with pool.connection() as nested:
+                nested.execute("INSERT INTO id_sequences (name, next_value) VALUES ('gone', 1)")
+            raise RuntimeError()
+
+    with pool.connection() as conn:
+        assert conn.execute("SELECT 1 FROM id_sequences WHERE name = 'gone'").fetchone() is None
@@ -0,0 +1,74 @@
+import os
+import base64
+import sqlite3
+import stat
+
+import pytest
+from cryptography.fernet import Fernet, InvalidToken
+
+from encryption_keys import Keyring, _derive_key, reencrypt_api_secrets
+
+SECRET = b'0' * 32
+PASSPHRASE = b'legacy passphrase'
+
+
+@pytest.fixture
+def keyring_file(tmp_path):
+    return str(tmp_path / 'keyring.json')
+
+
+def test_legacy_ciphertexts_stay_readable(keyring_file):
+    keyring = Keyring(SECRET, keyring_file=keyring_file, legacy_passphrase=PASSPHRASE)
+
+    # Bare Fernet token under the key derived from secret.key
+    bare = Fernet(_derive_key(SECRET, Keyring.LEGACY_SALT)).encrypt(b'bare').decode()
+    assert keyring.decrypt(bare) == 'bare'
+
+    # base64(salt + token) under a per-ciphertext salt
+    salt = os.urandom(16)
+    token = Fernet(_derive_key(PASSPHRASE, salt)).encrypt(b'salted')
+    salted = base64.urlsafe_b64encode(salt + token).decode()
+    assert keyring.decrypt(salted) == 'salted'
+
+    assert not keyring.is_current(bare)
+    assert keyring.encrypt('new').startswith('v1:')
+
+
+def test_rotate_keeps_old_versions_and_persists_the_new_key(keyring_file):
+    keyring = Keyring(SECRET, keyring_file=keyring_file)
+    old = keyring.encrypt('secret')
+
+    assert keyring.rotate() == 2
+    new = keyring.encrypt('secret')
+    assert new.startswith('v2:')
+    assert keyring.decrypt(old) == 'secret'
+    assert stat.S_IMODE(os.stat(keyring_file).st_mode) == 0o600
+
+    reloaded = Keyring(SECRET, keyring_file=keyring_file)
+    assert reloaded.versions == [1, 2]
+    assert reloaded.primary == 2
+    assert reloaded.decrypt(new) == 'secret'
+    with pytest.raises(InvalidToken):
+        reloaded.decrypt('v3:' + new[3:])
+
+
+def test_reencrypt_moves_secrets_to_the_primary_key(db_path, keyring_file):
+    keyring = Keyring(SECRET, keyring_file=keyring_file)
+    conn = sqlite3.connect(db_path)
+    try:
+        secrets = [keyring.encrypt(f'secret {i}') for i in range(3)] + ['not a ciphertext']
+        conn.executemany(
+            "INSERT INTO api_keys (id, user_id, api_key, api_secret, api_id, created_at) VALUES (?, 'u', ?, ?, ?, '')",
+            [(str(i), f'key {i}', secret, str(i)) for i, secret in enumerate(secrets)]
+        )
+        conn.commit()
+        keyring.rotate()
+
+        counts = reencrypt_api_secrets(conn, keyring, batch_size=2, pause=0)
+
+        assert counts == {'scanned': 4, 'reencrypted': 3, 'skipped': 1}
+        stored = [row[0] for row in conn.execute("SELECT api_secret FROM api_keys ORDER BY rowid")]
+    finally:
+        conn.close()
+    assert [keyring.decrypt(secret) for secret in stored[:3]] == ['secret 0', 'secret 1', 'secret 2']
+    assert all(keyring.is_current(secret) for secret in stored[:3])
@@ -0,0 +1,36 @@
+import sqlite3
+
+import migrations
+from migrations import MIGRATIONS, apply_migrations, check_query_plans, get_schema_version, pending_migrations
+
+
+def test_fresh_database_uses_an_index_for_every_hot_query(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        assert check_query_plans(conn) == {}
+    finally:
+        conn.close()
+
+
+def test_migrations_apply_once(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        assert get_schema_version(conn) == MIGRATIONS[-1][0]
+        assert pending_migrations(conn) == []
+        assert apply_migrations(conn) == []
+    finally:
+        conn.close()
+
+
+def test_table_scans_are_reported(db_path, monkeypatch):
+    monkeypatch.setattr(migrations, 'HOT_QUERIES', {
+        'unindexed': ("SELECT id FROM users WHERE bio = ?", ('x',)),
+        'unreferenced_blobs': ("SELECT hash FROM content_blobs WHERE refcount <= 0 LIMIT ?", (500,)),
+    })
+    conn = sqlite3.connect(db_path)
+    try:
+        problems = check_query_plans(conn)
+    finally:
+        conn.close()
+    assert list(problems) == ['unindexed']
+    assert problems['unindexed'][0].startswith('SCAN users')
@@ -0,0 +1,47 @@
+import json
+
+import bcrypt
+
+import password_policy
+from password_policy import PasswordPolicy, bcrypt_cost
+
+
+def _hash(rounds):
+    return bcrypt.hashpw(b'Secret-pass1', bcrypt.gensalt(rounds)).decode()
+
+
+def test_needs_rehash_outside_the_policy_cost(tmp_path):
+    policy = PasswordPolicy(policy_file=str(tmp_path / 'missing.json'), rounds=10, max_rounds=12)
+
+    assert not policy.needs_rehash(_hash(10))
+    assert not policy.needs_rehash(_hash(12))
+    assert policy.needs_rehash(_hash(4))
+    assert policy.needs_rehash('$2b$13$' + 'x' * 53)
+    assert policy.needs_rehash('pbkdf2:sha256$not-bcrypt')
+    assert policy.needs_rehash(None)
+
+
+def test_calibrated_cost_is_clamped_to_the_allowed_range(tmp_path):
+    policy_file = tmp_path / 'password_policy.json'
+    policy_file.write_text(json.dumps({'rounds': 31, 'target_ms': 250}))
+
+    policy = PasswordPolicy(policy_file=str(policy_file), min_rounds=10, max_rounds=14)
+
+    assert policy.rounds == 14
+    assert policy.target_ms == 250
+
+
+def test_login_upgrades_an_out_of_policy_hash(db, monkeypatch):
+    monkeypatch.setattr(password_policy.password_policy, 'rounds', 5)
+    user_id = db.create_user('alice', 'Secret-pass1', 'alice@example.com')
+    weak = _hash(4)
+    with db.pool.connection() as conn:
+        conn.execute("UPDATE users SET password = ? WHERE id = ?", (weak, user_id))
+        conn.commit()
+
+    assert db.authenticate_user('alice', 'Secret-pass1') == user_id
+
+    upgraded = db.get_password_hash(user_id)
+    assert bcrypt_cost(upgraded) == 5
+    assert db.authenticate_user('alice', 'Secret-pass1') == user_id
+    assert db.get_password_hash(user_id) == upgraded
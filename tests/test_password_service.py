@@ -0,0 +1,46 @@
+import sys
+import types
+
+import pytest
+
+import database
+from password_service import PasswordHasher, PasswordServiceBusy
+
+
+def test_saturated_hasher_rejects_without_queuing():
+    hasher = PasswordHasher(max_workers=1, max_pending=1)
+    hasher._slots.acquire()  # the one slot is taken by a call in flight
+
+    with pytest.raises(PasswordServiceBusy) as raised:
+        hasher.verify('password', '$2b$12$' + 'x' * 53)
+
+    assert raised.value.retry_after >= 1
+    assert hasher.stats()['rejected'] == 1
+    assert hasher._executor is None
+
+
+@pytest.fixture
+def server(db, monkeypatch):
+    # The password recovery mailer lives outside this repository
+    email_handler = types.ModuleType('email_handler.email_handler')
+    email_handler.EmailHandler = type('EmailHandler', (), {})
+    monkeypatch.setitem(sys.modules, 'email_handler', types.ModuleType('email_handler'))
+    monkeypatch.setitem(sys.modules, 'email_handler.email_handler', email_handler)
+    monkeypatch.setattr(database, '_db', db)
+
+    import server
+    monkeypatch.setattr(server.app, 'extensions', {})
+    server.create_app()
+    yield server
+    db.sessions.stop_sweeper()
+
+
+def test_busy_password_service_answers_503_with_retry_after(server, monkeypatch):
+    def login_user(username, password):
+        raise PasswordServiceBusy("Password service is busy", retry_after=7)
+    monkeypatch.setattr(server.auth_handler, 'login_user', login_user)
+
+    response = server.app.test_client().post('/login', data={'username': 'alice', 'password': 'Secret-pass1'})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '7'
@@ -0,0 +1,116 @@
+import json
+import sqlite3
+
+import pytest
+
+from role_hierarchy import RoleHierarchyError, set_role_parents
+
+
+@pytest.fixture
+def conn(db_path):
+    conn = sqlite3.connect(db_path)
+    yield conn
+    conn.close()
+
+
+def _effective(conn, user_id):
+    return {row[0] for row in conn.execute(
+        "SELECT permission FROM user_effective_permissions WHERE user_id = ?", (user_id,)
+    )}
+
+
+def _add_role(conn, role_name, permissions):
+    conn.execute(
+        "INSERT INTO roles (role_id, role_name, permissions, created_at, updated_at) VALUES (?, ?, ?, '', '')",
+        (role_name, role_name, json.dumps(permissions))
+    )
+
+
+def test_user_role_changes_refresh_effective_permissions(conn):
+    _add_role(conn, 'writer', {'write': True, 'publish': False, 'quota': 3, 'notes': ''})
+    conn.execute("INSERT INTO user_roles (id, user_id, role) VALUES ('r1', 'u1', 'Writer')")
+    # Only truthy values grant, and role names match case-insensitively
+    assert _effective(conn, 'u1') == {'write', 'quota'}
+
+    conn.execute("UPDATE user_roles SET role = 'basic_user' WHERE id = 'r1'")
+    assert _effective(conn, 'u1') == {'prompting'}
+
+    conn.execute("DELETE FROM user_roles WHERE id = 'r1'")
+    assert _effective(conn, 'u1') == set()
+
+
+def test_role_changes_refresh_every_holder(conn):
+    _add_role(conn, 'editor', {'edit': True})
+    conn.executemany("INSERT INTO user_roles (id, user_id, role) VALUES (?, ?, 'editor')",
+                     [('r1', 'u1'), ('r2', 'u2')])
+
+    conn.execute("UPDATE roles SET permissions = ? WHERE role_name = 'editor'", (json.dumps({'review': 1}),))
+    assert _effective(conn, 'u1') == _effective(conn, 'u2') == {'review'}
+
+    # Malformed JSON grants nothing instead of failing the write
+    conn.execute("UPDATE roles SET permissions = 'not json' WHERE role_name = 'editor'")
+    assert _effective(conn, 'u1') == set()
+
+    conn.execute("UPDATE roles SET permissions = ? WHERE role_name = 'editor'", (json.dumps({'edit': True}),))
+    conn.execute("DELETE FROM roles WHERE role_name = 'editor'")
+    assert _effective(conn, 'u1') == _effective(conn, 'u2') == set()
+
+
+def test_database_reads_the_materialized_permissions(db):
+    user_id = db.create_user('alice', 'Secret-pass1', 'alice@example.com', roles=[{'role': 'social_media_handler'}])
+
+    assert db.has_permission(user_id, 'social_media')
+    assert not db.has_permission(user_id, 'manage_users')
+    assert user_id in db.get_users_with_permission('social_media')
+
+
+def _closure(conn, role_name):
+    return dict(conn.execute(
+        "SELECT ancestor, depth FROM role_closure WHERE descendant = ?", (role_name,)
+    ).fetchall())
+
+
+def test_closure_follows_parent_changes_and_renames(conn):
+    _add_role(conn, 'reader', {'read': True})
+    _add_role(conn, 'writer', {'write': True})
+    _add_role(conn, 'editor', {'edit': True})
+    conn.execute("INSERT INTO user_roles (id, user_id, role) VALUES ('r1', 'u1', 'editor')")
+
+    set_role_parents(conn, 'writer', ['reader'])
+    set_role_parents(conn, 'editor', ['writer'])
+    assert _closure(conn, 'editor') == {'editor': 0, 'writer': 1, 'reader': 2}
+    assert _effective(conn, 'u1') == {'edit', 'write', 'read'}
+
+    # Changing a grandparent's permissions reaches every descendant's holders
+    conn.execute("UPDATE roles SET permissions = ? WHERE role_name = 'reader'", (json.dumps({'browse': True}),))
+    assert _effective(conn, 'u1') == {'edit', 'write', 'browse'}
+
+    conn.execute("UPDATE roles SET role_name = 'author' WHERE role_name = 'writer'")
+    assert _closure(conn, 'editor') == {'editor': 0, 'author': 1, 'reader': 2}
+
+    set_role_parents(conn, 'editor', [])
+    assert _closure(conn, 'editor') == {'editor': 0}
+    assert _effective(conn, 'u1') == {'edit'}
+
+
+def test_cycles_and_unknown_parents_are_rejected(conn):
+    _add_role(conn, 'reader', {'read': True})
+    _add_role(conn, 'writer', {'write': True})
+    set_role_parents(conn, 'writer', ['reader'])
+
+    with pytest.raises(RoleHierarchyError):
+        set_role_parents(conn, 'reader', ['writer'])
+    with pytest.raises(RoleHierarchyError):
+        set_role_parents(conn, 'reader', ['reader'])
+    with pytest.raises(RoleHierarchyError):
+        set_role_parents(conn, 'writer', ['no-such-role'])
+    assert _closure(conn, 'reader') == {'reader': 0}
+
+
+def test_role_inherits_through_database(db):
+    assert db.create_role('auditor', {'audit': True}, inherits=['basic_user'])
+    user_id = db.create_user('bob', 'Secret-pass1', 'bob@example.com', roles=[{'role': 'auditor'}])
+
+    assert db.get_role_inheritance('auditor') == {'parents': ['basic_user'], 'ancestors': {'basic_user': 1}}
+    assert db.has_permission(user_id, 'audit')
+    assert db.has_permission(user_id, 'prompting')
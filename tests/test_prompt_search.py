@@ -0,0 +1,70 @@
+import pytest
+
+from prompt_search import build_match_query
+
+
+def _log(db, prompts):
+    ids = [db.log_user_activity(user_id, 'generate', prompt, f"response to {prompt}") for user_id, prompt in prompts]
+    assert db.activity.flush()
+    return ids
+
+
+def _page_through(db, **options):
+    items, cursor = [], None
+    while True:
+        page = db.get_prompt_history(limit=2, cursor=cursor, **options)
+        items += page['items']
+        cursor = page['next_cursor']
+        if cursor is None:
+            return items
+
+
+def test_match_query_quotes_every_term():
+    assert build_match_query('red "cat" OR dog*') == '"red" "cat" "OR" "dog"*'
+    assert build_match_query('cat', prefix=False) == '"cat"'
+    assert build_match_query('*** ""') is None
+
+
+def test_history_pages_newest_first(db):
+    _log(db, [('u1', f'prompt {i}') for i in range(5)] + [('u2', 'someone else')])
+
+    items = _page_through(db, user_id='u1')
+
+    assert [item['prompt'] for item in items] == [f'prompt {i}' for i in reversed(range(5))]
+    assert items[0]['responses'] == ['response to prompt 4']
+    assert items[0]['payload'] == 'response to prompt 4'
+
+
+def test_search_pages_by_relevance_without_repeats(db):
+    _log(db, [
+        ('u1', 'a castle on a hill'),
+        ('u1', 'castle castle castle'),
+        ('u1', 'a cat <b>sleeping</b> in a castle'),
+        ('u1', 'nothing relevant'),
+        ('u2', 'castle for another user'),
+    ])
+
+    items = _page_through(db, user_id='u1', query='castle')
+
+    assert len(items) == 3
+    assert items[0]['prompt'] == 'castle castle castle'
+    scores = [item['score'] for item in items]
+    assert scores == sorted(scores, reverse=True)
+    cat = next(item for item in items if 'cat' in item['prompt'])
+    assert '<mark>castle</mark>' in cat['snippet']
+    assert '&lt;b&gt;' in cat['snippet']
+
+    recent = _page_through(db, query='cas', sort='recent')
+    assert [item['prompt'] for item in recent] == [
+        'castle for another user', 'a cat <b>sleeping</b> in a castle', 'castle castle castle', 'a castle on a hill',
+    ]
+
+
+def test_cursors_are_tied_to_their_sort(db):
+    _log(db, [('u1', 'castle one'), ('u1', 'castle two')])
+    cursor = db.get_prompt_history(query='castle', limit=1)['next_cursor']
+
+    with pytest.raises(ValueError):
+        db.get_prompt_history(query='castle', limit=1, cursor=cursor, sort='recent')
+    with pytest.raises(ValueError):
+        db.get_prompt_history(limit=1, sort='relevance')
@@ -0,0 +1,38 @@
+import time
+
+import pytest
+
+from flask import Flask
+
+from rate_limit import RateLimiter, GCRALimiter, SlidingWindowLimiter, api_key
+
+
+def test_limiter_missing_an_override_fails_at_construction(pool):
+    class Incomplete(RateLimiter):
+        def _hit(self, key, now):
+            return True, 0.0
+
+    with pytest.raises(TypeError):
+        Incomplete(pool, 'incomplete', limit=1, period=60)
+
+
+@pytest.mark.parametrize('limiter_class', [GCRALimiter, SlidingWindowLimiter])
+def test_hit_inside_a_transaction_leaves_it_to_the_caller(pool, limiter_class):
+    limiter = limiter_class(pool, 'nested', limit=5, period=60)
+    with pool.connection() as conn:
+        conn.execute("INSERT INTO rate_limits (limiter, key, tat) VALUES ('outer', 'k', ?)", (time.time() + 60,))
+        assert limiter.hit('client')[0]
+        assert conn.in_transaction
+        conn.rollback()
+
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM rate_limits WHERE limiter = 'outer'").fetchone()[0] == 0
+
+
+@pytest.mark.parametrize('headers', [
+    {'X-API-Key': 'abc123', 'X-API-Secret': 's3cret'},
+    {'Authorization': 'Bearer abc123.s3cret'},
+])
+def test_api_key_rule_reads_both_credential_forms(headers):
+    with Flask(__name__).test_request_context(headers=headers):
+        assert api_key() == 'api_key:abc123'
@@ -0,0 +1,49 @@
+import time
+
+from revocation import RevocationList
+from signed_sessions import SignedSessionTokens
+
+
+def test_revocation_after_purging_the_newest_row_reaches_other_workers(pool):
+    worker = RevocationList(pool, sync_interval=0, purge_interval=3600)
+    other = RevocationList(pool, sync_interval=0, purge_interval=3600)
+
+    assert worker.revoke("live-token", time.time() + 3600)
+    # The newest row has already expired, so the purge deletes the highest id
+    assert worker.revoke("expired-token", time.time() - 1)
+    assert other.is_revoked("live-token")
+
+    with worker._lock:
+        worker._purge_and_rebuild()
+    assert worker.revoke("logged-out-token", time.time() + 3600)
+
+    assert other.is_revoked("logged-out-token")
+
+
+def test_bumping_the_epoch_revokes_signed_tokens_in_every_worker(pool):
+    worker = SignedSessionTokens(pool, b'k' * 32, sync_interval=0)
+    other = SignedSessionTokens(pool, b'k' * 32, sync_interval=0)
+    expires = time.time() + 3600
+
+    old = worker.issue('user-1', expires)
+    unrelated = worker.issue('user-2', expires)
+    assert other.verify(old) == 'user-1'
+
+    assert worker.revoke_user('user-1') == 1
+    assert other.verify(old) is None
+    assert other.verify(unrelated) == 'user-2'
+
+    # Tokens issued after the bump carry the new epoch
+    new = other.issue('user-1', expires)
+    assert worker.decode(new)['epoch'] == 1
+    assert worker.verify(new) == 'user-1'
+
+
+def test_forged_and_expired_signed_tokens_are_rejected(pool):
+    tokens = SignedSessionTokens(pool, b'k' * 32, sync_interval=0)
+    token = tokens.issue('user-1', time.time() + 3600)
+    payload, _, signature = token.rpartition('.')
+
+    assert tokens.verify(payload.replace('user-1', 'user-2') + '.' + signature) is None
+    assert SignedSessionTokens(pool, b'x' * 32).verify(token) is None
+    assert tokens.verify(tokens.issue('user-1', time.time() - 1)) is None
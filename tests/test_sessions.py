@@ -0,0 +1,133 @@
+import time
+
+import pytest
+from flask import Flask, session
+
+from server_session import ServerSessionInterface
+from session_store import SessionStore, hash_token
+
+
+def test_tokens_are_stored_hashed_and_validated(pool):
+    store = SessionStore(pool)
+    assert store.create('user-1', 'token-a', time.time() + 60)
+
+    with pool.connection() as conn:
+        stored = [row[0] for row in conn.execute("SELECT token_hash FROM sessions")]
+    assert stored == [hash_token('token-a')]
+
+    assert store.validate('token-a') == 'user-1'
+    assert store.validate('token-b') is None
+
+
+def test_repeat_validations_are_served_from_the_lru(pool):
+    store = SessionStore(pool, lru_size=2)
+    for token in ('token-a', 'token-b', 'token-c'):
+        store.create('user-1', token, time.time() + 60)
+        store.validate(token)
+    # token-a was the least recently used and has been evicted
+    assert store.stats()['lru_size'] == 2
+
+    with pool.connection() as conn:
+        conn.execute("DELETE FROM sessions")
+        conn.commit()
+    assert store.validate('token-c') == 'user-1'
+    assert store.validate('token-a') is None
+    assert store.stats()['lru_hits'] == 1
+
+
+def test_revoke_evicts_the_cached_token(pool):
+    store = SessionStore(pool)
+    store.create('user-1', 'token-a', time.time() + 60)
+    store.create('user-1', 'token-b', time.time() + 60)
+    store.validate('token-a')
+    store.validate('token-b')
+
+    assert store.revoke('token-a')
+    assert store.validate('token-a') is None
+    assert store.revoke_user_sessions('user-1') == 1
+    assert store.validate('token-b') is None
+
+
+def test_sweep_deletes_only_expired_sessions_in_batches(pool):
+    store = SessionStore(pool, sweep_batch_size=2)
+    now = time.time()
+    for i in range(5):
+        store.create('user-1', f'expired-{i}', now - 1)
+    store.create('user-1', 'live', now + 60)
+
+    assert store.sweep(pause=0) == 5
+
+    stats = store.stats()
+    assert stats['table_size'] == 1
+    assert stats['sweeps'] == 1
+    assert stats['swept_rows'] == 5
+    assert store.validate('live') == 'user-1'
+
+
+@pytest.fixture
+def app(db):
+    app = Flask(__name__)
+    app.session_interface = ServerSessionInterface(lambda: db)
+
+    @app.route('/login/<user_id>')
+    def login(user_id):
+        session.regenerate()
+        session['user_id'] = user_id
+        return ''
+
+    @app.route('/whoami')
+    def whoami():
+        return session.get('user_id') or ''
+
+    @app.route('/logout')
+    def logout():
+        session.clear()
+        return ''
+
+    return app
+
+
+def _session_ids(db):
+    with db.pool.connection() as conn:
+        return [row[0] for row in conn.execute("SELECT id FROM web_sessions")]
+
+
+def test_server_session_keeps_only_a_hashed_id(app, db):
+    client = app.test_client()
+    client.get('/login/user-1')
+    sid = client.get_cookie('session').value
+
+    assert _session_ids(db) == [hash_token(sid)]
+    assert client.get('/whoami').text == 'user-1'
+
+
+def test_login_moves_the_session_to_a_fresh_id(app, db):
+    client = app.test_client()
+    client.get('/login/user-1')
+    first = client.get_cookie('session').value
+
+    client.get('/login/user-2')
+    second = client.get_cookie('session').value
+
+    assert second != first
+    assert _session_ids(db) == [hash_token(second)]
+    assert client.get('/whoami').text == 'user-2'
+
+
+def test_logout_deletes_the_stored_session(app, db):
+    client = app.test_client()
+    client.get('/login/user-1')
+    client.get('/logout')
+
+    assert _session_ids(db) == []
+    assert client.get_cookie('session') is None
+    assert client.get('/whoami').text == ''
+
+
+def test_permissions_come_from_the_user_cache_not_the_session(db):
+    user_id = db.create_user('alice', 'Secret-pass1', 'alice@example.com')
+    assert 'manage_users' not in db.user_cache.get(user_id)[1]
+
+    assert db.assign_role_to_user(user_id, 'admin')
+
+    assert db.user_cache.get(user_id)[1].get('manage_users')
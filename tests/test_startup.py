@@ -0,0 +1,38 @@
+import os
+
+import database
+from encryption_keys import Keyring, _derive_key
+
+
+def test_database_is_created_on_first_use(db_path, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, '_db', None)
+
+    first = database.get_db(db_path)
+    try:
+        assert database.get_db() is first
+        assert database.db is first
+    finally:
+        first.close()
+
+
+def test_keys_are_loaded_on_first_use(db):
+    assert db._keyring is None
+    assert not os.path.exists('secret.key')
+
+    ciphertext = db._encrypt_sensitive_data('value')
+
+    assert db._keyring is not None
+    assert os.path.exists('secret.key')
+    assert db._decrypt_sensitive_data(ciphertext) == 'value'
+
+
+def test_key_derivation_runs_once_per_secret(tmp_path):
+    secret = os.urandom(32)
+    keyring_file = str(tmp_path / 'keyring.json')
+    Keyring(secret, keyring_file=keyring_file)
+    misses = _derive_key.cache_info().misses
+
+    Keyring(secret, keyring_file=keyring_file)
+
+    assert _derive_key.cache_info().misses == misses
@@ -0,0 +1,7 @@
+def test_removing_the_last_role_falls_back_to_basic_user(db):
+    user_id = db.create_user('alice', 'Secret-pass1', 'alice@example.com', roles=[{'role': 'admin'}])
+    assert user_id
+
+    assert db.remove_role_from_user(user_id, 'admin')
+
+    assert db.get_user_roles(user_id) == ['basic_user']
@@ -0,0 +1,70 @@
+import pytest
+
+
+def test_get_users_hydrates_roles_and_permissions_in_order(db):
+    alice = db.create_user('alice', 'Secret-pass1', 'alice@example.com', full_name='Alice', roles=[
+        {'role': 'admin', 'permissions': ['manage_users', 'manage_roles']},
+        {'role': 'basic_user'},
+    ])
+    bob = db.create_user('bob', 'Secret-pass1', 'bob@example.com')
+
+    # One id per chunk, with a duplicate and an unknown id
+    users = db.get_users([alice, bob, alice, 'no-such-user'], chunk_size=1)
+
+    assert set(users) == {alice, bob}
+    assert users[alice]['username'] == 'alice'
+    assert users[alice]['full_name'] == 'Alice'
+    assert users[alice]['roles'] == [
+        {'role': 'admin', 'permissions': ['manage_users', 'manage_roles']},
+        {'role': 'basic_user', 'permissions': []},
+    ]
+    assert users[bob]['roles'] == []
+    assert set(users[bob]) == {'id', 'username', 'full_name', 'email', 'bio', 'profile_pic',
+                               'created_at', 'updated_at', 'roles'}
+    assert 'password' not in users[bob]
+
+
+def test_get_user_matches_get_users(db):
+    user_id = db.create_user('carol', 'Secret-pass1', 'carol@example.com', roles=[{'role': 'admin'}])
+
+    assert db.get_user(user_id) == db.get_users([user_id])[user_id]
+    assert db.get_user('no-such-user') is None
+
+
+def _page_through(db, **options):
+    ids, cursor = [], None
+    while True:
+        page = db.list_users(limit=2, cursor=cursor, **options)
+        ids += [user['id'] for user in page['users']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            return ids
+
+
+def test_list_users_pages_cover_every_user_once(db):
+    # Shared full names exercise the id tie-breaker
+    names = {'dave': 'Same', 'erin': 'Same', 'frank': 'Same', 'grace': None, 'heidi': 'Alpha'}
+    ids = {name: db.create_user(name, 'Secret-pass1', f'{name}@example.com', full_name=full_name,
+                                roles=[{'role': 'admin'}] if name in ('erin', 'heidi') else None)
+           for name, full_name in names.items()}
+
+    assert _page_through(db) == [ids[name] for name in sorted(names)]
+    assert _page_through(db, descending=True) == [ids[name] for name in sorted(names, reverse=True)]
+
+    by_full_name = _page_through(db, sort='full_name')
+    assert sorted(by_full_name) == sorted(ids.values())
+    assert by_full_name[:2] == [ids['grace'], ids['heidi']]
+
+    assert _page_through(db, role='admin') == [ids['erin'], ids['heidi']]
+    assert _page_through(db, search='RAN') == [ids['frank']]
+
+
+def test_list_users_rejects_a_cursor_from_another_sort(db):
+    for name in ('ivan', 'judy', 'mallory'):
+        db.create_user(name, 'Secret-pass1', f'{name}@example.com')
+    cursor = db.list_users(limit=1)['next_cursor']
+
+    with pytest.raises(ValueError):
+        db.list_users(limit=1, cursor=cursor, sort='email')
+    with pytest.raises(ValueError):
+        db.list_users(limit=1, cursor='not a cursor')
@@ -0,0 +1,97 @@
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+
+class UserCache:
+    """Short-lived cache of users and their permissions for the current-user loader
+
+    Entries are keyed by user id and remember the user's updated_at and the
+    permission epoch they were loaded under. Within ``ttl`` seconds an entry
+    is served as is. After that it is revalidated by reading only
+    updated_at, an indexed primary-key lookup, and reloaded in full only if
+    the user row or any role has changed. Writes made through Database
+    invalidate the entry straight away.
+    """
+
+    def __init__(self, db, ttl=2.0, max_size=10000):
+        """Initialize the cache
+
+        Args:
+            db (Database): Database the users and permissions are loaded from
+            ttl (float, optional): Seconds an entry is trusted without revalidation. Defaults to 2.
+            max_size (int, optional): Maximum cached users. Defaults to 10000.
+        """
+        self.db = db
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # user_id -> [user, permissions, updated_at, epoch, checked_at]
+
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """Get a user and their permissions
+
+        Returns:
+            tuple: (user, permissions) as fresh dicts; (None, {}) if the user does not exist
+        """
+        now = time.monotonic()
+        epoch = self.db.permissions.current_epoch()
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[3] == epoch and now - entry[4] < self.ttl:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return dict(entry[0]), dict(entry[1])
+
+        if entry is not None and entry[3] == epoch:
+            try:
+                with self.db.connection() as conn:
+                    row = conn.execute("SELECT updated_at FROM users WHERE id = ?", (user_id,)).fetchone()
+            except sqlite3.Error as e:
+                logging.error(f"Error revalidating cached user: {str(e)}")
+                row = None
+            if row is not None and row[0] == entry[2]:
+                with self._lock:
+                    entry[4] = now
+                    self.revalidations += 1
+                return dict(entry[0]), dict(entry[1])
+
+        with self._lock:
+            self.misses += 1
+        user = self.db.get_user(user_id)
+        if user is None:
+            self.invalidate(user_id)
+            return None, {}
+        permissions = self.db.get_user_permissions(user_id)
+
+        with self._lock:
+            self._entries[user_id] = [user, permissions, user['updated_at'], epoch, now]
+            self._entries.move_to_end(user_id)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return dict(user), dict(permissions)
+
+    def invalidate(self, user_id):
+        """Drop a user after a write so the next request reloads them"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        """Get hit, revalidation and miss counters"""
+        with self._lock:
+            lookups = self.hits + self.revalidations + self.misses
+            return {
+                'cached_users': len(self._entries),
+                'hits': self.hits,
+                'revalidations': self.revalidations,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.revalidations) / lookups if lookups else 0.0,
+            }